@@ -6,6 +6,7 @@ from pathlib import Path
 import os
 BASE_DIR = Path(os.environ["BMCVN_BASE"])
 import sys, json
+import hmac
 import uuid
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
@@ -16,9 +17,18 @@ from pathlib import Path
 from run.main import BASE_DIR, KB
 from logger_img_csv.logger_img import log_image_analysis  # Import log_image_analysis function
 from rag.config import RAGConfig
-from rag.kb_loader import load_npz
-from rag.pipeline import answer_with_suggestions_stream
+from rag.kb_registry import kb_registry
+from rag.embedder import embedding_cache
+from rag.retrieval_cache import retrieval_cache
+from rag.llm_cache import llm_cache
+from rag.tag_filter import tag_cache_stats, ontology_registry
+from rag.pipeline import answer_with_suggestions_stream, answer_with_suggestions_stream_coalesced, coalesce_stats
+from rag.post_answer.solution_completion import warm_t4_slots
+from rag.llm_client import get_client, pool_stats
 openai.api_key = '...'
+# Client OpenAI dùng chung (pool + keep-alive) cho pipeline và endpoint ảnh; mỗi worker
+# tạo pool riêng ở lần get_client() đầu tiên (sau fork)
+get_client(api_key=openai.api_key)
 
 # thêm path để import module rag
 BASE_DIR = Path(os.getenv("BMCVN_BASE", Path(__file__).parent.parent))
@@ -27,6 +37,20 @@ UPLOAD_FOLDER = BASE_DIR / "uploads"
 CSV_PATH = BASE_DIR / "rag_logs.csv"
 KB_PATH = BASE_DIR / "data-kd-1-4-1-2-2026-focus-product.npz"
 
+# Load KB 1 lần khi worker khởi động, mọi request dùng chung instance này
+kb_registry.load(KB_PATH)
+# Slot query tĩnh của T4: embed + tính sims 1 lần cho KB này
+if RAGConfig.t4_slot_precompute:
+    warm_t4_slots(get_client(), kb_registry.get())
+
+# Ontology tag_filter: load sẵn + reload nóng khi nhận signal (kill -HUP <pid>)
+ontology_registry.get()
+if RAGConfig.ontology_reload_signal:
+    ontology_registry.install_signal(RAGConfig.ontology_reload_signal)
+
+# Token cho các route /admin/* (không đặt → tắt admin)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
 # Cấu hình Flask
 app = Flask(__name__)
 
@@ -132,7 +156,7 @@ def analyze_image_with_gpt4v(image_path): # Phân tích ảnh với GPT-4 Vision
 
 
     # Gọi GPT-4 Vision API
-    response = openai.chat.completions.create(
+    response = get_client().chat.completions.create(
         model="gpt-4.1",  # Dùng mô hình 4.1 để bắt hình ảnh tốt hơn
         messages=[
             {
@@ -184,7 +208,7 @@ def diagnose_from_image(client, q: str, image_base64: str) -> dict:
         f"Schema mẫu (chỉ để tham chiếu):\n{DIAG_SCHEMA_HINT}"
     )
 
-    response = openai.chat.completions.create(
+    response = get_client().chat.completions.create(
         model="gpt-4.1-mini",
         temperature=0,
         messages=[
@@ -214,16 +238,16 @@ def process_with_rag_stream(user_id, description):
         return
 
     user_query = description
-    openai.api_key = openai.api_key
-    client = openai
-    kb = load_npz(str(KB_PATH))
+    client = get_client()
+    kb = kb_registry.get()
     cfg = RAGConfig()
     policy = PolicyV7()
 
     full_text = ""
 
-    # gọi streaming
-    for chunk in answer_with_suggestions_stream(
+    # gọi streaming (câu hỏi giống nhau đang chạy đồng thời → dùng chung 1 lượt pipeline)
+    stream = answer_with_suggestions_stream_coalesced if RAGConfig.coalesce_inflight else answer_with_suggestions_stream
+    for chunk in stream(
         user_id=user_id,
         user_query=user_query,
         kb=kb,
@@ -275,7 +299,7 @@ def upload_stream():
     final_query = None
     if has_file and user_query:
         image_base64 = encode_image_to_base64(file_path)
-        diag_json = diagnose_from_image(client=openai, q=user_query, image_base64=image_base64)
+        diag_json = diagnose_from_image(client=get_client(), q=user_query, image_base64=image_base64)
         product_query = build_product_query_from_diag(diag_json)
         final_query = product_query
     elif has_file:
@@ -296,6 +320,38 @@ def upload_stream():
     resp.headers["X-Accel-Buffering"] = "no"  # nginx: tắt buffer nếu có
     return resp
 
+@app.route('/kb_stats')
+def kb_stats():
+    return jsonify(kb_registry.stats())
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify({
+        "embedding": embedding_cache.stats(),
+        "retrieval": retrieval_cache.stats(),
+        "tag_filter": tag_cache_stats(),
+        "llm": llm_cache.stats(),
+        "coalesce": coalesce_stats(),
+    })
+
+@app.route('/llm_stats')
+def llm_stats():
+    return jsonify(pool_stats())
+
+@app.route('/ontology_stats')
+def ontology_stats():
+    return jsonify(ontology_registry.stats())
+
+@app.route('/admin/reload_ontology', methods=['POST'])
+def admin_reload_ontology():
+    if not ADMIN_TOKEN or not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        return jsonify({"error": "forbidden"}), 403
+    try:
+        onto = ontology_registry.reload()
+    except Exception as e:
+        return jsonify({"error": str(e), "version": ontology_registry.version}), 500
+    return jsonify({"version": onto.version, **ontology_registry.stats()})
+
 @app.route('/')
 def index():
     return render_template('./index.html') 
@@ -0,0 +1,70 @@
+"""
+Matcher alias nhiều pattern (Aho-Corasick trên token) cho tag_filter.
+
+Alias và query đều được normalize rồi tách theo khoảng trắng → alias khớp khi
+dãy token của nó xuất hiện liên tiếp trong query, đúng ngữ nghĩa word-boundary
+của match_aliases() cũ (regex (?:^|\\s)alias(?:\\s|$)).
+
+Automaton build 1 lần cho mỗi normalizer (gộp nhiều bảng alias, mỗi bảng là
+1 group); match() quét query 1 lượt, chi phí không phụ thuộc kích thước bảng alias.
+"""
+from collections import deque
+from typing import Callable, Dict, List, Set
+
+
+class AliasMatcher:
+    def __init__(self, tables: Dict[str, Dict[str, List[str]]], normalizer: Callable[[str], str]):
+        self.normalizer = normalizer
+        self.groups = tuple(tables)
+
+        goto = [{}]      # node -> {token: node}
+        out = [set()]    # node -> {(group, key)}
+        for group, aliases in tables.items():
+            for key, variants in aliases.items():
+                for v in variants:
+                    tokens = normalizer(v).split()
+                    if not tokens:
+                        continue
+                    node = 0
+                    for t in tokens:
+                        nxt = goto[node].get(t)
+                        if nxt is None:
+                            nxt = len(goto)
+                            goto.append({})
+                            out.append(set())
+                            goto[node][t] = nxt
+                        node = nxt
+                    out[node].add((group, key))
+
+        # failure link: suffix dài nhất cũng là prefix trong trie (BFS theo độ sâu)
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for t, child in goto[node].items():
+                f = fail[node]
+                while f and t not in goto[f]:
+                    f = fail[f]
+                fail[child] = goto[f].get(t, 0)
+                out[child] |= out[fail[child]]
+                queue.append(child)
+
+        self._goto = goto
+        self._fail = fail
+        self._out = [tuple(o) for o in out]
+
+    def __len__(self):
+        return len(self._goto)
+
+    def match(self, text: str) -> Dict[str, Set[str]]:
+        """Trả về {group: set(key)} cho mọi alias xuất hiện trong text."""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = {g: set() for g in self.groups}
+        node = 0
+        for t in self.normalizer(text).split():
+            while node and t not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(t, 0)
+            for group, key in out[node]:
+                found[group].add(key)
+        return found
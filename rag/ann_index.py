@@ -0,0 +1,195 @@
+"""
+ANN backend (FAISS HNSW / IVF) cho retriever.
+
+ANN chỉ dùng để lấy ứng viên (over-fetch); điểm cuối cùng luôn được tính lại
+exact float32 trên EMBS, rồi mới qua các stage tag filter của search().
+
+Báo cáo recall / latency so với exact trên KB thật:
+    python -m rag.ann_index data-kd-1-4-1-2-2026-focus-product.npz --backend hnsw
+"""
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:  # faiss-cpu là optional cho backend ANN
+    faiss = None
+
+from rag.config import RAGConfig
+
+ANN_BACKENDS = ("hnsw", "ivf")
+
+
+class AnnIndex:
+    def __init__(self, index, kind: str):
+        self.index = index
+        self.kind = kind
+        self.ntotal = int(index.ntotal)
+
+    @classmethod
+    def build(cls, embs: np.ndarray, kind: str = "hnsw") -> "AnnIndex":
+        if faiss is None:
+            raise RuntimeError("faiss-cpu is required for the ANN retrieval backend")
+        if kind not in ANN_BACKENDS:
+            raise ValueError(f"Unknown ANN backend {kind!r}, expected one of {ANN_BACKENDS}")
+
+        x = np.ascontiguousarray(np.asarray(embs, dtype=np.float32))
+        n, d = x.shape
+
+        if kind == "hnsw":
+            index = faiss.IndexHNSWFlat(d, int(RAGConfig.ann_hnsw_m), faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = int(RAGConfig.ann_ef_construction)
+            index.add(x)
+        else:
+            nlist = max(1, min(int(RAGConfig.ann_ivf_nlist) or int(np.sqrt(n)), n))
+            quantizer = faiss.IndexFlatIP(d)
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(x)
+            index.add(x)
+
+        ann = cls(index, kind)
+        ann.configure()
+        return ann
+
+    @classmethod
+    def load(cls, path) -> "AnnIndex":
+        if faiss is None:
+            raise RuntimeError("faiss-cpu is required for the ANN retrieval backend")
+        index = faiss.read_index(str(path))
+        kind = "ivf" if isinstance(index, faiss.IndexIVF) else "hnsw"
+        ann = cls(index, kind)
+        ann.configure()
+        return ann
+
+    def save(self, path):
+        faiss.write_index(self.index, str(path))
+
+    def configure(self):
+        if self.kind == "hnsw":
+            self.index.hnsw.efSearch = int(RAGConfig.ann_ef_search)
+        else:
+            self.index.nprobe = int(RAGConfig.ann_ivf_nprobe)
+
+    def candidates(self, Q: np.ndarray, k: int) -> np.ndarray:
+        """Q [m, d] → doc ids [m, k] (-1 nếu index trả thiếu)."""
+        k = max(1, min(int(k), self.ntotal))
+        Q = np.ascontiguousarray(np.asarray(Q, dtype=np.float32).reshape(-1, self.index.d))
+        _, I = self.index.search(Q, k)
+        return I
+
+
+def fetch_k_for(top_k: int) -> int:
+    return max(int(RAGConfig.ann_min_candidates), int(RAGConfig.ann_overfetch) * int(top_k))
+
+
+def build_ann_index(embs, path=None, kind=None):
+    """
+    Build (hoặc load file .faiss build offline nếu có) theo RAGConfig.retrieval_backend.
+    Trả về None khi backend = "exact".
+    """
+    kind = kind or RAGConfig.retrieval_backend
+    if kind == "exact":
+        return None
+    if path is not None and Path(path).exists():
+        ann = AnnIndex.load(path)
+        if ann.ntotal != len(embs):
+            raise ValueError(f"ANN index {path} has {ann.ntotal} vectors, KB has {len(embs)}")
+        return ann
+    return AnnIndex.build(embs, kind)
+
+
+# ===========================
+# Recall vs latency report
+# ===========================
+
+def sample_queries(embs: np.ndarray, num_queries: int = 200, seed: int = 0) -> np.ndarray:
+    """
+    Query = embedding của chính các doc trong KB (lấy mẫu) trộn cặp, chuẩn hoá lại
+    → gần với phân bố câu hỏi thật mà không cần gọi API.
+    """
+    n = embs.shape[0]
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, n, size=num_queries)
+    b = rng.integers(0, n, size=num_queries)
+    Q = embs[a] + 0.5 * embs[b]
+    return Q / (np.linalg.norm(Q, axis=1, keepdims=True) + 1e-8)
+
+
+def candidate_report(embs, index, fetch_k, top_ks=(10, 20, 40), num_queries: int = 200, seed: int = 0):
+    """
+    So sánh 1 candidate index (ANN / quantized) + rescore exact với brute force exact.
+    recall = overlap top-k trung bình; latency gồm cả bước rescore exact.
+    """
+    embs = np.ascontiguousarray(np.asarray(embs, dtype=np.float32))
+    n = embs.shape[0]
+    Q = sample_queries(embs, num_queries, seed)
+
+    rows = []
+    for k in top_ks:
+        k = min(k, n)
+        exact_ms, cand_ms, recalls = [], [], []
+        for q in Q:
+            t0 = time.perf_counter()
+            sims = embs @ q
+            exact = np.argpartition(-sims, k - 1)[:k]
+            exact_ms.append((time.perf_counter() - t0) * 1000)
+
+            t0 = time.perf_counter()
+            cand = index.candidates(q, fetch_k(k))[0]
+            cand = cand[cand >= 0]
+            cs = embs[cand] @ q
+            got = cand[np.argsort(-cs)[:k]]
+            cand_ms.append((time.perf_counter() - t0) * 1000)
+
+            recalls.append(len(set(exact.tolist()) & set(got.tolist())) / k)
+
+        rows.append({
+            "top_k": k,
+            "fetch_k": fetch_k(k),
+            "recall": round(float(np.mean(recalls)), 4),
+            "exact_p50_ms": round(float(np.percentile(exact_ms, 50)), 3),
+            "exact_p99_ms": round(float(np.percentile(exact_ms, 99)), 3),
+            "cand_p50_ms": round(float(np.percentile(cand_ms, 50)), 3),
+            "cand_p99_ms": round(float(np.percentile(cand_ms, 99)), 3),
+        })
+    return rows
+
+
+def print_report(title: str, rows):
+    print(title)
+    print(f"{'top_k':>6} {'fetch_k':>8} {'recall':>8} {'exact p50/p99 ms':>18} {'approx p50/p99 ms':>19}")
+    for r in rows:
+        print(
+            f"{r['top_k']:>6} {r['fetch_k']:>8} {r['recall']:>8.4f} "
+            f"{r['exact_p50_ms']:>8.3f}/{r['exact_p99_ms']:<9.3f} {r['cand_p50_ms']:>9.3f}/{r['cand_p99_ms']:<9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    from rag.kb_loader import load_kb
+
+    parser = argparse.ArgumentParser(description="Build an ANN index for a KB, or compare ANN vs exact retrieval")
+    parser.add_argument("kb", help="KB path (.npz or .kbcol directory)")
+    parser.add_argument("--backend", default="hnsw", choices=ANN_BACKENDS)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--save", default=None, help="write the built index to this .faiss file")
+    args = parser.parse_args()
+
+    EMBS = load_kb(args.kb)[0]
+
+    t0 = time.perf_counter()
+    ann = AnnIndex.build(EMBS, args.backend)
+    build_s = time.perf_counter() - t0
+
+    if args.save:
+        ann.save(args.save)
+        print(f"[ANN] saved {args.backend} index -> {args.save}")
+
+    rows = candidate_report(EMBS, ann, fetch_k_for, num_queries=args.queries)
+    print_report(
+        f"[ANN REPORT] backend={args.backend} docs={len(EMBS)} dim={EMBS.shape[1]} build={build_s:.3f}s",
+        rows,
+    )
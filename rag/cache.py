@@ -0,0 +1,139 @@
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    LRU in-process, thread-safe, giới hạn số phần tử, TTL tuỳ chọn.
+    Đếm hits/misses để monitoring.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl_seconds: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl_seconds
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()   # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires_at = (time.time() + self.ttl) if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class SqliteKV:
+    """
+    Key-value bền (qua restart) trên SQLite: key TEXT → value BLOB.
+    Lỗi I/O chỉ log và coi như miss — cache không bao giờ làm hỏng request.
+    """
+
+    def __init__(self, path, table: str = "kv", ttl_seconds: Optional[float] = None):
+        self.path = Path(path)
+        self.table = table
+        self.ttl = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = None
+        self.disabled = False
+
+    def _connect(self):
+        if self._conn is None and not self.disabled:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                conn = sqlite3.connect(str(self.path), check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.table} "
+                    "(k TEXT PRIMARY KEY, v BLOB NOT NULL, ts REAL NOT NULL)"
+                )
+                conn.commit()
+                self._conn = conn
+            except Exception as e:
+                print(f"[CACHE DISK ERROR] {self.path}: {e}")
+                self.disabled = True
+        return self._conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return None
+            try:
+                row = conn.execute(f"SELECT v, ts FROM {self.table} WHERE k = ?", (key,)).fetchone()
+            except Exception as e:
+                print("[CACHE DISK ERROR]", e)
+                return None
+        if row is None:
+            return None
+        value, ts = row
+        if self.ttl and ts + self.ttl < time.time():
+            return None
+        return value
+
+    def put(self, key: str, value: bytes):
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (k, v, ts) VALUES (?, ?, ?)",
+                    (key, sqlite3.Binary(value), time.time()),
+                )
+                conn.commit()
+            except Exception as e:
+                print("[CACHE DISK ERROR]", e)
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                conn.execute(f"DELETE FROM {self.table}")
+                conn.commit()
+            except Exception as e:
+                print("[CACHE DISK ERROR]", e)
@@ -1,28 +1,41 @@
-import json
 import re
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 KB_PATH = BASE_DIR / "chemical_tags_from_kb.json"
 
-CHEMICALS = []
+_CHEMICALS = None
+_CHEMICAL_REGEX = None
 
 def load_chemicals():
-    global CHEMICALS
+    global _CHEMICALS
 
+    # dùng chung ontology (snapshot) với rag.tag_filter, không parse JSON lần 2
     if KB_PATH.exists():
-        with open(KB_PATH, "r", encoding="utf-8") as f:
-            CHEMICALS = json.load(f)
+        from rag.tag_filter import get_ontology
+        _CHEMICALS = get_ontology().chemical_kb
     else:
-        CHEMICALS = []
+        _CHEMICALS = []
+    return _CHEMICALS
 
-# Load ngay khi module được import
-load_chemicals()
+def chemical_regex():
+    """Regex cho toàn bộ hoạt chất, build lười ở lần dùng đầu tiên."""
+    global _CHEMICAL_REGEX
 
-# Tạo regex động cho toàn bộ hoạt chất
-if CHEMICALS:
-    CHEMICAL_REGEX = re.compile(
-        r"\b(" + "|".join(re.escape(c.lower()) for c in CHEMICALS) + r")\b"
-    )
-else:
-    CHEMICAL_REGEX = re.compile(r"$^")   # không match gì nếu file rỗng
\ No newline at end of file
+    if _CHEMICAL_REGEX is None:
+        chemicals = _CHEMICALS if _CHEMICALS is not None else load_chemicals()
+        if chemicals:
+            _CHEMICAL_REGEX = re.compile(
+                r"\b(" + "|".join(re.escape(c.lower()) for c in chemicals) + r")\b"
+            )
+        else:
+            _CHEMICAL_REGEX = re.compile(r"$^")   # không match gì nếu file rỗng
+    return _CHEMICAL_REGEX
+
+def __getattr__(name):
+    # CHEMICALS / CHEMICAL_REGEX cũ vẫn dùng được, nhưng chỉ load khi truy cập
+    if name == "CHEMICALS":
+        return _CHEMICALS if _CHEMICALS is not None else load_chemicals()
+    if name == "CHEMICAL_REGEX":
+        return chemical_regex()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,114 @@
+"""
+Single-flight: các request đồng thời có cùng key dùng chung 1 lần chạy upstream
+(1 generator token), token được phát lại cho mọi request đang chờ.
+
+    flight = flights.join(key, lambda: upstream_generator(...))
+    result = yield from flight.stream()      # yield từng token, return = giá trị return của upstream
+
+- Upstream chạy trên thread riêng của flight, không thuộc request nào → client đầu tiên
+  ngắt kết nối thì các request còn lại vẫn nhận đủ câu trả lời.
+- Request join giữa chừng nhận lại từ token đầu (buffer giữ tới khi flight xong).
+- Flight xong là bị gỡ khỏi bảng → request sau đó chạy lượt mới (không phải cache).
+- Upstream lỗi → mọi request của flight nhận lại exception sau các token đã có.
+"""
+import threading
+from typing import Callable, Dict, Generator, Hashable
+
+
+class Flight:
+    def __init__(self, key: Hashable):
+        self.key = key
+        self.tokens = []
+        self.done = False
+        self.result = None
+        self.error = None
+        self.subscribers = 1
+        self._cond = threading.Condition()
+
+    def _run(self, upstream: Generator, on_done: Callable[["Flight"], None]):
+        try:
+            for tok in _drain(upstream, self):
+                with self._cond:
+                    self.tokens.append(tok)
+                    self._cond.notify_all()
+        except BaseException as e:
+            self.error = e
+        finally:
+            on_done(self)
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+
+    def stream(self):
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self.tokens) and not self.done:
+                    self._cond.wait()
+                batch = self.tokens[i:]
+                finished = self.done
+            i += len(batch)
+            yield from batch
+            if finished:
+                break
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _drain(upstream: Generator, flight: Flight):
+    # như `yield from` nhưng giữ lại giá trị return của upstream vào flight.result
+    flight.result = yield from upstream
+
+
+class SingleFlight:
+    def __init__(self, name: str = "flight"):
+        self.name = name
+        self._flights: Dict[Hashable, Flight] = {}
+        self._lock = threading.Lock()
+        self.flights = 0
+        self.coalesced = 0
+
+    def join(self, key: Hashable, start: Callable[[], Generator]) -> Flight:
+        """Flight đang chạy cho key (nếu có), không thì tạo flight mới chạy start()."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.subscribers += 1
+                self.coalesced += 1
+                return flight
+            flight = Flight(key)
+            self._flights[key] = flight
+            self.flights += 1
+
+        try:
+            upstream = start()
+            threading.Thread(
+                target=flight._run, args=(upstream, self._forget),
+                name=f"rag-{self.name}", daemon=True,
+            ).start()
+        except BaseException as e:
+            flight.error = e
+            self._forget(flight)
+            with flight._cond:
+                flight.done = True
+                flight._cond.notify_all()
+        return flight
+
+    def _forget(self, flight: Flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = len(self._flights)
+            waiting = sum(f.subscribers for f in self._flights.values())
+        total = self.flights + self.coalesced
+        return {
+            "in_flight": in_flight,
+            "waiting_requests": waiting,
+            "flights": self.flights,
+            "coalesced": self.coalesced,
+            "coalesce_rate": round(self.coalesced / total, 4) if total else 0.0,
+        }
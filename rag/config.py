@@ -10,6 +10,7 @@ class RAGConfig:
     # layer 4 result
     enable_t4_solution_completion = True
     t4_top_k = 12
+    t4_slot_precompute = True        # tag + sims của slot query T4 tính sẵn theo KB (không embed lúc request)
 
     # Multi-hop
     multi_hop_top_k = 20
@@ -18,6 +19,74 @@ class RAGConfig:
     enable_multi_query_log = True
     multi_hop_stop_threshold = 80
 
+    # Embedding cache (LRU trong process + SQLite float16 trên đĩa)
+    embedding_cache_size = 4096
+    embedding_cache_disk = True
+
+    # Retrieval backend: "exact" (brute force) | "hnsw" | "ivf" (FAISS, rag/ann_index.py)
+    # ANN chỉ lấy ứng viên, điểm cuối luôn rescore exact float32
+    retrieval_backend = "exact"
+    ann_index_path = None            # file .faiss build offline (None → build lúc load KB)
+    ann_overfetch = 8                # fetch_k = max(ann_min_candidates, ann_overfetch * top_k)
+    ann_min_candidates = 200
+    ann_hnsw_m = 32
+    ann_ef_construction = 200
+    ann_ef_search = 128
+    ann_ivf_nlist = 0                # 0 → sqrt(N)
+    ann_ivf_nprobe = 16
+
+    # Embedding lượng tử cho lượt quét đầu: None | "fp16" | "int8" (rag/quantize.py)
+    # top quantized_rescore_k ứng viên được rescore exact float32
+    embedding_quantization = None
+    quantized_rescore_k = 300
+
+    # Cache kết quả retrieval (rag/retrieval_cache.py), key gồm fingerprint nội dung KB
+    # 0 → tắt
+    retrieval_cache_size = 2048
+    retrieval_cache_ttl = 3600
+
+    # Cache câu trả lời LLM của helper tất định (rag/llm_cache.py): normalize, intent,
+    # rewrite, infer_* recovery, expand_query, L3 gap. 0 → tắt
+    llm_cache_size = 4096
+    llm_cache_ttl = 86400
+    llm_cache_disk = False           # True → thêm tầng SQLite ở cache/llm_responses.sqlite
+    llm_cache_helpers = None         # None → mọi helper; hoặc set tên helper được cache
+
+    # Cache tag_filter_pipeline theo query đã normalize (rag/tag_filter.py)
+    tag_filter_cache_size = 4096
+
+    # Ontology tag_filter đã compile sẵn ở cache/ontology.pkl (rag/ontology.py)
+    ontology_snapshot = True
+    # Reload nóng ontology + bảng alias khi worker nhận signal này (None → tắt)
+    ontology_reload_signal = "SIGHUP"
+
+    # Sửa chính tả entity cục bộ (rag/fuzzy_alias.py); chắc chắn thì bỏ qua LLM normalize
+    local_normalize_skip_llm = True
+
+    # Thread pool chạy song song các stage độc lập của pipeline (rag/stage_graph.py)
+    stage_graph_workers = 16
+    # Thread chạy các bước helper sync của pipeline async (answer_with_suggestions_astream)
+    async_pipeline_workers = 32
+    # Việc nền (tóm tắt + ghi memory): tuần tự theo user, song song giữa các user
+    background_workers = 4
+    background_queue_max = 1000      # quá số job chờ này → bỏ job mới (log BACKGROUND DROPPED)
+    memory_write_wait = 2.0          # read_memory chờ tối đa (giây) memory của lượt trước cùng user
+    # Gộp các câu hỏi giống nhau đang chạy đồng thời thành 1 lượt pipeline (rag/coalesce.py)
+    coalesce_inflight = True
+    # Deadline (giây) cho các LLM sinh giả thuyết của no_hit_recovery_pipeline (chạy song song)
+    recovery_llm_timeout = 20
+
+    # Client OpenAI dùng chung cho worker (rag/llm_client.py): pool + keep-alive
+    llm_max_connections = 100
+    llm_max_keepalive_connections = 20
+    llm_keepalive_expiry = 60.0
+    llm_connect_timeout = 5.0
+    llm_timeout = 120.0
+    # Timeout đọc (giây) theo loại call; stream = thời gian chờ tối đa giữa 2 chunk
+    llm_call_timeouts = {"embeddings": 20.0, "chat": 60.0, "stream": 120.0, "vision": 90.0}
+    # HTTP/2 (multiplex nhiều request trên 1 kết nối) — cần package h2, thiếu thì dùng HTTP/1.1
+    llm_http2 = False
+
     min_score_main: float = 0.35
     """
     1️⃣ min_score_main: float = 0.35
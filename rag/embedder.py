@@ -1,11 +1,110 @@
 # rag/embedder.py
+import re
+import unicodedata
+from pathlib import Path
+
 import numpy as np
 
+from rag.cache import LRUCache, SqliteKV
+from rag.config import RAGConfig
+
+EMBED_MODEL = "text-embedding-3-small"
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+EMBED_CACHE_PATH = BASE_DIR / "cache" / "embeddings.sqlite"
+
+_space_re = re.compile(r"\s+")
+
+
+def _cache_text(text: str) -> str:
+    # chỉ chuẩn hoá những gì không đổi nghĩa: unicode NFC + khoảng trắng
+    return _space_re.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+class EmbeddingCache:
+    """
+    Cache embedding 2 tầng, key = (model, text đã chuẩn hoá):
+    - tầng 1: LRU trong process (float32)
+    - tầng 2: SQLite trên đĩa (float16) → worker restart vẫn còn
+    """
+
+    def __init__(self, maxsize: int, disk_path=None):
+        self.mem = LRUCache(maxsize=maxsize)
+        self.disk = SqliteKV(disk_path, table="embeddings") if disk_path else None
+        self.disk_hits = 0
+
+    def get(self, model: str, text: str):
+        key = (model, _cache_text(text))
+        v = self.mem.get(key)
+        if v is not None:
+            return v
+        if self.disk is None:
+            return None
+        blob = self.disk.get(f"{key[0]}\x1f{key[1]}")
+        if blob is None:
+            return None
+        v = np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+        v = v / (np.linalg.norm(v) + 1e-8)
+        self.disk_hits += 1
+        self.mem.put(key, v)
+        return v
+
+    def put(self, model: str, text: str, v: np.ndarray):
+        key = (model, _cache_text(text))
+        self.mem.put(key, v)
+        if self.disk is not None:
+            self.disk.put(f"{key[0]}\x1f{key[1]}", v.astype(np.float16).tobytes())
+
+    def stats(self) -> dict:
+        s = self.mem.stats()
+        # miss ở LRU nhưng trúng đĩa vẫn là hit (không phải gọi API)
+        s["disk_hits"] = self.disk_hits
+        s["api_misses"] = s["misses"] - self.disk_hits
+        s["disk_enabled"] = self.disk is not None and not self.disk.disabled
+        return s
+
+
+embedding_cache = EmbeddingCache(
+    maxsize=int(getattr(RAGConfig, "embedding_cache_size", 4096)),
+    disk_path=EMBED_CACHE_PATH if getattr(RAGConfig, "embedding_cache_disk", True) else None,
+)
+
+
 def embed_text(client, text: str):
+    cached = embedding_cache.get(EMBED_MODEL, text)
+    if cached is not None:
+        return cached
+
     resp = client.embeddings.create(
-        model="text-embedding-3-small",
+        model=EMBED_MODEL,
         input=[text],
     )
     v = np.array(resp.data[0].embedding, dtype=np.float32)
     v = v / (np.linalg.norm(v) + 1e-8)
+    embedding_cache.put(EMBED_MODEL, text, v)
     return v
+
+def embed_texts(client, texts):
+    """
+    Embed nhiều text trong 1 lần gọi API → ma trận [len(texts), dim], mỗi dòng đã chuẩn hoá.
+    Text đã có trong cache không gửi lên API.
+    """
+    texts = list(texts)
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    vecs = [embedding_cache.get(EMBED_MODEL, t) for t in texts]
+    missing = [i for i, v in enumerate(vecs) if v is None]
+
+    if missing:
+        resp = client.embeddings.create(
+            model=EMBED_MODEL,
+            input=[texts[i] for i in missing],
+        )
+        M = np.array([d.embedding for d in resp.data], dtype=np.float32)
+        M = M / (np.linalg.norm(M, axis=1, keepdims=True) + 1e-8)
+        for i, v in zip(missing, M):
+            vecs[i] = v
+            embedding_cache.put(EMBED_MODEL, texts[i], v)
+
+    return np.vstack(vecs)
@@ -0,0 +1,144 @@
+"""
+Sửa lỗi chính tả token entity theo kiểu SymSpell (symmetric delete) trên
+từ vựng alias của tag_filter + ontology hoá chất, vd. "metalaxi" -> "metalaxyl".
+
+Chỉ sửa khi có đúng 1 ứng viên tốt nhất và ứng viên đó là tên riêng (targets: hoạt chất,
+sản phẩm...), không phải từ tiếng Việt thường (vd. "chiet" gần "chet" nhưng không được
+sửa thành "chết"); token không sửa được (không có ứng viên, mơ hồ, gần từ thường, hoặc
+người dùng đã gõ có dấu) được báo lại để caller quyết định (vd. vẫn gọi LLM normalize).
+"""
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+MIN_TOKEN_LEN = 5
+
+
+def allowed_distance(n: int) -> int:
+    """Token càng dài càng chịu được nhiều lỗi; token ngắn (< 5 ký tự) không sửa."""
+    if n < MIN_TOKEN_LEN:
+        return 0
+    if n < 8:
+        return 1
+    return 2
+
+
+def _deletes(word: str, max_distance: int) -> Set[str]:
+    out = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        nxt = set()
+        for w in frontier:
+            if len(w) <= 1:
+                continue
+            for i in range(len(w)):
+                nxt.add(w[:i] + w[i + 1:])
+        nxt -= out
+        out |= nxt
+        frontier = nxt
+    return out
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Damerau-Levenshtein (optimal string alignment); > max_distance thì trả max_distance + 1."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        row_min = cur[0]
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+            row_min = min(row_min, cur[j])
+        if row_min > max_distance:
+            return max_distance + 1
+        prev2, prev = prev, cur
+    return prev[-1] if prev[-1] <= max_distance else max_distance + 1
+
+
+class FuzzyVocab:
+    def __init__(self, words: Dict[str, int], max_distance: int = 2, targets: Iterable[str] = None):
+        self.words = dict(words)          # token -> số alias chứa token (tie-break)
+        self.max_distance = max_distance
+        # token được phép làm đích sửa (None → mọi token)
+        self.targets = frozenset(self.words if targets is None else targets)
+        index: Dict[str, List[str]] = {}
+        for w in self.words:
+            for d in _deletes(w, max_distance):
+                index.setdefault(d, []).append(w)
+        self._index = index
+
+    def __contains__(self, token: str) -> bool:
+        return token in self.words
+
+    def __len__(self):
+        return len(self.words)
+
+    def lookup(self, token: str) -> Tuple[Optional[str], int, bool]:
+        """
+        (word, distance, ambiguous):
+        - word: từ vựng duy nhất gần nhất (None nếu không có / mơ hồ)
+        - ambiguous: True khi nhiều từ cùng khoảng cách và cùng tần suất
+        """
+        if token in self.words:
+            return token, 0, False
+        d_max = min(allowed_distance(len(token)), self.max_distance)
+        if d_max == 0:
+            return None, 0, False
+
+        candidates = set()
+        for d in _deletes(token, d_max):
+            candidates.update(self._index.get(d, ()))
+
+        best: List[str] = []
+        best_d = d_max + 1
+        for w in candidates:
+            dist = edit_distance(token, w, d_max)
+            if dist < best_d:
+                best, best_d = [w], dist
+            elif dist == best_d:
+                best.append(w)
+
+        if not best:
+            return None, 0, False
+        if len(best) == 1:
+            return best[0], best_d, False
+
+        best.sort(key=lambda w: -self.words[w])
+        if self.words[best[0]] > self.words[best[1]]:
+            return best[0], best_d, False
+        return None, best_d, True
+
+
+def correct_tokens(
+    tokens: Iterable[str],
+    vocab: FuzzyVocab,
+    known_words: Set[str] = frozenset(),
+    accented: Set[str] = frozenset(),
+    protected: Set[str] = frozenset(),
+) -> Tuple[Dict[str, str], List[str]]:
+    """
+    Trả về (corrections {token: từ vựng}, unresolved [token không xác định được]).
+    Token đã có trong vocab / known_words, có chữ số hoặc ký tự + - / thì giữ nguyên.
+    accented: token mà người dùng gõ có dấu → coi là cố ý, không sửa (unresolved).
+    protected: từ thường thêm cho lần gọi này (vd. KB viết có dấu) → không làm đích sửa.
+    Token còn lại mà không sửa được (không có ứng viên, mơ hồ, ứng viên không phải
+    vocab.targets hoặc thuộc protected) là unresolved.
+    """
+    corrections: Dict[str, str] = {}
+    unresolved: List[str] = []
+    for t in tokens:
+        if t in corrections or t in unresolved or t in vocab or t in known_words:
+            continue
+        if not t.isalpha():
+            continue
+        word = None
+        if t not in accented:
+            word, _, _ = vocab.lookup(t)
+        if word is not None and word in vocab.targets and word not in protected:
+            corrections[t] = word
+        else:
+            unresolved.append(t)
+    return corrections, unresolved
@@ -367,15 +367,14 @@ def call_finetune_with_context(client, user_query, context, answer_mode: str = "
     )
     return resp.choices[0].message.content.strip()
 
-def call_finetune_with_context_stream(
+def build_finetune_stream_request(
     system_prefix,
-    client,
     user_query: str,
     context: str,
     answer_mode: str = "general",
     must_tags=None,
     any_tags=None,
-):
+) -> dict:
     BASE_REASONING_PROMPT = """
 Bạn là Trợ lý Kỹ thuật Nông nghiệp & Sản phẩm của BMCVN.
 
@@ -417,8 +416,9 @@ YÊU CẦU TRÌNH BÀY:
 - Ưu tiên tính đúng, đầy đủ, nhất quán.
 """.strip()
     """
-    Stream token từ OpenAI chat.completions (stream=True).
-    Trả về generator[str] yield từng chunk text.
+    Tham số chat.completions (model, temperature, messages) cho câu trả lời cuối dạng stream.
+    Dùng chung cho call_finetune_with_context_stream và các bước stream của pipeline
+    (bản sync + async) → mọi đường gửi đúng cùng 1 prompt.
     """
 
     # -----------------------------
@@ -810,13 +810,30 @@ YÊU CẦU TRÌNH BÀY:
         {"role": "user", "content": user_query},
     ]
 
+    return {
+        "model": model,
+        "temperature": 0.25,
+        "messages": messages,
+    }
+
+
+def call_finetune_with_context_stream(
+    system_prefix,
+    client,
+    user_query: str,
+    context: str,
+    answer_mode: str = "general",
+    must_tags=None,
+    any_tags=None,
+):
+    """
+    Stream token từ OpenAI chat.completions (stream=True).
+    Trả về generator[str] yield từng chunk text.
+    """
+    req = build_finetune_stream_request(system_prefix, user_query, context, answer_mode, must_tags, any_tags)
+
     # 3) Streaming
-    resp = client.chat.completions.create(
-        model=model,
-        temperature=0.25,
-        messages=messages,
-        stream=True,
-    )
+    resp = client.chat.completions.create(**req, stream=True)
 
     for chunk in resp:
         try:
@@ -0,0 +1,182 @@
+"""
+KB dạng cột (columnar) để mmap:
+
+    <name>.kbcol/
+        manifest.json
+        embeddings.npy               float32 [N, D]
+        <col>.offsets.npy            int64   [N + 1]
+        <col>.data.npy               uint8   (UTF-8 nối liền)
+
+Mọi file .npy được mở bằng np.load(mmap_mode="r") → nhiều worker gunicorn
+dùng chung page qua OS cache, cold start gần như tức thì.
+
+CLI chuyển từ NPZ cũ:
+    python -m rag.kb_columnar data-kd-1-4-1-2-2026-focus-product.npz [--out DIR] [--quantize int8]
+"""
+import json
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+FORMAT_NAME = "kbcol"
+FORMAT_VERSION = 1
+
+# Thứ tự cột = thứ tự 9-tuple mà search() unpack (sau embeddings)
+STRING_COLUMNS = (
+    "questions", "answers", "alt_questions", "category",
+    "tags", "ids", "tags_v2", "entity_type",
+)
+
+
+class StringColumn:
+    """
+    Cột chuỗi UTF-8 đọc lười từ mmap: chỉ decode dòng nào được truy cập.
+    Hành xử như object array 1 chiều: len(), col[i], iter(col).
+    """
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return int(self.offsets.shape[0]) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError(f"row {i} out of range for column of length {len(self)}")
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.data[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.offsets.nbytes + self.data.nbytes)
+
+
+def _encode_strings(values):
+    encoded = [("" if v is None else str(v)).encode("utf-8") for v in values]
+    lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return offsets, data
+
+
+def convert_npz_to_columnar(npz_path, out_dir=None) -> Path:
+    """
+    Đọc NPZ (qua load_npz để giữ đúng logic alias cột) và ghi ra thư mục .kbcol.
+    manifest.json được ghi cuối cùng → thư mục chỉ hợp lệ khi convert xong.
+    """
+    from rag.kb_loader import load_npz
+
+    npz_path = Path(npz_path)
+    out_dir = Path(out_dir) if out_dir else npz_path.with_suffix(".kbcol")
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    EMBS, *string_cols = load_npz(str(npz_path))
+    embs = np.ascontiguousarray(np.asarray(EMBS, dtype=np.float32))
+    np.save(out_dir / "embeddings.npy", embs)
+
+    present = []
+    for name, col in zip(STRING_COLUMNS, string_cols):
+        if col is None:
+            continue
+        offsets, data = _encode_strings(col)
+        np.save(out_dir / f"{name}.offsets.npy", offsets)
+        np.save(out_dir / f"{name}.data.npy", data)
+        present.append(name)
+
+    manifest = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "source": npz_path.name,
+        "num_docs": int(embs.shape[0]),
+        "dim": int(embs.shape[1]),
+        "columns": present,
+    }
+    with open(out_dir / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    return out_dir
+
+
+def load_columnar(kb_dir):
+    """
+    Mở thư mục .kbcol, trả về đúng 9-tuple như load_npz():
+    (EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS, TAGS_V2, ENTITY_TYPE)
+    EMBS là np.memmap read-only, các cột chuỗi là StringColumn (None nếu không có).
+    """
+    kb_dir = Path(kb_dir)
+    manifest_path = kb_dir / "manifest.json"
+    if not manifest_path.exists():
+        raise ValueError(f"{kb_dir} is not a columnar KB (missing manifest.json)")
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_NAME:
+        raise ValueError(f"Unknown KB format: {manifest.get('format')}")
+    if int(manifest.get("version", 0)) > FORMAT_VERSION:
+        raise ValueError(f"Columnar KB version {manifest.get('version')} is newer than supported {FORMAT_VERSION}")
+
+    EMBS = np.load(kb_dir / "embeddings.npy", mmap_mode="r")
+
+    present = set(manifest.get("columns", []))
+    cols = {}
+    for name in STRING_COLUMNS:
+        if name not in present:
+            cols[name] = None
+            continue
+        offsets = np.load(kb_dir / f"{name}.offsets.npy", mmap_mode="r")
+        data = np.load(kb_dir / f"{name}.data.npy", mmap_mode="r")
+        cols[name] = StringColumn(offsets, data)
+
+    if cols["ids"] is None:
+        raise ValueError("Columnar KB missing 'ids' - required for VERBATIM mode.")
+
+    return (
+        EMBS,
+        cols["questions"],
+        cols["answers"],
+        cols["alt_questions"],
+        cols["category"],
+        cols["tags"],
+        cols["ids"],
+        cols["tags_v2"],
+        cols["entity_type"],
+    )
+
+
+def is_columnar_kb(path) -> bool:
+    p = Path(path)
+    return p.is_dir() and (p / "manifest.json").exists()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert data-*.npz KB files to the mmap columnar format")
+    parser.add_argument("npz", nargs="+", help="NPZ file(s) to convert")
+    parser.add_argument("--out", default=None, help="output directory (only valid with a single input)")
+    parser.add_argument("--quantize", default=None, choices=("fp16", "int8"),
+                        help="also write quantized first-pass embeddings (see rag/quantize.py)")
+    args = parser.parse_args()
+
+    if args.out and len(args.npz) > 1:
+        parser.error("--out can only be used with a single input file")
+
+    for src in args.npz:
+        out = convert_npz_to_columnar(src, args.out)
+        print(f"[KBCOL] {src} -> {out}")
+        if args.quantize:
+            from rag.quantize import QuantizedEmbeddings, quantized_path
+
+            EMBS = np.load(out / "embeddings.npy", mmap_mode="r")
+            QuantizedEmbeddings.build(EMBS, args.quantize).save(quantized_path(out, args.quantize))
+            print(f"[KBCOL] {args.quantize} embeddings -> {quantized_path(out, args.quantize)}")
@@ -18,3 +18,15 @@ def load_npz(npz_path: str):
     ENTITY_TYPE = data.get("ENTITY_TYPE", data.get("entity_type", None))
 
     return (EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS, TAGS_V2, ENTITY_TYPE)
+
+
+def load_kb(path: str):
+    """
+    Load KB từ NPZ cũ hoặc thư mục columnar (.kbcol, mmap).
+    Cả hai đều trả về cùng 9-tuple mà search() cần.
+    """
+    from rag.kb_columnar import is_columnar_kb, load_columnar
+
+    if is_columnar_kb(path):
+        return load_columnar(path)
+    return load_npz(str(path))
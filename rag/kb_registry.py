@@ -0,0 +1,169 @@
+import sys
+import time
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from rag.kb_loader import load_kb
+from rag.kb_columnar import StringColumn
+from rag.tag_index import build_tag_index
+from rag.ann_index import build_ann_index
+from rag.quantize import build_quantized
+from rag.retrieval_cache import kb_fingerprint
+from rag.config import RAGConfig
+
+KB_COLUMNS = (
+    "EMBS", "QUESTIONS", "ANSWERS", "ALT_QUESTIONS", "CATEGORY",
+    "TAGS", "IDS", "TAGS_V2", "ENTITY_TYPE",
+)
+
+
+class LoadedKB(tuple):
+    """
+    KB đã load + validate, dùng chung cho mọi request trong worker.
+
+    Vẫn là 9-tuple giống load_npz() trả về (search()/verbatim unpack được),
+    kèm thêm metadata: path, load_seconds, resident_bytes, mapped_bytes, num_docs, dim
+    và tag_index (tags_v2 đã parse sẵn thành inverted index),
+    ann_index (FAISS, None nếu RAGConfig.retrieval_backend = "exact"),
+    quantized (embedding fp16/int8 cho lượt quét đầu, None nếu tắt),
+    fingerprint (hash nội dung, dùng làm version cho retrieval cache).
+    """
+
+    def __new__(cls, columns, *, path: str, load_seconds: float):
+        obj = super().__new__(cls, columns)
+        obj.path = path
+        obj.load_seconds = load_seconds
+        obj.num_docs = int(columns[0].shape[0])
+        obj.dim = int(columns[0].shape[1])
+        obj.tag_index = build_tag_index(columns[7])
+        obj.ann_index = build_ann_index(columns[0], path=RAGConfig.ann_index_path)
+        obj.quantized = build_quantized(columns[0], kb_path=path)
+        obj.fingerprint = kb_fingerprint(columns)
+        obj.resident_bytes, obj.mapped_bytes = _estimate_bytes(columns)
+        return obj
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "num_docs": self.num_docs,
+            "dim": self.dim,
+            "fingerprint": self.fingerprint,
+            "load_seconds": round(self.load_seconds, 4),
+            "resident_mb": round(self.resident_bytes / (1024 * 1024), 2),
+            "mapped_mb": round(self.mapped_bytes / (1024 * 1024), 2),
+            "num_tags": len(self.tag_index.postings),
+            "retrieval_backend": self.ann_index.kind if self.ann_index is not None else "exact",
+            "quantization": self.quantized.mode if self.quantized is not None else None,
+            "quantized_mb": round(self.quantized.nbytes / (1024 * 1024), 2) if self.quantized is not None else 0.0,
+        }
+
+
+def _estimate_bytes(columns):
+    """
+    (resident, mapped): phần nằm trong heap của worker vs phần mmap từ file
+    (KB columnar) — phần mmap được OS cache chia sẻ giữa các worker.
+    """
+    resident = 0
+    mapped = 0
+    for col in columns:
+        if col is None:
+            continue
+        if isinstance(col, np.memmap):
+            mapped += col.nbytes
+        elif isinstance(col, StringColumn):
+            mapped += col.nbytes
+        elif isinstance(col, np.ndarray):
+            resident += col.nbytes
+            if col.dtype == object:
+                resident += sum(sys.getsizeof(x) for x in col)
+        else:
+            resident += sys.getsizeof(col)
+    return resident, mapped
+
+
+def validate_kb(columns) -> None:
+    """
+    Kiểm tra KB trước khi publish cho các request:
+    - đủ 9 cột
+    - embeddings 2D, dạng số
+    - mọi cột còn lại (nếu có) cùng số dòng với embeddings
+    """
+    if len(columns) != len(KB_COLUMNS):
+        raise ValueError(f"KB must have {len(KB_COLUMNS)} columns, got {len(columns)}")
+
+    EMBS = columns[0]
+    if EMBS is None or getattr(EMBS, "ndim", 0) != 2:
+        raise ValueError("KB embeddings must be a 2D matrix")
+    if not np.issubdtype(EMBS.dtype, np.number):
+        raise ValueError(f"KB embeddings must be numeric, got {EMBS.dtype}")
+
+    n = EMBS.shape[0]
+    for name, col in zip(KB_COLUMNS[1:], columns[1:]):
+        if col is None:
+            continue
+        if len(col) != n:
+            raise ValueError(f"KB column {name} has {len(col)} rows, expected {n}")
+
+    if columns[2] is None:
+        raise ValueError("KB missing ANSWERS column")
+
+
+def _freeze(columns):
+    out = []
+    for col in columns:
+        if isinstance(col, np.ndarray):
+            col.setflags(write=False)
+        out.append(col)
+    return out
+
+
+class KBRegistry:
+    """
+    Giữ KB đã load cho cả process (1 lần / worker).
+    Request chỉ gọi get() → luôn nhận cùng 1 instance, không load lại NPZ.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kb = None
+
+    def load(self, path) -> LoadedKB:
+        path = str(path)
+        with self._lock:
+            if self._kb is not None and self._kb.path == path:
+                return self._kb
+
+            t0 = time.perf_counter()
+            columns = list(load_kb(path))
+            EMBS = columns[0]
+            if EMBS is not None and EMBS.dtype != np.float32:
+                columns[0] = np.asarray(EMBS, dtype=np.float32)
+            validate_kb(columns)
+            columns = _freeze(columns)
+            kb = LoadedKB(columns, path=path, load_seconds=0.0)
+            kb.load_seconds = time.perf_counter() - t0
+
+            self._kb = kb
+            print("[KB LOADED]", kb.stats())
+            return kb
+
+    def get(self) -> LoadedKB:
+        kb = self._kb
+        if kb is None:
+            raise RuntimeError("KB chưa được load — gọi kb_registry.load(path) lúc khởi động worker")
+        return kb
+
+    def stats(self) -> dict:
+        kb = self._kb
+        return kb.stats() if kb is not None else {"loaded": False}
+
+
+kb_registry = KBRegistry()
+
+
+def get_kb(path=None) -> LoadedKB:
+    if path is not None:
+        return kb_registry.load(Path(path))
+    return kb_registry.get()
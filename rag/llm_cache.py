@@ -0,0 +1,130 @@
+"""
+Cache câu trả lời LLM cho các helper gần như tất định (normalize_query, intent,
+rewrite, infer_* recovery, expand_query, detect_l3_gaps...) — câu hỏi lặp lại của
+nhân viên thị trường bỏ qua gần hết chuỗi LLM trước bước sinh câu trả lời.
+
+key = (helper, model, hash toàn bộ request: messages + tham số sinh)
+→ prompt template nằm trong messages nên sửa prompt là key tự đổi (entry cũ hết hạn
+theo TTL / bị LRU đẩy ra), không bao giờ trả kết quả của prompt cũ.
+
+2 tầng giống EmbeddingCache: LRU trong process (TTL) + SQLite trên đĩa (tuỳ chọn, TTL).
+Chỉ cache nội dung hợp lệ (validate) → câu trả lời lỗi / JSON hỏng không bị lặp lại.
+"""
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import Callable, Optional
+
+from rag.cache import LRUCache, SqliteKV
+from rag.config import RAGConfig
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+LLM_CACHE_PATH = BASE_DIR / "cache" / "llm_responses.sqlite"
+
+# tham số không đổi nội dung câu trả lời → không đưa vào key
+_NON_KEY_PARAMS = {"timeout", "stream", "user", "extra_headers"}
+
+
+def request_key(helper: str, request: dict) -> str:
+    payload = {k: v for k, v in request.items() if k not in _NON_KEY_PARAMS}
+    digest = hashlib.sha1(
+        json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+    return f"{helper}\x1f{request.get('model', '')}\x1f{digest}"
+
+
+def is_json(text: str) -> bool:
+    try:
+        json.loads(text)
+        return True
+    except Exception:
+        return False
+
+
+class LLMResponseCache:
+    def __init__(self, maxsize: int, ttl_seconds=None, disk_path=None, helpers=None):
+        self.mem = LRUCache(maxsize=maxsize, ttl_seconds=ttl_seconds)
+        self.disk = SqliteKV(disk_path, table="llm_responses", ttl_seconds=ttl_seconds) if disk_path else None
+        self.helpers = set(helpers) if helpers is not None else None
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def enabled_for(self, helper: str) -> bool:
+        return self.mem.maxsize > 0 and (self.helpers is None or helper in self.helpers)
+
+    def _count(self, helper: str, field: str):
+        with self._lock:
+            m = self._metrics.setdefault(helper, {"hits": 0, "disk_hits": 0, "misses": 0, "skipped_puts": 0})
+            m[field] += 1
+
+    def get(self, helper: str, key: str) -> Optional[str]:
+        v = self.mem.get(key)
+        if v is not None:
+            self._count(helper, "hits")
+            return v
+        if self.disk is not None:
+            blob = self.disk.get(key)
+            if blob is not None:
+                v = bytes(blob).decode("utf-8")
+                self.mem.put(key, v)
+                self._count(helper, "disk_hits")
+                return v
+        self._count(helper, "misses")
+        return None
+
+    def put(self, key: str, content: str):
+        self.mem.put(key, content)
+        if self.disk is not None:
+            self.disk.put(key, content.encode("utf-8"))
+
+    def clear(self):
+        self.mem.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> dict:
+        s = self.mem.stats()
+        helpers = {}
+        with self._lock:
+            for name, m in sorted(self._metrics.items()):
+                total = m["hits"] + m["disk_hits"] + m["misses"]
+                helpers[name] = dict(m, hit_rate=round((m["hits"] + m["disk_hits"]) / total, 4) if total else 0.0)
+        s["disk_enabled"] = self.disk is not None and not self.disk.disabled
+        s["helpers"] = helpers
+        return s
+
+
+llm_cache = LLMResponseCache(
+    maxsize=int(getattr(RAGConfig, "llm_cache_size", 4096)),
+    ttl_seconds=getattr(RAGConfig, "llm_cache_ttl", 86400),
+    disk_path=LLM_CACHE_PATH if getattr(RAGConfig, "llm_cache_disk", False) else None,
+    helpers=getattr(RAGConfig, "llm_cache_helpers", None),
+)
+
+
+def cached_chat(client, helper: str, validate: Callable[[str], bool] = None, **request) -> str:
+    """
+    client.chat.completions.create(**request) → content (str), qua llm_cache.
+    validate(content) False / lỗi → vẫn trả content nhưng không cache.
+    """
+    if not llm_cache.enabled_for(helper):
+        resp = client.chat.completions.create(**request)
+        return resp.choices[0].message.content or ""
+
+    key = request_key(helper, request)
+    content = llm_cache.get(helper, key)
+    if content is not None:
+        return content
+
+    resp = client.chat.completions.create(**request)
+    content = resp.choices[0].message.content or ""
+    try:
+        ok = bool(content.strip()) and (validate is None or validate(content))
+    except Exception:
+        ok = False
+    if ok:
+        llm_cache.put(key, content)
+    else:
+        llm_cache._count(helper, "skipped_puts")
+    return content
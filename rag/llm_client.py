@@ -0,0 +1,300 @@
+"""
+Client OpenAI dùng chung cho cả worker: 1 connection pool (keep-alive) thay vì mở
+kết nối / TLS handshake mới cho từng lần gọi LLM / embeddings.
+
+- get_client(): client sync dùng chung (pipeline sync, endpoint ảnh, run/main.py).
+  Tạo lười ở lần gọi đầu trong mỗi worker (fork → process con tạo pool riêng).
+- get_async_client(): AsyncOpenAI dùng chung cho pipeline async
+  (answer_with_suggestions_astream) — stream câu trả lời cuối không giữ thread nên 1 worker
+  giữ được hàng trăm stream cùng lúc; chuỗi trước generate của mỗi request vẫn chiếm 1
+  thread của _PIPELINE_EXECUTOR (RAGConfig.async_pipeline_workers).
+- LoopBridgeClient: giao diện sync (client.chat.completions.create /
+  client.embeddings.create) chạy request trên AsyncOpenAI của event loop → các helper
+  sync (multi-hop, L3, T4, T5...) chạy trong thread vẫn dùng chung pool async.
+- pool_stats(): số kết nối đang mở / rảnh / bận, request đang chờ pool, số kết nối
+  mới đã mở (≈ số handshake) so với tổng request.
+
+Cấu hình pool / timeout / HTTP/2: RAGConfig.llm_*. Timeout đọc theo loại call
+(embeddings / chat / stream / vision) được gắn vào từng request nếu caller không tự truyền.
+"""
+import os
+import asyncio
+import weakref
+import threading
+import concurrent.futures
+from types import SimpleNamespace
+
+import openai
+
+from rag.config import RAGConfig
+
+try:
+    import httpx2 as _http    # openai >= 3 dùng httpx2
+except ImportError:           # openai cũ dùng httpx
+    import httpx as _http
+
+
+def _limits():
+    return _http.Limits(
+        max_connections=int(getattr(RAGConfig, "llm_max_connections", 100)),
+        max_keepalive_connections=int(getattr(RAGConfig, "llm_max_keepalive_connections", 20)),
+        keepalive_expiry=float(getattr(RAGConfig, "llm_keepalive_expiry", 60.0)),
+    )
+
+
+def _timeout(read: float = None):
+    return _http.Timeout(
+        float(read if read is not None else getattr(RAGConfig, "llm_timeout", 120.0)),
+        connect=float(getattr(RAGConfig, "llm_connect_timeout", 5.0)),
+    )
+
+
+def _http2() -> bool:
+    if not getattr(RAGConfig, "llm_http2", False):
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        print("[LLM CLIENT] llm_http2=True nhưng chưa cài h2 → dùng HTTP/1.1")
+        return False
+    return True
+
+
+def call_timeout(kind: str):
+    """Timeout cho 1 loại call (RAGConfig.llm_call_timeouts), connect timeout dùng chung."""
+    return _timeout(getattr(RAGConfig, "llm_call_timeouts", {}).get(kind))
+
+
+def _call_kind(kwargs) -> str:
+    if kwargs.get("stream"):
+        return "stream"
+    for m in kwargs.get("messages") or ():
+        content = m.get("content") if isinstance(m, dict) else None
+        if isinstance(content, list) and any(
+            isinstance(part, dict) and part.get("type") == "image_url" for part in content
+        ):
+            return "vision"
+    return "chat"
+
+
+def _with_timeout(kwargs, kind: str):
+    if "timeout" not in kwargs:
+        kwargs = dict(kwargs, timeout=call_timeout(kind))
+    return kwargs
+
+
+# ===========================
+# Thống kê pool
+# ===========================
+
+class _PoolCounter:
+    """
+    Đếm request + kết nối mới qua event hook response của httpx: mỗi kết nối có
+    1 network_stream riêng → stream chưa gặp = kết nối vừa mở (TCP + TLS handshake).
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.http_versions = {}
+        self._seen = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def observe(self, response):
+        stream = response.extensions.get("network_stream")
+        version = response.http_version
+        with self._lock:
+            self.requests += 1
+            self.http_versions[version] = self.http_versions.get(version, 0) + 1
+            if stream is not None and stream not in self._seen:
+                self._seen.add(stream)
+                self.new_connections += 1
+
+    def hooks(self, is_async: bool):
+        if is_async:
+            async def _hook(response):
+                self.observe(response)
+        else:
+            def _hook(response):
+                self.observe(response)
+        return {"response": [_hook]}
+
+
+def _pool_snapshot(http_client, counter: _PoolCounter) -> dict:
+    pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+    conns = list(getattr(pool, "_connections", []) or [])
+    idle = sum(1 for c in conns if c.is_idle())
+    return {
+        "connections": len(conns),
+        "idle": idle,
+        "active": len(conns) - idle,
+        "waiting_requests": max(0, len(getattr(pool, "_requests", []) or []) - (len(conns) - idle)),
+        "requests": counter.requests,
+        "new_connections": counter.new_connections,
+        "reuse_ratio": round(1 - counter.new_connections / counter.requests, 4) if counter.requests else None,
+        "http_versions": dict(counter.http_versions),
+    }
+
+
+# ===========================
+# Client sync
+# ===========================
+
+class PooledClient:
+    """
+    OpenAI sync + timeout theo loại call. chat.completions.create / embeddings.create
+    giống OpenAI; thuộc tính khác chuyển thẳng cho client gốc (self.raw).
+    """
+
+    def __init__(self, **kwargs):
+        self.counter = _PoolCounter()
+        self.http_client = openai.DefaultHttpxClient(
+            limits=_limits(),
+            timeout=_timeout(),
+            http2=_http2(),
+            event_hooks=self.counter.hooks(is_async=False),
+        )
+        self.raw = openai.OpenAI(http_client=self.http_client, **kwargs)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat_create))
+        self.embeddings = SimpleNamespace(create=self._embeddings_create)
+
+    def _chat_create(self, **kwargs):
+        return self.raw.chat.completions.create(**_with_timeout(kwargs, _call_kind(kwargs)))
+
+    def _embeddings_create(self, **kwargs):
+        return self.raw.embeddings.create(**_with_timeout(kwargs, "embeddings"))
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def stats(self) -> dict:
+        return _pool_snapshot(self.http_client, self.counter)
+
+
+_CLIENT = None
+_CLIENT_KWARGS = {}
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_client(**kwargs) -> PooledClient:
+    """
+    Client sync dùng chung (tạo ở lần gọi đầu). kwargs (api_key, base_url...) chỉ có
+    tác dụng ở lần tạo đầu tiên và được nhớ lại để tạo lại pool sau fork.
+    """
+    global _CLIENT, _CLIENT_KWARGS
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT_KWARGS = kwargs or _CLIENT_KWARGS
+                _CLIENT = PooledClient(**_CLIENT_KWARGS)
+    return _CLIENT
+
+
+# ===========================
+# Client async
+# ===========================
+
+_ASYNC_CLIENT = None
+_ASYNC_KWARGS = {}
+_ASYNC_COUNTER = _PoolCounter()
+_ASYNC_LOCK = threading.Lock()
+_LOOP_POLL_SECS = 0.5
+
+
+def get_async_client(**kwargs) -> "openai.AsyncOpenAI":
+    """
+    AsyncOpenAI dùng chung (tạo ở lần gọi đầu). kwargs (api_key, base_url...) chỉ có
+    tác dụng ở lần tạo đầu tiên và được nhớ lại để tạo lại pool sau fork.
+    """
+    global _ASYNC_CLIENT, _ASYNC_KWARGS
+    if _ASYNC_CLIENT is None:
+        with _ASYNC_LOCK:
+            if _ASYNC_CLIENT is None:
+                _ASYNC_KWARGS = kwargs or _ASYNC_KWARGS
+                http_client = openai.DefaultAsyncHttpxClient(
+                    limits=_limits(),
+                    timeout=_timeout(),
+                    http2=_http2(),
+                    event_hooks=_ASYNC_COUNTER.hooks(is_async=True),
+                )
+                _ASYNC_CLIENT = openai.AsyncOpenAI(http_client=http_client, **_ASYNC_KWARGS)
+    return _ASYNC_CLIENT
+
+
+def pool_stats() -> dict:
+    """Thống kê pool của các client dùng chung đã được tạo trong worker này."""
+    out = {}
+    if _CLIENT is not None:
+        out["sync"] = _CLIENT.stats()
+    if _ASYNC_CLIENT is not None:
+        out["async"] = _pool_snapshot(_ASYNC_CLIENT._client, _ASYNC_COUNTER)
+    return out
+
+
+def _reset_after_fork():
+    # kết nối của process cha không dùng chung được → worker con tạo pool mới
+    global _CLIENT, _CLIENT_LOCK, _ASYNC_CLIENT, _ASYNC_COUNTER, _ASYNC_LOCK
+    _CLIENT, _CLIENT_LOCK = None, threading.Lock()
+    _ASYNC_CLIENT, _ASYNC_LOCK = None, threading.Lock()
+    _ASYNC_COUNTER = _PoolCounter()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class LoopBridgeClient:
+    """
+    Client kiểu sync cho helper chạy trong thread: mỗi request được chạy trên
+    AsyncOpenAI của `loop` (run_coroutine_threadsafe) rồi chờ kết quả.
+    Không được gọi từ chính thread của loop (sẽ tự khoá) → raise RuntimeError.
+    Loop đã dừng (vd. việc nền còn chạy sau asyncio.run) → raise RuntimeError thay vì chờ mãi.
+    """
+
+    def __init__(self, aclient, loop: asyncio.AbstractEventLoop):
+        self._aclient = aclient
+        self._loop = loop
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat_create))
+        self.embeddings = SimpleNamespace(create=self._embeddings_create)
+
+    def _run(self, coro):
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            coro.close()
+            raise RuntimeError("LoopBridgeClient được gọi trên thread của event loop — dùng AsyncOpenAI trực tiếp")
+        if self._loop.is_closed():
+            coro.close()
+            raise RuntimeError("LoopBridgeClient: event loop đã đóng")
+        fut = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        while True:
+            try:
+                return fut.result(timeout=_LOOP_POLL_SECS)
+            except concurrent.futures.TimeoutError:
+                if not self._loop.is_running():
+                    fut.cancel()
+                    raise RuntimeError("LoopBridgeClient: event loop đã dừng trước khi request xong")
+
+    def _chat_create(self, **kwargs):
+        kwargs = _with_timeout(kwargs, _call_kind(kwargs))
+        resp = self._run(self._aclient.chat.completions.create(**kwargs))
+        if kwargs.get("stream"):
+            return self._iter_stream(resp)
+        return resp
+
+    def _iter_stream(self, aresp):
+        it = aresp.__aiter__()
+
+        async def _next():
+            return await it.__anext__()
+
+        while True:
+            try:
+                yield self._run(_next())
+            except StopAsyncIteration:
+                return
+
+    def _embeddings_create(self, **kwargs):
+        return self._run(self._aclient.embeddings.create(**_with_timeout(kwargs, "embeddings")))
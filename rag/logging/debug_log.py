@@ -7,6 +7,9 @@ def set_debug_dir(path: Path):
     global CURRENT_DEBUG_DIR
     CURRENT_DEBUG_DIR = path
 
+def debug_enabled() -> bool:
+    return CURRENT_DEBUG_DIR is not None
+
 def debug_log(*args):
     if not CURRENT_DEBUG_DIR:
         return
@@ -11,6 +11,7 @@ def _sanitize_filename(s: str) -> str:
 class TimingLog:
     def __init__(self, query: str):
         self.query = query
+        self.t0 = time.time()
 
         # span timers
         self.active = {}          # name → start_time
@@ -19,6 +20,10 @@ class TimingLog:
         # nested steps
         self.submarks = {}        # group → { step → time }
 
+        # timeline (stage chạy song song): name → (start offset, end offset)
+        self.spans = {}
+        self.waits = {}           # name → thời gian main thread chờ join stage
+
     # -----------------------------
     # SPAN API (pipeline dùng)
     # -----------------------------
@@ -28,8 +33,15 @@ class TimingLog:
     def end(self, name: str):
         if name not in self.active:
             return
-        dt = time.time() - self.active.pop(name)
+        t_start = self.active.pop(name)
+        t_end = time.time()
+        dt = t_end - t_start
         self.marks[name] = self.marks.get(name, 0) + dt
+        self.spans[name] = (t_start - self.t0, t_end - self.t0)
+
+    # dùng cho StageGraph: main thread bị chặn bao lâu khi join stage
+    def wait(self, name: str, dt: float):
+        self.waits[name] = self.waits.get(name, 0) + dt
 
     # dùng cho multi-hop
     def sub(self, group: str, name: str, dt: float):
@@ -67,7 +79,16 @@ class TimingLog:
             for name, t in steps.items():
                 lines.append(f"  - {name}: {t:.3f}s")
 
+        # timeline: stage song song chồng lên nhau → TOTAL (tổng span) > WALL
+        if self.spans:
+            lines.append("\n[timeline]")
+            for name, (a, b) in sorted(self.spans.items(), key=lambda kv: kv[1][0]):
+                wait = self.waits.get(name)
+                extra = f"  (waited {wait:.3f}s)" if wait is not None else ""
+                lines.append(f"  {a:7.3f}s → {b:7.3f}s  {name}{extra}")
+
         lines.append(f"\nTOTAL: {total:.3f}s")
+        lines.append(f"WALL: {time.time() - self.t0:.3f}s")
 
         try:
             with open(path, "w", encoding="utf-8") as f:
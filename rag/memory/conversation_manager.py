@@ -22,5 +22,8 @@ def write_memory(client, user_id, facts_json):
         memory_store.add(user_id, emb, f)
 
 def read_memory(client, user_id, query, k=5):
+    # user chưa có fact nào → khỏi tốn 1 lần gọi embedding
+    if user_id not in memory_store.user_indexes:
+        return []
     emb = embed_text(client, query)
     return memory_store.search(user_id, emb, k)
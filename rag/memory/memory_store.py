@@ -1,3 +1,5 @@
+import threading
+
 import faiss
 import numpy as np
 
@@ -6,24 +8,29 @@ class UserMemoryStore:
         self.dim = dim
         self.user_indexes = {}   # user_id -> FAISS index
         self.user_facts = {}     # user_id -> list facts
+        # ghi (luồng nền) và đọc (stage read_memory) chạy trên thread khác nhau
+        self._lock = threading.Lock()
 
     def _get_user_index(self, user_id):
         if user_id not in self.user_indexes:
-            self.user_indexes[user_id] = faiss.IndexFlatIP(self.dim)
+            # facts có trước index → ai thấy index là thấy facts
             self.user_facts[user_id] = []
+            self.user_indexes[user_id] = faiss.IndexFlatIP(self.dim)
         return self.user_indexes[user_id]
 
     def add(self, user_id, embedding, fact):
-        index = self._get_user_index(user_id)
-        index.add(np.array([embedding]).astype("float32"))
-        self.user_facts[user_id].append(fact)
+        with self._lock:
+            index = self._get_user_index(user_id)
+            self.user_facts[user_id].append(fact)
+            index.add(np.array([embedding]).astype("float32"))
 
     def search(self, user_id, embedding, k=5):
-        if user_id not in self.user_indexes:
-            return []
-        index = self.user_indexes[user_id]
-        facts = self.user_facts[user_id]
-        D, I = index.search(np.array([embedding]).astype("float32"), k)
-        return [facts[i] for i in I[0] if i != -1]
+        with self._lock:
+            if user_id not in self.user_indexes:
+                return []
+            index = self.user_indexes[user_id]
+            facts = self.user_facts[user_id]
+            D, I = index.search(np.array([embedding]).astype("float32"), k)
+            return [facts[i] for i in I[0] if i != -1]
 
 memory_store = UserMemoryStore()
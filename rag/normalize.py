@@ -1,5 +1,68 @@
+import string
+import unicodedata
+from collections import Counter
+
+from rag.config import RAGConfig
+from rag.llm_cache import cached_chat
+from rag.tag_filter import fuzzy_normalize, normalize as normalize_text
+
+_PUNCT = string.punctuation + "“”‘’…"
+
+# theo từng KB, từ câu hỏi trong KB:
+# - token (đã normalize) → "từ bình thường" cho fuzzy_normalize
+# - token bỏ dấu → dạng có dấu hay gặp nhất → ghép từ đã sửa chính tả bằng dạng có dấu
+_KB_WORDS = {}
+_KB_WORDS_MAX = 4
+
+
+def _kb_vocab(kb):
+    QUESTIONS, ALT_QUESTIONS = kb[1], kb[3]
+    key = id(QUESTIONS)
+    hit = _KB_WORDS.get(key)
+    if hit is not None and hit[0] is QUESTIONS:
+        return hit[1], hit[2]
+
+    words = set()
+    surface_counts = Counter()
+    for col in (QUESTIONS, ALT_QUESTIONS):
+        if col is None:
+            continue
+        for text in col:
+            text = unicodedata.normalize("NFC", str(text or ""))
+            words.update(normalize_text(text).split())
+            for w in text.lower().split():
+                w = w.strip(_PUNCT)
+                folded = normalize_text(w)
+                if w and folded != w and " " not in folded:
+                    surface_counts[(folded, w)] += 1
+
+    surface = {}
+    for (folded, w), _ in surface_counts.most_common():
+        surface.setdefault(folded, w)
+
+    words = frozenset(words)
+    if len(_KB_WORDS) >= _KB_WORDS_MAX:
+        _KB_WORDS.pop(next(iter(_KB_WORDS)))
+    _KB_WORDS[key] = (QUESTIONS, words, surface)
+    return words, surface
+
+
+def kb_words(kb) -> frozenset:
+    if kb is None:
+        return frozenset()
+    return _kb_vocab(kb)[0]
+
+
+def kb_surface_forms(kb) -> dict:
+    if kb is None:
+        return {}
+    return _kb_vocab(kb)[1]
+
+
 def normalize_query(client, q: str) -> str:
-    resp = client.chat.completions.create(
+    content = cached_chat(
+        client,
+        "normalize_query",
         model="gpt-4o-mini",
         temperature=0,
         messages=[
@@ -21,4 +84,20 @@ def normalize_query(client, q: str) -> str:
             {"role": "user", "content": q}
         ],
     )
-    return resp.choices[0].message.content.strip()
\ No newline at end of file
+    return content.strip()
+
+
+def normalize_query_fast(client, q: str, kb=None) -> str:
+    """
+    Sửa chính tả entity cục bộ trước (rag.tag_filter.fuzzy_normalize); chỉ gọi LLM
+    normalize khi bản sửa cục bộ chưa chắc chắn (còn token lạ / từ gõ có dấu chưa biết /
+    chỗ sửa không tạo thêm entity / không có entity nào).
+    """
+    if getattr(RAGConfig, "local_normalize_skip_llm", True):
+        local = fuzzy_normalize(q, known_words=kb_words(kb), surface_forms=kb_surface_forms(kb))
+        if local["confident"]:
+            print("[NORMALIZE LOCAL]", local["corrections"])
+            return local["text"].strip()
+        print("[NORMALIZE LLM] unresolved:", local["unresolved"], "entities:", local["num_entities"],
+              "missing diacritics:", local["missing_diacritics"])
+    return normalize_query(client, q)
@@ -0,0 +1,250 @@
+"""
+Snapshot nhị phân của ontology tag_filter (đã normalize + compile sẵn):
+- CHEMICAL_KB (chemical_tags_from_kb.json) đã normalize_entity
+- inverted index entity -> chemical
+- AliasMatcher (Aho-Corasick) cho entity / chemical
+- FuzzyVocab (symmetric delete) để sửa lỗi chính tả token entity
+
+Process mới chỉ cần unpickle thay vì parse JSON + normalize lại mọi alias.
+Snapshot ghi kèm (mtime, size, hash) của từng file nguồn; file nguồn đổi → build lại.
+
+OntologyRegistry giữ bản đang dùng và cho phép reload nóng (signal / admin endpoint):
+bản mới được build xong ở ngoài request rồi mới swap tham chiếu (nguyên tử), request
+đang chạy vẫn dùng trọn vẹn bản cũ mà nó đã lấy.
+
+Build trước (deploy / CI):
+    python -m rag.ontology
+"""
+import os
+import time
+import pickle
+import signal
+import hashlib
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Set
+
+from rag.alias_matcher import AliasMatcher
+from rag.fuzzy_alias import FuzzyVocab
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+SNAPSHOT_PATH = BASE_DIR / "cache" / "ontology.pkl"
+SNAPSHOT_FORMAT = 2
+
+
+class Ontology:
+    """Dữ liệu chỉ đọc mà tag_filter cần, build 1 lần cho cả process."""
+
+    def __init__(
+        self,
+        version: str,
+        chemical_kb: Dict[str, Dict],
+        chemical_index: Dict[str, Dict[str, Set[str]]],
+        entity_matcher: AliasMatcher,
+        chemical_matcher: AliasMatcher,
+        fuzzy: FuzzyVocab,
+    ):
+        self.version = version
+        self.chemical_kb = chemical_kb
+        self.chemical_index = chemical_index
+        self.entity_matcher = entity_matcher
+        self.chemical_matcher = chemical_matcher
+        self.fuzzy = fuzzy
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "num_chemicals": len(self.chemical_kb),
+            "entity_matcher_nodes": len(self.entity_matcher),
+            "chemical_matcher_nodes": len(self.chemical_matcher),
+            "fuzzy_vocab_size": len(self.fuzzy),
+        }
+
+
+def _file_sha(path: Path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _source_meta(path: Path, sha: str = None) -> dict:
+    st = path.stat()
+    return {
+        "mtime_ns": st.st_mtime_ns,
+        "size": st.st_size,
+        "sha": sha or _file_sha(path),
+    }
+
+
+def _is_fresh(meta: dict, sources: Iterable[Path]) -> bool:
+    """mtime + size khớp → fresh ngay; lệch thì so hash (touch / checkout lại không làm rebuild)."""
+    recorded = meta.get("sources", {})
+    sources = [Path(p) for p in sources]
+    if set(recorded) != {str(p) for p in sources}:
+        return False
+    for p in sources:
+        rec = recorded[str(p)]
+        st = p.stat()
+        if st.st_mtime_ns == rec["mtime_ns"] and st.st_size == rec["size"]:
+            continue
+        if _file_sha(p) != rec["sha"]:
+            return False
+    return True
+
+
+def _version(source_meta: Dict[str, dict]) -> str:
+    h = hashlib.blake2b(digest_size=8)
+    for name in sorted(source_meta):
+        h.update(source_meta[name]["sha"].encode("ascii"))
+    return h.hexdigest()
+
+
+def read_snapshot(sources: Iterable[Path], path=SNAPSHOT_PATH):
+    """Ontology từ snapshot nếu còn fresh, ngược lại None."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    try:
+        with open(path, "rb") as f:
+            meta = pickle.load(f)
+            if meta.get("format") != SNAPSHOT_FORMAT or not _is_fresh(meta, sources):
+                return None
+            return pickle.load(f)
+    except Exception as e:
+        print(f"[ONTOLOGY SNAPSHOT ERROR] {path}: {e}")
+        return None
+
+
+def write_snapshot(onto: Ontology, source_meta: Dict[str, dict], path=SNAPSHOT_PATH):
+    path = Path(path)
+    meta = {"format": SNAPSHOT_FORMAT, "version": onto.version, "sources": source_meta}
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "wb") as f:
+            pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(onto, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # replace nguyên tử → worker khác không bao giờ đọc file ghi dở
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"[ONTOLOGY SNAPSHOT ERROR] {path}: {e}")
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+
+
+def load_or_build(
+    sources: Iterable[Path],
+    build: Callable[[str], Ontology],
+    path=SNAPSHOT_PATH,
+    use_snapshot: bool = True,
+    force_rebuild: bool = False,
+) -> Ontology:
+    """
+    sources: các file quyết định nội dung ontology (JSON + module chứa bảng alias).
+    build(version) chỉ được gọi khi snapshot thiếu / cũ / bị tắt.
+    """
+    sources = [Path(p) for p in sources]
+    if use_snapshot and not force_rebuild:
+        onto = read_snapshot(sources, path)
+        if onto is not None:
+            return onto
+
+    source_meta = {str(p): _source_meta(p) for p in sources}
+    onto = build(_version(source_meta))
+    if use_snapshot:
+        write_snapshot(onto, source_meta, path)
+    return onto
+
+
+class OntologyRegistry:
+    """
+    get() không lấy lock (đọc 1 tham chiếu) → caller lấy 1 lần rồi dùng cho cả lượt xử lý.
+    reload() build bản mới (load(reload=True)) rồi mới gán _current; build lỗi thì giữ bản cũ.
+    """
+
+    def __init__(self, load: Callable[..., Ontology]):
+        self._load = load
+        self._current: Ontology = None
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self.last_reload_at = None
+        self.last_reload_seconds = None
+        self.last_error = None
+
+    def get(self) -> Ontology:
+        onto = self._current
+        if onto is None:
+            with self._lock:
+                if self._current is None:
+                    self._current = self._load()
+                onto = self._current
+        return onto
+
+    @property
+    def version(self) -> str:
+        return self.get().version
+
+    def reload(self) -> Ontology:
+        with self._lock:
+            t0 = time.perf_counter()
+            try:
+                onto = self._load(reload=True)
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                print("[ONTOLOGY RELOAD ERROR]", self.last_error)
+                raise
+            old = self._current
+            self._current = onto
+            self.reloads += 1
+            self.last_reload_at = time.time()
+            self.last_reload_seconds = time.perf_counter() - t0
+            self.last_error = None
+        print(f"[ONTOLOGY RELOADED] {old.version if old else None} -> {onto.version} "
+              f"in {self.last_reload_seconds:.3f}s")
+        return onto
+
+    def reload_in_background(self) -> threading.Thread:
+        def _run():
+            try:
+                self.reload()
+            except Exception:
+                pass  # đã log trong reload(), giữ bản cũ
+
+        t = threading.Thread(target=_run, name="ontology-reload", daemon=True)
+        t.start()
+        return t
+
+    def install_signal(self, signame: str = "SIGHUP") -> bool:
+        """Reload khi nhận signal (vd. kill -HUP <worker pid>). Chỉ gọi được từ main thread."""
+        signum = getattr(signal, signame, None)
+        if signum is None:
+            return False
+        try:
+            signal.signal(signum, lambda *_: self.reload_in_background())
+        except ValueError:
+            # không phải main thread (vd. import trong thread của server dev)
+            return False
+        return True
+
+    def stats(self) -> dict:
+        s = self.get().stats()
+        s.update({
+            "reloads": self.reloads,
+            "last_reload_at": self.last_reload_at,
+            "last_reload_seconds": round(self.last_reload_seconds, 4) if self.last_reload_seconds else None,
+            "last_error": self.last_error,
+        })
+        return s
+
+
+if __name__ == "__main__":
+    import time
+    from rag.tag_filter import load_ontology
+
+    t0 = time.perf_counter()
+    onto = load_ontology(force_rebuild=True)
+    print(f"[ONTOLOGY] built in {time.perf_counter() - t0:.3f}s -> {SNAPSHOT_PATH}", onto.stats())
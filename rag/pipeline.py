@@ -1,12 +1,13 @@
 #Khối import
 import json
 import re
+import asyncio
 from datetime import datetime
 from rag.config import RAGConfig
 from rag.router import route_query
-from rag.normalize import normalize_query
+from rag.normalize import normalize_query_fast
 from rag.text_utils import is_listing_query
-from rag.retriever import search as retrieve_search
+from rag.retriever import search_many as retrieve_search_many
 from rag.scoring import fused_score
 from rag.context_builder import build_context_from_hits
 from rag.memory.conversation_manager import read_memory, log_event, build_conversation_text, write_memory
@@ -14,11 +15,15 @@ from rag.memory.summarizer import summarize_to_fact
 from rag.conversation_state import conversation_state
 from rag.query_rewriter import needs_rewrite, format_history, rewrite_query_with_llm
 from rag.answer_modes import decide_answer_policy
-from rag.generator import call_finetune_with_context_stream, call_finetune_with_context, l3_draft_fast_from_kb
+from rag.generator import call_finetune_with_context, l3_draft_fast_from_kb, build_finetune_stream_request
+from rag.llm_client import call_timeout, get_async_client, LoopBridgeClient
 from rag.tag_filter import tag_filter_pipeline
 from rag.logging.timing_logger import TimingLog
 from rag.logging.debug_log import set_debug_dir
-from rag.reasoning.multi_hop import multi_hop_controller
+from rag.reasoning.multi_hop import multi_hop_controller, analyze_intent_strategy
+from rag.stage_graph import StageGraph, run_in_background, wait_background
+from rag.coalesce import SingleFlight
+from rag.retrieval_cache import get_kb_fingerprint
 from typing import List, Tuple, Dict, Any
 from rag.logging.debug_log import debug_log
 from rag.logging.multi_query_logger import _safe_folder_name
@@ -207,19 +212,17 @@ def formula_mode_search(
     # ngân sách cho mỗi tag
     per_tag_k = max(1, max_ctx // num_tags)
 
+    # 1 lần embed + 1 GEMM cho mọi per-tag search và free search
+    batch = [(norm_query, per_tag_k, [m], []) for m in must_tags]
+    batch.append((norm_query, max_ctx, [], []))
+    batch_hits = retrieve_search_many(client, kb, batch)
+    free_hits = batch_hits.pop()
+
     all_results = []
 
     # ---- ROLE 1: MUST TAG (chia ngân sách) ----
-    for m in must_tags:
+    for m, hits in zip(must_tags, batch_hits):
         print("m:", m)
-        hits = retrieve_search(
-            client=client,
-            kb=kb,
-            norm_query=norm_query,
-            top_k=per_tag_k,
-            must_tags=[m],
-            any_tags=[]
-        )
         all_results.extend(hits)
 
     # dedupe theo id
@@ -237,14 +240,8 @@ def formula_mode_search(
     remaining = max_ctx - len(results)
 
     if remaining > 0:
-        hits_free = retrieve_search(
-            client=client,
-            kb=kb,
-            norm_query=norm_query,
-            top_k=remaining,
-            must_tags=[],
-            any_tags=[]
-        )
+        # free search không filter → top `remaining` là prefix của top max_ctx
+        hits_free = free_hits[:remaining]
 
         for h in hits_free:
             hid = h.get("id")
@@ -349,16 +346,38 @@ QUY TẮC TRẢ LỜI:
 - Văn phong chuyên nghiệp, dễ hiểu; ưu tiên ví dụ và tiêu chí phân biệt hơn là lý thuyết dài dòng.
 """.strip()
 
-#Core GPT
-def answer_with_suggestions_stream(*, user_id, user_query, kb, client, cfg, policy):
-    timer = TimingLog(user_query)
-    run_dir = make_run_dir(user_query)
-    set_debug_dir(run_dir)
+def _summarize_and_write_memory(client, user_id, conv_text):
+    try:
+        facts_raw = summarize_to_fact(client, conv_text)
+        facts = json.loads(facts_raw)
+        write_memory(client, user_id, facts)
+    except Exception as e:
+        print("[MEMORY WRITE ERROR]:", e)
 
+def _global_request(effective_query: str) -> dict:
+    return {
+        "model": "gpt-4.1",
+        "temperature": 0.25,
+        "messages": [
+            {"role": "system", "content": _global_system_prompt()},
+            {"role": "user", "content": effective_query},
+        ],
+    }
+
+def _record_turn(user_id, user_query, final_text):
+    conversation_state.append(user_id, "user", user_query)
+    conversation_state.append(user_id, "assistant", final_text)
+    log_event(user_id, "user", user_query)
+    log_event(user_id, "assistant", final_text)
+
+def _memory_prompt(memory_facts) -> str:
+    if not memory_facts:
+        return ""
+    return "USER MEMORY:\n" + "\n".join(f"- {m['fact']}" for m in memory_facts)
+
+def _rewrite_query(client, user_id, user_query) -> str:
     turns = conversation_state.get_turns(user_id)
     effective_query = user_query
-
-    # 1) rewrite
     if turns and needs_rewrite(user_query):
         history_text = format_history(turns)
         try:
@@ -371,63 +390,20 @@ def answer_with_suggestions_stream(*, user_id, user_query, kb, client, cfg, poli
                 effective_query = rewritten
         except Exception as e:
             print("[QUERY REWRITE ERROR]:", e)
+    return effective_query
 
-    # 2) route + normalize
-    route = route_query(client, effective_query)
-    if route == "GLOBAL":
-        model = "gpt-4.1"
-        yield "🌍 Đang trả lời bằng tri thức tổng quát...\n\n"
-
-        resp = client.chat.completions.create(
-            model=model,
-            temperature=0.25,
-            messages=[
-                {"role": "system", "content": _global_system_prompt()},
-                {"role": "user", "content": effective_query},
-            ],
-            stream=True,
-        )
-
-        parts = []
-        for chunk in resp:
-            try:
-                delta = chunk.choices[0].delta
-                if delta and getattr(delta, "content", None):
-                    parts.append(delta.content)
-                    yield delta.content
-            except Exception:
-                continue
-
-        final_text = "".join(parts)
-
-        conversation_state.append(user_id, "user", user_query)
-        conversation_state.append(user_id, "assistant", final_text)
-        log_event(user_id, "user", user_query)
-        log_event(user_id, "assistant", final_text)
-
-        timer.finish(RAGConfig.enable_timing_log)
-        return
-
+def _normalize(client, timer, kb, effective_query) -> str:
     timer.start("normalize")
-    norm_query = normalize_query(client, effective_query)
-    norm_lower = norm_query.lower()
+    norm_query = normalize_query_fast(client, effective_query, kb=kb)
     timer.end("normalize")
+    return norm_query
 
-    # 3) read memory + force_rag
-    timer.start("read_memory and check route")
-    memory_facts = read_memory(client=client, user_id=user_id, query=norm_query)
-    memory_prompt = ""
-    if memory_facts:
-        memory_prompt = "USER MEMORY:\n" + "\n".join(f"- {m['fact']}" for m in memory_facts)
-
-    force_rag = any(k in norm_lower for k in FORMULA_TRIGGERS)
-    if force_rag:
-        route = "RAG"
-    timer.end("read_memory and check route")
-
-    # UI status
-    yield "⏳ Đang truy vấn dữ liệu...\n\n"
-
+def _prepare_answer(*, client, kb, run_dir, timer, graph, effective_query, norm_query):
+    """
+    Bước 4 → T5: tag filter, retrieval (multi-hop / formula), build context, L3, T4, T5.
+    Trả về dict state cho bước generate, hoặc None nếu không có hit.
+    Dùng chung cho answer_with_suggestions_stream và answer_with_suggestions_astream.
+    """
     # 4) tag filter
     timer.start("tag_filter_pipeline running")
     result = tag_filter_pipeline(norm_query)
@@ -446,12 +422,14 @@ def answer_with_suggestions_stream(*, user_id, user_query, kb, client, cfg, poli
             must_tags=must_tags
         )
     else:
+        intent_future = graph.submit("analyze_intent", analyze_intent_strategy, client, norm_query)
         hits = multi_hop_controller(
             client=client,
             kb=kb,
             base_query=norm_query,
             must_tags=must_tags,
             any_tags=any_tags,
+            intent_hint=intent_future,
         )
     timer.end("retrieval")
 
@@ -463,8 +441,7 @@ def answer_with_suggestions_stream(*, user_id, user_query, kb, client, cfg, poli
     debug_log("ANY TAGS   :", any_tags)
 
     if not hits:
-        yield "Không tìm thấy dữ liệu phù hợp."
-        return
+        return None
 
     # fused score, tag hits, ordering
     for h in hits:
@@ -570,31 +547,215 @@ def answer_with_suggestions_stream(*, user_id, user_query, kb, client, cfg, poli
         to complete the user's objective.
         Do not answer using only internal data.
         """
-    yield "✍️ Đang tổng hợp câu trả lời...\n\n"
 
-    # 7) generate streaming (FINAL)
     answer_mode_final = (
         "formula" if is_formula_query(norm_query, {"must": must_tags, "soft": any_tags}) else policy.format
     )
 
+    return {
+        "must_tags": must_tags,
+        "any_tags": any_tags,
+        "hits": hits,
+        "max_ctx": max_ctx,
+        "context": context,
+        "l3_missing_slots": l3_missing_slots,
+        "missing_after_t4": missing_after_t4,
+        "t4_report": t4_report,
+        "need_kb_fallback": need_kb_fallback,
+        "final_system_override": final_system_override,
+        "answer_mode": answer_mode_final,
+    }
+
+def _emit_trace(prep, *, user_query, effective_query, norm_query, memory_prompt):
     emit_trace_snapshot(
         user_query=user_query,
         effective_query=effective_query,
         norm_query=norm_query,
-        must_tags=must_tags,
-        any_tags=any_tags,
-        hits=hits,
-        base_ctx=build_context_from_hits(hits[:max_ctx]),  # context trước T4/T5
-        context=context,
-        l3_missing_slots=l3_missing_slots,
-        missing_after_t4=missing_after_t4,
-        t4_report=t4_report,
-        need_kb_fallback=need_kb_fallback,
+        must_tags=prep["must_tags"],
+        any_tags=prep["any_tags"],
+        hits=prep["hits"],
+        base_ctx=build_context_from_hits(prep["hits"][:prep["max_ctx"]]),  # context trước T4/T5
+        context=prep["context"],
+        l3_missing_slots=prep["l3_missing_slots"],
+        missing_after_t4=prep["missing_after_t4"],
+        t4_report=prep["t4_report"],
+        need_kb_fallback=prep["need_kb_fallback"],
         memory_prompt=memory_prompt,
-        final_system_override=final_system_override,
-        answer_mode=answer_mode_final,
+        final_system_override=prep["final_system_override"],
+        answer_mode=prep["answer_mode"],
     )
 
+def _log_answer(*, run_dir, user_query, norm_query, route, prep, final_answer):
+    # 8) log CSV
+    try:
+        append_log_to_csv(
+            run_dir,
+            user_query,
+            norm_query,
+            prep["context"],
+            {
+                "text": final_answer,
+                "route": route,
+                "norm_query": norm_query,
+                "missing_slots": prep["l3_missing_slots"],
+            },
+            route
+        )
+    except Exception as e:
+        print("[RAG CSV LOG ERROR]:", e)
+
+def _update_user(client, user_id, user_query, final_answer):
+    # 9) memory/log
+    _record_turn(user_id, user_query, final_answer)
+
+    # tóm tắt + ghi memory không cần cho câu trả lời → chạy nền, không giữ request
+    conv_text = build_conversation_text(user_id)
+    run_in_background("memory_write", _summarize_and_write_memory, client, user_id, conv_text, key=user_id)
+
+def _read_user_memory(client, user_id, query):
+    # lượt trước của user này có thể còn đang ghi memory nền → chờ ngắn rồi mới đọc
+    if not wait_background(user_id, timeout=RAGConfig.memory_write_wait):
+        print(f"[MEMORY] {user_id}: memory lượt trước chưa ghi xong sau {RAGConfig.memory_write_wait}s → đọc bản hiện có")
+    return read_memory(client, user_id, query)
+
+def _finish_turn(client, *, run_dir, timer, user_id, user_query, norm_query, route, prep, final_answer):
+    _log_answer(run_dir=run_dir, user_query=user_query, norm_query=norm_query, route=route,
+                prep=prep, final_answer=final_answer)
+    _update_user(client, user_id, user_query, final_answer)
+    timer.finish(RAGConfig.enable_timing_log)
+
+# ===========================
+# Các bước stream dùng chung cho bản sync / async
+# ===========================
+# Mỗi *_steps là generator "lệnh", viết 1 lần cho cả 2 bản:
+#   yield "text"                          → token gửi cho người dùng
+#   x = yield ("call", fn, args, kwargs)  → chạy helper sync (bản async: trên pool pipeline)
+#   h = yield ("stream", request)         → mở stream chat.completions
+#   t = yield ("next", h)                 → token kế tiếp của stream, _END khi hết
+# Lỗi khi chạy lệnh được ném lại vào generator tại chỗ yield (try/except bên trong vẫn bắt được).
+# _drive chạy lệnh bằng client sync, _adrive bằng AsyncOpenAI (stream không giữ thread nào).
+
+_END = object()
+
+def _delta_text(chunk):
+    try:
+        delta = chunk.choices[0].delta
+        return getattr(delta, "content", None) if delta else None
+    except Exception:
+        return None  # bỏ qua delta lỗi
+
+def _drive(steps, client):
+    """Chạy steps với client sync; return (generator) = giá trị return của steps."""
+    value, error = None, None
+    try:
+        while True:
+            try:
+                op = steps.throw(error) if error is not None else steps.send(value)
+            except StopIteration as stop:
+                return stop.value
+            value, error = None, None
+            if isinstance(op, str):
+                yield op
+                continue
+            try:
+                if op[0] == "call":
+                    value = op[1](*op[2], **op[3])
+                elif op[0] == "stream":
+                    value = iter(client.chat.completions.create(**op[1], stream=True))
+                else:
+                    value = _END
+                    for chunk in op[1]:
+                        text = _delta_text(chunk)
+                        if text:
+                            value = text
+                            break
+            except Exception as e:
+                error = e
+    finally:
+        steps.close()
+
+async def _adrive(steps, aclient, graph, out: dict):
+    """Bản async của _drive; giá trị return của steps ghi vào out["result"]."""
+    value, error = None, None
+    try:
+        while True:
+            try:
+                op = steps.throw(error) if error is not None else steps.send(value)
+            except StopIteration as stop:
+                out["result"] = stop.value
+                return
+            value, error = None, None
+            if isinstance(op, str):
+                yield op
+                continue
+            try:
+                if op[0] == "call":
+                    value = await graph.arun(None, op[1], *op[2], **op[3])
+                elif op[0] == "stream":
+                    resp = await aclient.chat.completions.create(
+                        **op[1], stream=True, timeout=call_timeout("stream")
+                    )
+                    value = resp.__aiter__()
+                else:
+                    value = _END
+                    async for chunk in op[1]:
+                        text = _delta_text(chunk)
+                        if text:
+                            value = text
+                            break
+            except Exception as e:
+                error = e
+    finally:
+        steps.close()
+
+def _global_answer_steps(effective_query):
+    """Stream câu trả lời GLOBAL; return = toàn bộ text đã stream."""
+    yield "🌍 Đang trả lời bằng tri thức tổng quát...\n\n"
+
+    resp = yield ("stream", _global_request(effective_query))
+
+    parts = []
+    while True:
+        tok = yield ("next", resp)
+        if tok is _END:
+            break
+        parts.append(tok)
+        yield tok
+    return "".join(parts)
+
+def _prepare_steps(*, client, kb, run_dir, timer, graph, effective_query, norm_query, route):
+    """Bước 4 → T5 (kèm status UI); return = (route, prep), prep None nếu không có hit."""
+    force_rag = any(k in norm_query.lower() for k in FORMULA_TRIGGERS)
+    if force_rag:
+        route = "RAG"
+
+    # UI status
+    yield "⏳ Đang truy vấn dữ liệu...\n\n"
+
+    # 4) → T5
+    prep = yield ("call", _prepare_answer, (), dict(
+        client=client,
+        kb=kb,
+        run_dir=run_dir,
+        timer=timer,
+        graph=graph,
+        effective_query=effective_query,
+        norm_query=norm_query,
+    ))
+    if prep is None:
+        yield "Không tìm thấy dữ liệu phù hợp."
+        return route, None
+
+    yield "✍️ Đang tổng hợp câu trả lời...\n\n"
+    return route, prep
+
+def _final_answer_steps(*, client, timer, prep, user_query, effective_query, norm_query, memory_prompt,
+                        recovery_query):
+    """Stream câu trả lời cuối + chạy lại non-stream nếu stream đứt; return = final_answer."""
+    # 7) generate streaming (FINAL)
+    _emit_trace(prep, user_query=user_query, effective_query=effective_query,
+                norm_query=norm_query, memory_prompt=memory_prompt)
+
     timer.start("final_gpt_ttft")
     timer.start("final_gpt_total")
     first_tok = True
@@ -602,15 +763,18 @@ def answer_with_suggestions_stream(*, user_id, user_query, kb, client, cfg, poli
     stream_failed = False
 
     try:
-        for tok in call_finetune_with_context_stream(
-            system_prefix=memory_prompt + final_system_override,
-            client=client,
+        resp = yield ("stream", build_finetune_stream_request(
+            system_prefix=memory_prompt + prep["final_system_override"],
             user_query=effective_query,
-            context=context,  # context đã có T4/T5 nếu có
-            answer_mode=answer_mode_final,
-            must_tags=must_tags,
-            any_tags=any_tags,
-        ):
+            context=prep["context"],  # context đã có T4/T5 nếu có
+            answer_mode=prep["answer_mode"],
+            must_tags=prep["must_tags"],
+            any_tags=prep["any_tags"],
+        ))
+        while True:
+            tok = yield ("next", resp)
+            if tok is _END:
+                break
             if first_tok:
                 timer.end("final_gpt_ttft")
                 first_tok = False
@@ -636,13 +800,13 @@ def answer_with_suggestions_stream(*, user_id, user_query, kb, client, cfg, poli
     if stream_failed:
         print("[STREAM RECOVERY] Re-running in non-stream mode")
         try:
-            final_answer = call_finetune_with_context(
+            final_answer = yield ("call", call_finetune_with_context, (), dict(
                 client=client,
-                user_query=user_query,
-                context=context,
-                answer_mode=answer_mode_final,
+                user_query=recovery_query,
+                context=prep["context"],
+                answer_mode=prep["answer_mode"],
                 rag_mode="STRICT",
-            )
+            ))
             if parts:
                 yield "\n\n[⚠ Kết nối bị gián đoạn – tiếp tục kết quả đầy đủ]\n\n"
             yield final_answer
@@ -653,36 +817,219 @@ def answer_with_suggestions_stream(*, user_id, user_query, kb, client, cfg, poli
     else:
         final_answer = "".join(parts)
 
-    # 8) log CSV
-    try:
-        append_log_to_csv(
-            run_dir,
-            user_query,
-            norm_query,
-            context,
-            {
-                "text": final_answer,
-                "route": route,
-                "norm_query": norm_query,
-                "missing_slots": l3_missing_slots,
-            },
-            route
-        )
-    except Exception as e:
-        print("[RAG CSV LOG ERROR]:", e)
+    return final_answer
 
-    # 9) memory/log
-    conversation_state.append(user_id, "user", user_query)
-    conversation_state.append(user_id, "assistant", final_answer)
-    log_event(user_id, "user", user_query)
-    log_event(user_id, "assistant", final_answer)
+#Core GPT
+def answer_with_suggestions_stream(*, user_id, user_query, kb, client, cfg, policy):
+    timer = TimingLog(user_query)
+    run_dir = make_run_dir(user_query)
+    set_debug_dir(run_dir)
 
-    try:
-        conv_text = build_conversation_text(user_id)
-        facts_raw = summarize_to_fact(client, conv_text)
-        facts = json.loads(facts_raw)
-        write_memory(client, user_id, facts)
-    except Exception as e:
-        print("[MEMORY WRITE ERROR]:", e)
+    # 1) rewrite
+    effective_query = _rewrite_query(client, user_id, user_query)
+
+    # 2) route + normalize
+    route = route_query(client, effective_query)
+    if route == "GLOBAL":
+        final_text = yield from _drive(_global_answer_steps(effective_query), client)
+        _record_turn(user_id, user_query, final_text)
+
+        timer.finish(RAGConfig.enable_timing_log)
+        return
+
+    # 3) stage độc lập chạy song song, chỉ join khi cần dữ liệu:
+    #    read_memory (embedding)  → join trước final GPT (memory_prompt)
+    #    normalize                → main thread (retrieval cần ngay)
+    #    analyze_intent_strategy  → chạy cùng lúc với HOP 1 retrieval
+    graph = StageGraph(timer)
+    graph.submit("read_memory", _read_user_memory, client=client, user_id=user_id, query=effective_query)
+
+    norm_query = _normalize(client, timer, kb, effective_query)
+
+    route, prep = yield from _drive(_prepare_steps(
+        client=client, kb=kb, run_dir=run_dir, timer=timer, graph=graph,
+        effective_query=effective_query, norm_query=norm_query, route=route,
+    ), client)
+    if prep is None:
+        return
+
+    memory_prompt = _memory_prompt(graph.result("read_memory", default=[]))
+
+    final_answer = yield from _drive(_final_answer_steps(
+        client=client, timer=timer, prep=prep, user_query=user_query, effective_query=effective_query,
+        norm_query=norm_query, memory_prompt=memory_prompt, recovery_query=user_query,
+    ), client)
 
+    _finish_turn(client, run_dir=run_dir, timer=timer, user_id=user_id, user_query=user_query,
+                 norm_query=norm_query, route=route, prep=prep, final_answer=final_answer)
+
+# answer_with_suggestions_stream_coalesced: 1 flight / câu hỏi giống nhau đang chạy
+_PREPARE_FLIGHTS = SingleFlight("prepare")   # tag filter → T5, không phụ thuộc user
+_ANSWER_FLIGHTS = SingleFlight("answer")     # final GPT (theo memory prompt) / GLOBAL
+
+def coalesce_stats() -> dict:
+    return {"prepare": _PREPARE_FLIGHTS.stats(), "answer": _ANSWER_FLIGHTS.stats()}
+
+def _prepare_flight(*, client, kb, user_query, effective_query, norm_query, route):
+    """Flight chung tag filter → multi-hop → L3 → T4 → T5; return = {"route", "prep", "run_dir"}."""
+    timer = TimingLog(user_query)
+    run_dir = make_run_dir(user_query)
+    set_debug_dir(run_dir)
+
+    route, prep = yield from _drive(_prepare_steps(
+        client=client, kb=kb, run_dir=run_dir, timer=timer, graph=StageGraph(timer),
+        effective_query=effective_query, norm_query=norm_query, route=route,
+    ), client)
+
+    timer.finish(RAGConfig.enable_timing_log)
+    return {"route": route, "prep": prep, "run_dir": run_dir}
+
+def _answer_flight(*, client, shared, user_query, effective_query, norm_query, memory_prompt):
+    """Flight final GPT từ context chung, cho các request có cùng memory prompt; return = final_answer."""
+    timer = TimingLog(user_query)
+    set_debug_dir(shared["run_dir"])
+
+    final_answer = yield from _drive(_final_answer_steps(
+        client=client, timer=timer, prep=shared["prep"], user_query=user_query,
+        effective_query=effective_query, norm_query=norm_query, memory_prompt=memory_prompt,
+        recovery_query=effective_query,
+    ), client)
+
+    _log_answer(run_dir=shared["run_dir"], user_query=user_query, norm_query=norm_query,
+                route=shared["route"], prep=shared["prep"], final_answer=final_answer)
+    timer.finish(RAGConfig.enable_timing_log)
+    return final_answer
+
+#Core GPT (coalesced)
+def answer_with_suggestions_stream_coalesced(*, user_id, user_query, kb, client, cfg, policy):
+    """
+    answer_with_suggestions_stream + single-flight, 2 tầng:
+    - các request đồng thời có cùng (KB fingerprint, route, norm_query) dùng chung 1 lượt
+      tag filter → multi-hop → L3 → T4 → T5 (không phụ thuộc user)
+    - final GPT dùng chung khi memory prompt cũng giống nhau (thường là user chưa có
+      memory); user có memory riêng thì generate riêng từ context chung đó.
+    Token của mỗi tầng được phát cho mọi request của flight.
+
+    Phần theo user vẫn chạy riêng cho từng request: rewrite theo lịch sử hội thoại,
+    read_memory (song song với normalize + flight chuẩn bị, chỉ join trước final GPT),
+    ghi lượt hội thoại + tóm tắt memory sau khi stream xong.
+    GLOBAL gộp theo effective_query. Lượt chạy chung dùng effective_query của request
+    đầu tiên; log CSV / timing ghi 1 lần cho mỗi flight.
+    """
+    timer = TimingLog(user_query)
+
+    # 1) rewrite (theo lịch sử của user)
+    effective_query = _rewrite_query(client, user_id, user_query)
+
+    # 2) route
+    route = route_query(client, effective_query)
+    if route == "GLOBAL":
+        key = ("GLOBAL", " ".join(effective_query.lower().split()))
+        flight = _ANSWER_FLIGHTS.join(key, lambda: _drive(_global_answer_steps(effective_query), client))
+        final_text = yield from flight.stream()
+        _record_turn(user_id, user_query, final_text)
+
+        timer.finish(RAGConfig.enable_timing_log)
+        return
+
+    # 3) read_memory chạy song song, chỉ join trước final GPT
+    graph = StageGraph(timer)
+    graph.submit("read_memory", _read_user_memory, client=client, user_id=user_id, query=effective_query)
+    norm_query = _normalize(client, timer, kb, effective_query)
+
+    # 4) → T5: flight chung, không phụ thuộc user
+    fingerprint = get_kb_fingerprint(kb)
+    flight = _PREPARE_FLIGHTS.join(("RAG", fingerprint, route, norm_query), lambda: _prepare_flight(
+        client=client,
+        kb=kb,
+        user_query=user_query,
+        effective_query=effective_query,
+        norm_query=norm_query,
+        route=route,
+    ))
+    timer.start("coalesced_prepare")
+    shared = yield from flight.stream()
+    timer.end("coalesced_prepare")
+    if shared["prep"] is None:
+        return
+
+    # 5) final GPT: dùng chung khi memory prompt giống nhau
+    memory_prompt = _memory_prompt(graph.result("read_memory", default=[]))
+    key = ("RAG", fingerprint, route, norm_query, memory_prompt)
+    flight = _ANSWER_FLIGHTS.join(key, lambda: _answer_flight(
+        client=client,
+        shared=shared,
+        user_query=user_query,
+        effective_query=effective_query,
+        norm_query=norm_query,
+        memory_prompt=memory_prompt,
+    ))
+    timer.start("coalesced_stream")
+    final_answer = yield from flight.stream()
+    timer.end("coalesced_stream")
+
+    _update_user(client, user_id, user_query, final_answer)
     timer.finish(RAGConfig.enable_timing_log)
+
+#Core GPT (async)
+async def answer_with_suggestions_astream(*, user_id, user_query, kb, cfg, policy, aclient=None):
+    """
+    Bản async của answer_with_suggestions_stream: cùng stage, cùng prompt, cùng chuỗi yield
+    (cùng các *_steps, chạy bằng _adrive thay vì _drive).
+    - stream LLM (GLOBAL + câu trả lời cuối) chạy thẳng trên AsyncOpenAI dùng chung →
+      không giữ OS thread nào trong lúc stream; chỉ phần này mới nhân được lên hàng trăm
+      stream cùng lúc trên 1 worker
+    - chuỗi trước generate (rewrite, normalize, retrieval/multi-hop, L3, T4, T5, log...) là
+      helper sync: mỗi request giữ 1 trong RAGConfig.async_pipeline_workers thread của
+      _PIPELINE_EXECUTOR trong lúc chạy (request mạng của chúng vẫn đi qua cùng AsyncOpenAI
+      qua LoopBridgeClient) → số request đang ở giai đoạn này bị giới hạn bởi pool đó
+      (run.parity_astream --concurrency 100 --latency 0.1: ~7 s, ~106 thread lúc cao điểm)
+    """
+    aclient = aclient or get_async_client()
+    client = LoopBridgeClient(aclient, asyncio.get_running_loop())
+    timer = TimingLog(user_query)
+    graph = StageGraph(timer)
+    out = {}
+
+    run_dir = await graph.arun(None, make_run_dir, user_query)
+    set_debug_dir(run_dir)
+
+    # 1) rewrite
+    effective_query = await graph.arun("rewrite", _rewrite_query, client, user_id, user_query)
+
+    # 2) route + normalize
+    route = await graph.arun(None, route_query, client, effective_query)
+    if route == "GLOBAL":
+        async for tok in _adrive(_global_answer_steps(effective_query), aclient, graph, out):
+            yield tok
+        _record_turn(user_id, user_query, out["result"])
+
+        await graph.arun(None, timer.finish, RAGConfig.enable_timing_log)
+        return
+
+    # 3) read_memory song song với normalize → retrieval
+    graph.submit("read_memory", _read_user_memory, client=client, user_id=user_id, query=effective_query)
+
+    norm_query = await graph.arun("normalize", normalize_query_fast, client, effective_query, kb=kb)
+
+    async for tok in _adrive(_prepare_steps(
+        client=client, kb=kb, run_dir=run_dir, timer=timer, graph=graph,
+        effective_query=effective_query, norm_query=norm_query, route=route,
+    ), aclient, graph, out):
+        yield tok
+    route, prep = out["result"]
+    if prep is None:
+        return
+
+    memory_prompt = _memory_prompt(await graph.aresult("read_memory", default=[]))
+
+    async for tok in _adrive(_final_answer_steps(
+        client=client, timer=timer, prep=prep, user_query=user_query, effective_query=effective_query,
+        norm_query=norm_query, memory_prompt=memory_prompt, recovery_query=user_query,
+    ), aclient, graph, out):
+        yield tok
+    final_answer = out["result"]
+
+    await graph.arun(None, _finish_turn, client, run_dir=run_dir, timer=timer, user_id=user_id,
+                     user_query=user_query, norm_query=norm_query, route=route, prep=prep,
+                     final_answer=final_answer)
@@ -1,6 +1,8 @@
 import json
 from typing import Dict, Any
 
+from rag.llm_cache import cached_chat, is_json
+
 
 def detect_l3_gaps(client, user_query: str, answer_text: str) -> Dict[str, Any]:
     """
@@ -105,7 +107,10 @@ CHỈ TRẢ JSON THEO SCHEMA
     }
 
     try:
-        resp = client.chat.completions.create(
+        content = cached_chat(
+            client,
+            "detect_l3_gaps",
+            validate=is_json,
             model="gpt-4.1-mini",
             temperature=0.0,
             max_completion_tokens=200,
@@ -116,7 +121,7 @@ CHỈ TRẢ JSON THEO SCHEMA
             ],
         )
 
-        data = json.loads(resp.choices[0].message.content)
+        data = json.loads(content)
         data.setdefault("is_complete", True)
         data.setdefault("missing_slots", [])
         data.setdefault("reason", "")
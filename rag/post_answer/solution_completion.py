@@ -1,7 +1,12 @@
 import json
+import threading
 from typing import List, Dict, Any, Tuple
-from rag.tag_filter import tag_filter_pipeline
-from rag.retriever import search as retrieve_search
+
+import numpy as np
+
+from rag.tag_filter import tag_filter_many, ontology_version
+from rag.retriever import search_many as retrieve_search_many, search_with_sims
+from rag.embedder import embed_texts
 from rag.config import RAGConfig
 from rag.logging.t4_logger import append_t4_log_to_csv
 
@@ -164,6 +169,96 @@ def validate_answer_readiness(slot_report: Dict[str, Any]) -> Dict[str, Any]:
     return {"status": "ok"}
 
 
+# -----------------------------
+# Slot query tĩnh (tính trước theo KB)
+# -----------------------------
+# L3 missing slot → query T4 cố định
+T4_SLOT_QUERIES = {
+    "need_herbicides": "thuốc trừ cỏ",
+    "need_pesticide": "thuốc trừ sâu",
+    "need_foliar_fertilizer": "phân bón lá",
+    "need_mix_compatibility": "pha chung thuốc",
+    "need_dosage_or_rate": "liều lượng pha",
+    "need_timing": "thời điểm phun",
+    "need_pest_or_disease": "đối tượng gây hại",
+}
+
+_SIMS_CHUNK_ROWS = 65536
+
+
+class T4SlotIndex:
+    """
+    Với mỗi query trong T4_SLOT_QUERIES: tag (must, any) + sims trên toàn KB.
+    T4 chỉ còn áp fallback any_tags của request + tag filter/ranking + dedupe,
+    không gọi embeddings, không quét KB.
+    Tag được tính lại (cục bộ) khi ontology reload; sims chỉ phụ thuộc KB.
+    """
+
+    def __init__(self, queries: List[str], sims: np.ndarray):
+        self.queries = list(queries)
+        self.sims = {q: np.ascontiguousarray(sims[:, j]) for j, q in enumerate(self.queries)}
+        self._tags = {}
+        self._tags_version = None
+
+    def __contains__(self, query: str) -> bool:
+        return query in self.sims
+
+    def tags(self, query: str) -> Tuple[List[str], List[str]]:
+        version = ontology_version()
+        if version != self._tags_version:
+            results = tag_filter_many(self.queries)
+            self._tags = {q: (r.get("must", []), r.get("any", [])) for q, r in zip(self.queries, results)}
+            self._tags_version = version
+        must, any_ = self._tags[query]
+        return list(must), list(any_)
+
+
+def build_t4_slot_index(client, kb, queries=None) -> T4SlotIndex:
+    queries = list(dict.fromkeys(queries or T4_SLOT_QUERIES.values()))
+    Q = embed_texts(client, queries)  # 1 lần gọi, sau đó nằm trong embedding cache
+    EMBS = kb[0]
+    # exact trên toàn KB (kể cả khi KB dùng ANN / lượng tử), đọc theo khối nếu EMBS là mmap
+    sims = np.empty((EMBS.shape[0], len(queries)), dtype=np.float32)
+    for a in range(0, EMBS.shape[0], _SIMS_CHUNK_ROWS):
+        b = min(a + _SIMS_CHUNK_ROWS, EMBS.shape[0])
+        sims[a:b] = np.asarray(EMBS[a:b], dtype=np.float32) @ Q.T
+    return T4SlotIndex(queries, sims)
+
+
+# EMBS id → (EMBS, T4SlotIndex); giữ tham chiếu EMBS để id() không bị tái sử dụng
+_SLOT_INDEXES: Dict[int, tuple] = {}
+_SLOT_INDEXES_MAX = 4
+_SLOT_LOCK = threading.Lock()
+
+
+def get_t4_slot_index(client, kb) -> T4SlotIndex:
+    """Index của KB này; chưa có thì build (1 lần embeddings cho cả 7 query)."""
+    EMBS = kb[0]
+    cached = _SLOT_INDEXES.get(id(EMBS))
+    if cached is not None and cached[0] is EMBS:
+        return cached[1]
+
+    with _SLOT_LOCK:
+        cached = _SLOT_INDEXES.get(id(EMBS))
+        if cached is not None and cached[0] is EMBS:
+            return cached[1]
+        idx = build_t4_slot_index(client, kb)
+        if len(_SLOT_INDEXES) >= _SLOT_INDEXES_MAX:
+            _SLOT_INDEXES.pop(next(iter(_SLOT_INDEXES)))
+        _SLOT_INDEXES[id(EMBS)] = (EMBS, idx)
+    return idx
+
+
+def warm_t4_slots(client, kb) -> bool:
+    """Gọi lúc worker load KB; lỗi (vd. chưa có mạng) thì để T4 build lười ở request đầu."""
+    try:
+        get_t4_slot_index(client, kb)
+        return True
+    except Exception as e:
+        print("[T4 SLOT WARM ERROR]:", e)
+        return False
+
+
 # -----------------------------
 # Execute T4 retrieval
 # -----------------------------
@@ -177,26 +272,57 @@ def _t4_retrieve(
     used_queries: set,
     top_k: int,
 ) -> List[dict]:
+    """
+    Tối đa 3 intent, độc lập nhau.
+    - query tĩnh (T4_SLOT_QUERIES): tag + sims lấy từ T4SlotIndex → không có round trip
+    - query khác: tag cả lô (tag_filter_many) rồi retrieve cả lô (search_many:
+      1 lần embed cho các query chưa có trong cache + 1 GEMM)
+    Dedupe với seen_ids chỉ làm SAU khi có đủ kết quả, theo đúng thứ tự intent
+    → kết quả không phụ thuộc thứ tự hoàn thành.
+    """
 
-    added = []
+    todo = []
     for it in intents[:3]:
         q = it["query"]
         if q in used_queries:
             continue
         used_queries.add(q)
+        todo.append(it)
+
+    slot_index = None
+    if bool(getattr(RAGConfig, "t4_slot_precompute", True)):
+        try:
+            slot_index = get_t4_slot_index(client, kb)
+        except Exception as e:
+            print("[T4 SLOT INDEX ERROR]:", e)
+
+    static = [it for it in todo if slot_index is not None and it["query"] in slot_index]
+    dynamic = [it for it in todo if slot_index is None or it["query"] not in slot_index]
+
+    def _fallback(must, any_):
+        return any_ if (must or any_) else (any_tags or [])
+
+    hits_for = {}
+    for it in static:
+        q = it["query"]
+        must, any_ = slot_index.tags(q)
+        hits_for[q] = search_with_sims(client, kb, q, slot_index.sims[q], top_k, must, _fallback(must, any_))
 
-        tag_result = tag_filter_pipeline(q)
+    planned = []
+    for it, tag_result in zip(dynamic, tag_filter_many([it["query"] for it in dynamic])):
+        q = it["query"]
         must = tag_result.get("must", [])
         any_ = tag_result.get("any", [])
+        planned.append((q, top_k, must, _fallback(must, any_)))
 
-        hits = retrieve_search(
-            client=client,
-            kb=kb,
-            norm_query=q,
-            top_k=top_k,
-            must_tags=must,
-            any_tags=any_ if (must or any_) else (any_tags or []),
-        )
+    # 1 lần embed + 1 GEMM cho mọi intent không tĩnh
+    for req, hits in zip(planned, retrieve_search_many(client, kb, planned)):
+        hits_for[req[0]] = hits
+
+    added = []
+    for it in todo:
+        q = it["query"]
+        hits = hits_for[q]
         unique = _dedupe_hits(hits, seen_ids)
         for h in unique:
             h["t4_origin_query"] = q
@@ -243,20 +369,8 @@ def run_solution_completion(
 
         # map slot → query
         for s in l3_missing_slots:
-            if s == "need_herbicides":
-                intents.append({"slot": s, "query": "thuốc trừ cỏ"})
-            elif s == "need_pesticide":
-                intents.append({"slot": s, "query": "thuốc trừ sâu"})
-            elif s == "need_foliar_fertilizer":
-                intents.append({"slot": s, "query": "phân bón lá"})
-            elif s == "need_mix_compatibility":
-                intents.append({"slot": s, "query": "pha chung thuốc"})
-            elif s == "need_dosage_or_rate":
-                intents.append({"slot": s, "query": "liều lượng pha"})
-            elif s == "need_timing":
-                intents.append({"slot": s, "query": "thời điểm phun"})
-            elif s == "need_pest_or_disease":
-                intents.append({"slot": s, "query": "đối tượng gây hại"})
+            if isinstance(s, str) and s in T4_SLOT_QUERIES:
+                intents.append({"slot": s, "query": T4_SLOT_QUERIES[s]})
 
         t4_top_k = int(getattr(RAGConfig, "t4_top_k", max(8, RAGConfig.multi_hop_top_k // 2)))
 
@@ -0,0 +1,126 @@
+"""
+Embedding lượng tử hoá (float16 / int8 scalar quantizer của FAISS) cho lượt quét đầu.
+
+Quét toàn KB trên bản lượng tử (2–4× ít byte hơn float32) để lấy vài trăm ứng viên,
+sau đó retriever rescore exact float32 chỉ trên các dòng đó. Với KB columnar,
+EMBS float32 là mmap → chỉ các dòng ứng viên được đọc vào RAM.
+
+Ghi sẵn vào KB columnar (converter) hoặc build lúc load KB:
+    python -m rag.quantize data-kd-1-4-1-2-2026-focus-product.kbcol --mode int8 --save
+Báo cáo overlap top-k so với exact:
+    python -m rag.quantize data-kd-1-4-1-2-2026-focus-product.npz --mode int8
+"""
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:  # faiss-cpu là optional cho embedding lượng tử
+    faiss = None
+
+from rag.config import RAGConfig
+
+QUANT_MODES = ("fp16", "int8")
+
+
+class QuantizedEmbeddings:
+    def __init__(self, index, mode: str):
+        self.index = index
+        self.mode = mode
+        self.ntotal = int(index.ntotal)
+
+    @classmethod
+    def build(cls, embs: np.ndarray, mode: str = "int8") -> "QuantizedEmbeddings":
+        if faiss is None:
+            raise RuntimeError("faiss-cpu is required for quantized embeddings")
+        if mode not in QUANT_MODES:
+            raise ValueError(f"Unknown quantization mode {mode!r}, expected one of {QUANT_MODES}")
+
+        x = np.ascontiguousarray(np.asarray(embs, dtype=np.float32))
+        qtype = faiss.ScalarQuantizer.QT_fp16 if mode == "fp16" else faiss.ScalarQuantizer.QT_8bit
+        index = faiss.IndexScalarQuantizer(x.shape[1], qtype, faiss.METRIC_INNER_PRODUCT)
+        index.train(x)
+        index.add(x)
+        return cls(index, mode)
+
+    @classmethod
+    def load(cls, path, mode: str) -> "QuantizedEmbeddings":
+        if faiss is None:
+            raise RuntimeError("faiss-cpu is required for quantized embeddings")
+        return cls(faiss.read_index(str(path)), mode)
+
+    def save(self, path):
+        faiss.write_index(self.index, str(path))
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.index.code_size) * self.ntotal
+
+    def candidates(self, Q: np.ndarray, k: int) -> np.ndarray:
+        """Q [m, d] → doc ids [m, k] theo điểm xấp xỉ trên bản lượng tử."""
+        k = max(1, min(int(k), self.ntotal))
+        Q = np.ascontiguousarray(np.asarray(Q, dtype=np.float32).reshape(-1, self.index.d))
+        _, I = self.index.search(Q, k)
+        return I
+
+
+def rescore_k_for(top_k: int) -> int:
+    return max(int(RAGConfig.quantized_rescore_k), int(RAGConfig.ann_overfetch) * int(top_k))
+
+
+def quantized_path(kb_path, mode: str) -> Path:
+    """File lượng tử nằm cạnh KB columnar: <kb>.kbcol/embeddings.<mode>.faiss"""
+    return Path(kb_path) / f"embeddings.{mode}.faiss"
+
+
+def build_quantized(embs, kb_path=None, mode=None):
+    """
+    Load bản lượng tử đã ghi sẵn trong KB columnar (nếu có), không thì build từ EMBS.
+    Trả về None khi RAGConfig.embedding_quantization = None.
+    """
+    mode = mode or RAGConfig.embedding_quantization
+    if not mode:
+        return None
+    if kb_path is not None and Path(kb_path).is_dir():
+        p = quantized_path(kb_path, mode)
+        if p.exists():
+            q = QuantizedEmbeddings.load(p, mode)
+            if q.ntotal != len(embs):
+                raise ValueError(f"Quantized embeddings {p} have {q.ntotal} rows, KB has {len(embs)}")
+            return q
+    return QuantizedEmbeddings.build(embs, mode)
+
+
+if __name__ == "__main__":
+    from rag.kb_loader import load_kb
+    from rag.ann_index import candidate_report, print_report
+
+    parser = argparse.ArgumentParser(description="Quantize KB embeddings and report top-k overlap vs exact float32")
+    parser.add_argument("kb", help="KB path (.npz or .kbcol directory)")
+    parser.add_argument("--mode", default="int8", choices=QUANT_MODES)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--save", action="store_true", help="write embeddings.<mode>.faiss into the .kbcol directory")
+    args = parser.parse_args()
+
+    EMBS = load_kb(args.kb)[0]
+
+    t0 = time.perf_counter()
+    q = QuantizedEmbeddings.build(EMBS, args.mode)
+    build_s = time.perf_counter() - t0
+
+    if args.save:
+        if not Path(args.kb).is_dir():
+            parser.error("--save needs a columnar KB directory (convert with python -m rag.kb_columnar)")
+        out = quantized_path(args.kb, args.mode)
+        q.save(out)
+        print(f"[QUANT] saved {args.mode} embeddings -> {out}")
+
+    f32_mb = EMBS.shape[0] * EMBS.shape[1] * 4 / (1024 * 1024)
+    print_report(
+        f"[QUANT REPORT] mode={args.mode} docs={len(EMBS)} dim={EMBS.shape[1]} build={build_s:.3f}s "
+        f"size={q.nbytes / (1024 * 1024):.2f}MB (float32 {f32_mb:.2f}MB)",
+        candidate_report(EMBS, q, rescore_k_for, num_queries=args.queries),
+    )
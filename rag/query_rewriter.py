@@ -3,6 +3,8 @@ from __future__ import annotations
 from typing import List
 import re
 
+from rag.llm_cache import cached_chat
+
 REFERENCE_PATTERNS = [
     r"\bđó\b", r"\bnày\b", r"\bkia\b",
     r"\bcái đó\b", r"\bcái này\b",
@@ -43,7 +45,9 @@ def rewrite_query_with_llm(client, user_query: str, history_text: str) -> str:
     )
     user = f"HỘI THOẠI GẦN NHẤT:\n{history_text}\n\nCÂU HỎI HIỆN TẠI:\n{user_query}"
 
-    resp = client.chat.completions.create(
+    content = cached_chat(
+        client,
+        "rewrite_query_with_llm",
         model="gpt-4.1-mini",
         temperature=0,
         max_completion_tokens=120,
@@ -52,6 +56,6 @@ def rewrite_query_with_llm(client, user_query: str, history_text: str) -> str:
             {"role": "user", "content": user},
         ],
     )
-    rewritten = (resp.choices[0].message.content or "").strip()
+    rewritten = content.strip()
     # Fallback nếu model trả rỗng
     return rewritten if rewritten else user_query
@@ -24,3 +24,110 @@ class PipelineResult:
     norm_query: str
     strategy: str
     profile: Dict[str, Any]
+
+
+class KBHit(dict):
+    """
+    Hit trả về từ retriever.search(): vẫn là dict như trước, nhưng các trường text
+    (question / alt_question / answer / category / entity_type / tags_v2|tags)
+    chỉ được đọc từ KB (có thể là cột mmap) khi có code thực sự truy cập.
+
+    Mang theo (kb_row, score, tag_score):
+    - "id", "score" có sẵn trong dict
+    - kb_row, tag_score là attribute (không thêm key mới vào dict)
+    """
+
+    __slots__ = ("kb", "kb_row", "tag_score", "_lazy")
+
+    def __init__(self, kb, kb_row: int, score: float, tag_score: int = 0):
+        EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS, TAGS_V2, ENTITY_TYPE = _kb_columns(kb)
+        super().__init__(
+            id=str(IDS[kb_row]) if IDS is not None else "",
+            score=float(score),
+        )
+        self.kb = kb
+        self.kb_row = int(kb_row)
+        self.tag_score = int(tag_score)
+
+        lazy = {
+            "question": QUESTIONS,
+            "alt_question": ALT_QUESTIONS,
+            "answer": ANSWERS,
+        }
+        if CATEGORY is not None:
+            lazy["category"] = CATEGORY
+        if ENTITY_TYPE is not None:
+            lazy["entity_type"] = ENTITY_TYPE
+        # Prefer tags_v2 for debug/metadata
+        if TAGS_V2 is not None:
+            lazy["tags_v2"] = TAGS_V2
+        elif TAGS is not None:
+            lazy["tags"] = TAGS
+        self._lazy = lazy
+
+    def _fetch(self, key):
+        col = self._lazy.pop(key)
+        value = str(col[self.kb_row]) if col is not None else ""
+        dict.setdefault(self, key, value)
+
+    def materialize(self) -> "KBHit":
+        for key in list(self._lazy):
+            self._fetch(key)
+        return self
+
+    def __getitem__(self, key):
+        if key in self._lazy:
+            self._fetch(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if key in self._lazy:
+            self._fetch(key)
+        return dict.get(self, key, default)
+
+    def __contains__(self, key):
+        return key in self._lazy or dict.__contains__(self, key)
+
+    def __setitem__(self, key, value):
+        self._lazy.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def setdefault(self, key, default=None):
+        if key in self._lazy:
+            self._fetch(key)
+        return dict.setdefault(self, key, default)
+
+    def pop(self, key, *default):
+        if key in self._lazy:
+            self._fetch(key)
+        return dict.pop(self, key, *default)
+
+    # Các API duyệt toàn bộ dict (json.dump, dict(h), {**h}, log) → đọc hết text
+    def __iter__(self):
+        return dict.__iter__(self.materialize())
+
+    def __len__(self):
+        return dict.__len__(self) + len(self._lazy)
+
+    def keys(self):
+        return dict.keys(self.materialize())
+
+    def values(self):
+        return dict.values(self.materialize())
+
+    def items(self):
+        return dict.items(self.materialize())
+
+    def copy(self):
+        return dict(self.materialize())
+
+    def __repr__(self):
+        return dict.__repr__(self.materialize())
+
+
+def _kb_columns(kb):
+    # Backward compatibility: KB 7 cột cũ không có TAGS_V2 / ENTITY_TYPE
+    if len(kb) >= 9:
+        return tuple(kb[:9])
+    EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS = kb
+    return EMBS, QUESTIONS, ANSWERS, ALT_QUESTIONS, CATEGORY, TAGS, IDS, None, None
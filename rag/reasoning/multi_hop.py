@@ -1,10 +1,13 @@
 import json
+from concurrent.futures import Future
 from typing import List, Dict, Tuple, Any
 
 from rag.config import RAGConfig
 from rag.logging.multi_hop_logger import write_multi_hop_logs
-from rag.retriever import search as retrieve_search
-from rag.tag_filter import tag_filter_pipeline
+from rag.retriever import search as retrieve_search, search_many as retrieve_search_many
+from rag.tag_filter import tag_filter_pipeline, tag_filter_many
+from rag.stage_graph import gather
+from rag.llm_cache import cached_chat, is_json
 
 
 # -----------------------------
@@ -31,7 +34,10 @@ Chỉ trả về JSON hợp lệ theo schema:
 }
 """
     try:
-        resp = client.chat.completions.create(
+        content = cached_chat(
+            client,
+            "analyze_intent_strategy",
+            validate=is_json,
             model="gpt-4.1-mini",
             temperature=0,
             response_format={"type": "json_object"},
@@ -40,7 +46,7 @@ Chỉ trả về JSON hợp lệ theo schema:
                 {"role": "user", "content": query},
             ],
         )
-        data = json.loads(resp.choices[0].message.content)
+        data = json.loads(content)
         if not isinstance(data, dict):
             return {"primary_target": "", "fallback_targets": []}
         data.setdefault("primary_target", "")
@@ -190,12 +196,15 @@ Rules:
 - Output MUST be a JSON array in Vietnamese
 - No explanations
 """
-    resp = client.chat.completions.create(
+    content = cached_chat(
+        client,
+        "infer_pest_from_problem",
+        validate=lambda c: bool(safe_json_array(c)),
         model="gpt-4.1",
         messages=[{"role": "user", "content": prompt}],
         temperature=0.3,
     )
-    arr = safe_json_array(resp.choices[0].message.content)
+    arr = safe_json_array(content)
 
     # light normalize (optional)
     out = []
@@ -251,12 +260,15 @@ Rules:
 - Output MUST be a JSON array in Vietnamese
 - No explanations
 """
-    resp = client.chat.completions.create(
+    content = cached_chat(
+        client,
+        "infer_mechanism_from_pest",
+        validate=lambda c: bool(safe_json_array(c)),
         model="gpt-4.1",
         messages=[{"role": "user", "content": prompt}],
         temperature=0.3,
     )
-    arr = safe_json_array(resp.choices[0].message.content)
+    arr = safe_json_array(content)
 
     # sanitize + de-dup
     cleaned = []
@@ -296,12 +308,15 @@ Rules:
 - No explanations
 - Return JSON array in Vietnamese
 """
-    resp = client.chat.completions.create(
+    content = cached_chat(
+        client,
+        "infer_disease_from_symptom",
+        validate=lambda c: bool(safe_json_array(c)),
         model="gpt-4.1",
         messages=[{"role": "user", "content": prompt}],
         temperature=0.3,
     )
-    return safe_json_array(resp.choices[0].message.content)
+    return safe_json_array(content)
 
 def infer_mechanism_from_disease(client, base_query: str) -> List[str]:
     prompt = f"""
@@ -324,13 +339,16 @@ Rules:
 - Do NOT mention any product names
 - Return JSON array only
 """
-    resp = client.chat.completions.create(
+    content = cached_chat(
+        client,
+        "infer_mechanism_from_disease",
+        validate=lambda c: bool(safe_json_array(c)),
         model="gpt-4.1",
         messages=[{"role": "user", "content": prompt}],
         temperature=0.3,
     )
 
-    return safe_json_array(resp.choices[0].message.content)
+    return safe_json_array(content)
 
 def infer_formula_queries(client, base_query: str) -> List[str]:
     prompt = f"""
@@ -351,13 +369,16 @@ Rules:
 - Do NOT include product names
 - Return JSON array only
 """
-    resp = client.chat.completions.create(
+    content = cached_chat(
+        client,
+        "infer_formula_queries",
+        validate=lambda c: bool(safe_json_array(c)),
         model="gpt-4.1",
         messages=[{"role": "user", "content": prompt}],
         temperature=0.3,
     )
 
-    return safe_json_array(resp.choices[0].message.content)
+    return safe_json_array(content)
 
 def expand_query_with_llm(client, base_query: str) -> List[str]:
     prompt = f"""
@@ -385,13 +406,16 @@ def expand_query_with_llm(client, base_query: str) -> List[str]:
     "Difenoconazole"
     ]
     """
-    resp = client.chat.completions.create(
+    content = cached_chat(
+        client,
+        "expand_query_with_llm",
+        validate=lambda c: bool(safe_json_array(c)),
         model="gpt-4.1",
         messages=[{"role": "user", "content": prompt}],
         temperature=0.4,
     )
 
-    return safe_json_array(resp.choices[0].message.content)
+    return safe_json_array(content)
 
 def infer_product_intent_queries(client, base_query: str) -> List[str]:
     prompt = f"""
@@ -410,13 +434,16 @@ Rules:
 - No brand names unless user already mentioned one
 - Return JSON array only
 """
-    resp = client.chat.completions.create(
+    content = cached_chat(
+        client,
+        "infer_product_intent_queries",
+        validate=lambda c: bool(safe_json_array(c)),
         model="gpt-4.1",
         messages=[{"role": "user", "content": prompt}],
         temperature=0.4,
     )
 
-    return safe_json_array(resp.choices[0].message.content)
+    return safe_json_array(content)
 
 def decide_recovery_branch(any_tags):
     if any(t.startswith("pest:") for t in any_tags):
@@ -444,66 +471,72 @@ def no_hit_recovery_pipeline(
     all_hits = []
     seen_ids = set()
     branch = decide_recovery_branch(any_tags)
-    # ========= 1. Sinh recovery hypotheses =========
+    # ========= 1. Sinh recovery hypotheses (song song) =========
+    # các LLM call độc lập → chạy cùng lúc, chung 1 deadline; call lỗi / quá hạn → []
     if branch == "pest":
-        recovery_queries = {
-            "pest": infer_pest_from_problem(client, base_query),
-            "mechanism": infer_mechanism_from_pest(client, base_query),
-            "formula": infer_formula_queries(client, base_query),
-            "expand": expand_query_with_llm(client, base_query),
+        strategies = {
+            "pest": infer_pest_from_problem,
+            "mechanism": infer_mechanism_from_pest,
+            "formula": infer_formula_queries,
+            "expand": expand_query_with_llm,
         }
 
     elif branch == "disease":
-        recovery_queries = {
-            "disease": infer_disease_from_symptom(client, base_query),
-            "mechanism": infer_mechanism_from_disease(client, base_query),
-            "formula": infer_formula_queries(client, base_query),
-            "expand": expand_query_with_llm(client, base_query),
+        strategies = {
+            "disease": infer_disease_from_symptom,
+            "mechanism": infer_mechanism_from_disease,
+            "formula": infer_formula_queries,
+            "expand": expand_query_with_llm,
         }
 
     else:
-        recovery_queries = {
-            "expand": expand_query_with_llm(client, base_query),
-            "formula": infer_formula_queries(client, base_query),
+        strategies = {
+            "expand": expand_query_with_llm,
+            "formula": infer_formula_queries,
         }
 
+    recovery_queries = gather(
+        {mode: (lambda fn=fn: fn(client, base_query)) for mode, fn in strategies.items()},
+        timeout=float(_get_cfg("recovery_llm_timeout", 20)),
+        default=[],
+    )
+
     # ========= 2. Thu thập bằng chứng song song =========
-    for mode, queries in recovery_queries.items():
-        print(f" - {mode}:")
-        for q in queries:
-            print("    •", q)
-            tag_result = tag_filter_pipeline(q)
-            print("  tags:", tag_result)
-            must = tag_result.get("must", [])
-            any_  = tag_result.get("any", [])
-            # # 🚫 Reject ungrounded queries (no ontology anchor)
-            # if not must and not any_:
-            #     print("  ⚠ SKIP (no tags) →", q)
-            #     continue
-            # FORMULA: dùng tag sinh ra, không dùng any_tags gốc
-            if mode == "formula":
-                any_ = any_
-
-            hits = retrieve_search(
-                client=client,
-                kb=kb,
-                norm_query=q,
-                top_k=top_k,
-                must_tags=must,
-                any_tags=any_,
-            )
-            print(f"  hits={len(hits)}")
-
-            for h in hits:
-                print(f"    + ADD doc {h.get('id')} score={h.get('score'):.4f}")
-                doc_id = h.get("id")
-                if doc_id in seen_ids:
-                    continue
-                seen_ids.add(doc_id)
+    # tag cả lô, rồi retrieve cả lô bằng 1 lần embed + 1 GEMM
+    flat = [(mode, q) for mode, queries in recovery_queries.items() for q in (queries or [])]
+    tag_results = tag_filter_many([q for _, q in flat])
+
+    planned = []
+    for (mode, q), tag_result in zip(flat, tag_results):
+        print(f" - {mode}:", q)
+        print("  tags:", tag_result)
+        must = tag_result.get("must", [])
+        any_  = tag_result.get("any", [])
+        # # 🚫 Reject ungrounded queries (no ontology anchor)
+        # if not must and not any_:
+        #     print("  ⚠ SKIP (no tags) →", q)
+        #     continue
+        planned.append((mode, q, must, any_))
+
+    batch_hits = retrieve_search_many(
+        client,
+        kb,
+        [(q, top_k, must, any_) for _, q, must, any_ in planned],
+    )
 
-                h["recovery_mode"] = mode
-                h["origin_query"] = q
-                all_hits.append(h)
+    for (mode, q, _, _), hits in zip(planned, batch_hits):
+        print(f"  [{mode}] {q} hits={len(hits)}")
+
+        for h in hits:
+            print(f"    + ADD doc {h.get('id')} score={h.get('score'):.4f}")
+            doc_id = h.get("id")
+            if doc_id in seen_ids:
+                continue
+            seen_ids.add(doc_id)
+
+            h["recovery_mode"] = mode
+            h["origin_query"] = q
+            all_hits.append(h)
 
     print("\n[TOTAL RECOVERED DOCS]", len(all_hits))
     from collections import Counter
@@ -567,7 +600,13 @@ def multi_hop_controller(
     base_query: str,
     must_tags: List[str],
     any_tags: List[str],
+    intent_hint: Any = None,
 ) -> List[dict]:
+    """
+    intent_hint: kết quả analyze_intent_strategy nếu caller đã có, hoặc Future của nó
+    (pipeline chạy song song với HOP 1). Hint chỉ ghi vào log multi-hop nên Future
+    chỉ được join lúc ghi log. None → tự gọi như cũ.
+    """
 
     # ---- Config ----
     top_k   = int(_get_cfg("multi_hop_top_k", 20))
@@ -617,9 +656,23 @@ def multi_hop_controller(
     hops_data: List[dict] = []
     used_queries = set()
 
-    intent_hint = analyze_intent_strategy(client, base_query)
+    if intent_hint is None:
+        intent_hint = analyze_intent_strategy(client, base_query)
     used_queries.add(base_query)
 
+    def _write_logs():
+        if isinstance(intent_hint, Future):
+            try:
+                hint = intent_hint.result()
+            except Exception:
+                hint = {"primary_target": "", "fallback_targets": []}
+            hops_data[0]["decision"]["intent_hint"] = hint
+        write_multi_hop_logs(
+            original_query=base_query,
+            hops_data=hops_data,
+            final_hits=all_hits,
+        )
+
     # =========================
     # HOP 1 — Ontology-driven retrieval
     # =========================
@@ -671,26 +724,18 @@ def multi_hop_controller(
                 continue
             seed_queries.append(f"{base_query} {ai}")
 
-        # 3) Iterate over a frozen list
-        for q in list(seed_queries):
-            q = _ensure_str_query(q, "hop1_tag_expand_seed")
-
-            tag_result = tag_filter_pipeline(q)
+        # 3) Tag từng seed query (frozen list), rồi retrieve cả lô 1 lần
+        planned = []
+        seed_queries = [_ensure_str_query(q, "hop1_tag_expand_seed") for q in seed_queries]
+        for q, tag_result in zip(seed_queries, tag_filter_many(seed_queries)):
             must, any_ = _safe_extract_ai_tags(tag_result)
 
             # ontology guard
             if not must and not any_:
                 continue
+            planned.append((q, top_k, must, any_))
 
-            hits = retrieve_search(
-                client=client,
-                kb=kb,
-                norm_query=q,
-                top_k=top_k,
-                must_tags=must,
-                any_tags=any_,
-            )
-
+        for hits in retrieve_search_many(client, kb, planned):
             new_hits = _dedupe_hits(hits, seen_ids)
             if new_hits:
                 unique_hits1.extend(new_hits)
@@ -700,22 +745,15 @@ def multi_hop_controller(
         # Only append ingredient names, NEVER append tag_result dict.
         if not unique_hits1 and active_ingredients:
             ai_queries = [f"hoạt chất {ai}" for ai in active_ingredients if ai.strip()]
-            for q in ai_queries:
-                q = _ensure_str_query(q, "hop1_ai_queries")
-
-                tag_result = tag_filter_pipeline(q)
+            planned = []
+            ai_queries = [_ensure_str_query(q, "hop1_ai_queries") for q in ai_queries]
+            for q, tag_result in zip(ai_queries, tag_filter_many(ai_queries)):
                 must, any_ = _safe_extract_ai_tags(tag_result)
                 if not must and not any_:
                     continue
+                planned.append((q, top_k, must, any_))
 
-                hits = retrieve_search(
-                    client=client,
-                    kb=kb,
-                    norm_query=q,
-                    top_k=top_k,
-                    must_tags=must,
-                    any_tags=any_,
-                )
+            for hits in retrieve_search_many(client, kb, planned):
                 new_hits = _dedupe_hits(hits, seen_ids)
                 if new_hits:
                     unique_hits1.extend(new_hits)
@@ -741,11 +779,7 @@ def multi_hop_controller(
     if len(all_hits) >= min_docs:
         hops_data[-1]["decision"]["stop_reason"] = f"enough_docs_after_hop1>={min_docs}"
         if enable_logs:
-            write_multi_hop_logs(
-                original_query=base_query,
-                hops_data=hops_data,
-                final_hits=all_hits,
-            )
+            _write_logs()
         return all_hits
 
     # =========================
@@ -832,10 +866,6 @@ def multi_hop_controller(
         current_query = next_query
 
     if enable_logs:
-        write_multi_hop_logs(
-            original_query=base_query,
-            hops_data=hops_data,
-            final_hits=all_hits,
-        )
+        _write_logs()
 
     return all_hits
@@ -0,0 +1,119 @@
+"""
+Cache kết quả retrieval quanh search() / search_many().
+
+key = (fingerprint KB, backend, norm_query, top_k, must_tags, any_tags)
+value = danh sách (row, score, tag_score) đã xếp hạng — đủ để dựng lại KBHit
+mà không cần embed query hay quét KB.
+
+fingerprint = hash nội dung KB (embeddings + ids + tags_v2) → đổi KB (reload,
+convert lại, đổi tag) thì key tự đổi, không bao giờ trả kết quả của KB cũ.
+"""
+import hashlib
+
+import numpy as np
+
+from rag.cache import LRUCache
+from rag.config import RAGConfig
+from rag.kb_columnar import StringColumn, _encode_strings
+
+_HASH_CHUNK_ROWS = 8192
+
+_ADHOC_FINGERPRINTS = {}
+_ADHOC_MAX = 8
+
+
+def _update_array(h, arr):
+    arr = np.asarray(arr)
+    h.update(f"{arr.dtype.str}{arr.shape}".encode("utf-8"))
+    # EMBS có thể là mmap lớn → hash theo từng khúc dòng
+    for start in range(0, arr.shape[0], _HASH_CHUNK_ROWS):
+        h.update(np.ascontiguousarray(arr[start:start + _HASH_CHUNK_ROWS]).tobytes())
+
+
+def _update_strings(h, col):
+    if col is None:
+        h.update(b"\x00none")
+        return
+    # cùng layout offsets + UTF-8 với KB columnar → NPZ và .kbcol cùng nội dung cho cùng fingerprint
+    offsets, data = (col.offsets, col.data) if isinstance(col, StringColumn) else _encode_strings(col)
+    _update_array(h, offsets)
+    _update_array(h, data)
+
+
+def kb_fingerprint(columns) -> str:
+    """Hash nội dung những cột quyết định kết quả retrieval: EMBS, IDS, TAGS_V2."""
+    h = hashlib.blake2b(digest_size=16)
+    _update_array(h, columns[0])
+    _update_strings(h, columns[6] if len(columns) > 6 else None)
+    _update_strings(h, columns[7] if len(columns) > 7 else None)
+    return h.hexdigest()
+
+
+def get_kb_fingerprint(kb) -> str:
+    fp = getattr(kb, "fingerprint", None)
+    if fp is not None:
+        return fp
+
+    # KB tuple thường (script / test tay): hash 1 lần theo identity của EMBS
+    EMBS = kb[0]
+    key = id(EMBS)
+    cached = _ADHOC_FINGERPRINTS.get(key)
+    if cached is not None and cached[0] is EMBS:
+        return cached[1]
+
+    fp = kb_fingerprint(kb)
+    if len(_ADHOC_FINGERPRINTS) >= _ADHOC_MAX:
+        _ADHOC_FINGERPRINTS.pop(next(iter(_ADHOC_FINGERPRINTS)))
+    _ADHOC_FINGERPRINTS[key] = (EMBS, fp)
+    return fp
+
+
+def _backend_label(kb) -> str:
+    # ANN / lượng tử có thể cho top-k khác exact → tách key theo backend
+    ann = getattr(kb, "ann_index", None)
+    quant = getattr(kb, "quantized", None)
+    if ann is not None:
+        return f"ann:{ann.kind}"
+    if quant is not None:
+        return f"quant:{quant.mode}"
+    return "exact"
+
+
+class RetrievalCache:
+    def __init__(self, maxsize: int, ttl_seconds=None):
+        self.lru = LRUCache(maxsize=maxsize, ttl_seconds=ttl_seconds)
+
+    @property
+    def enabled(self) -> bool:
+        return self.lru.maxsize > 0
+
+    def key(self, kb, norm_query: str, top_k: int, must_tags=None, any_tags=None):
+        return (
+            get_kb_fingerprint(kb),
+            _backend_label(kb),
+            norm_query,
+            int(top_k),
+            tuple(must_tags or ()),
+            tuple(any_tags or ()),
+        )
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        return self.lru.get(key)
+
+    def put(self, key, rows):
+        if self.enabled:
+            self.lru.put(key, tuple(rows))
+
+    def clear(self):
+        self.lru.clear()
+
+    def stats(self) -> dict:
+        return self.lru.stats()
+
+
+retrieval_cache = RetrievalCache(
+    maxsize=int(getattr(RAGConfig, "retrieval_cache_size", 2048)),
+    ttl_seconds=getattr(RAGConfig, "retrieval_cache_ttl", 3600),
+)
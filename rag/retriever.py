@@ -1,10 +1,13 @@
-import re
-import json
 import numpy as np
 from rag.config import RAGConfig
 from rag.reranker import llm_rerank
-from rag.logging.debug_log import debug_log
-from rag.embedder import embed_text
+from rag.logging.debug_log import debug_log, debug_enabled
+from rag.embedder import embed_text, embed_texts
+from rag.tag_index import get_tag_index
+from rag.rag_types import KBHit
+from rag.ann_index import fetch_k_for
+from rag.quantize import rescore_k_for
+from rag.retrieval_cache import retrieval_cache
 
 def parse_doc_tags(doc):
     """
@@ -55,7 +58,159 @@ def parse_doc_tags(doc):
 
     return tags
 
+def rank_filtered(sims: np.ndarray, tag_scores: np.ndarray, pass_mask, top_k: int) -> np.ndarray:
+    """
+    Top-k dòng pass filter, xếp theo (tag_score desc, sim desc).
+    argpartition chỉ giữ top_k ứng viên, sau đó lexsort trên nhóm nhỏ đó.
+    """
+    rows = np.arange(sims.shape[0]) if pass_mask is None else np.flatnonzero(pass_mask)
+    # backend ANN: dòng không được rescore có sim = -inf
+    rows = rows[np.isfinite(sims[rows])]
+    if rows.size == 0 or top_k <= 0:
+        return rows[:0]
+
+    if rows.size > top_k:
+        # |sim| < 2 nên tag_score * 4 + sim giữ đúng thứ tự (tag_score, sim)
+        key = tag_scores[rows] * 4.0 + sims[rows]
+        part = np.argpartition(-key, top_k - 1)[:top_k]
+        rows = rows[part]
+
+    order = np.lexsort((-sims[rows], -tag_scores[rows]))
+    return rows[order]
+
+def _candidate_index(kb):
+    """(index, fetch_k) dùng cho lượt quét đầu; (None, None) = brute force exact."""
+    ann = getattr(kb, "ann_index", None)
+    if ann is not None:
+        return ann, fetch_k_for
+    quantized = getattr(kb, "quantized", None)
+    if quantized is not None:
+        return quantized, rescore_k_for
+    return None, None
+
+def similarities(kb, Q: np.ndarray, requests) -> list:
+    """
+    sims cho từng query (Q [m, d]), requests[j] = (top_k, must_tags, any_tags).
+
+    - exact: 1 GEMM EMBS @ Q.T
+    - ANN (kb.ann_index) hoặc embedding lượng tử (kb.quantized): lấy ứng viên
+      over-fetch + mọi doc nằm trong postings của must/any tags, rescore exact
+      float32 trên các dòng đó; dòng còn lại = -inf (rank_filtered bỏ qua).
+    """
+    EMBS = kb[0]
+    index, fetch_k_of = _candidate_index(kb)
+
+    if index is None:
+        S = np.asarray(EMBS, dtype=np.float32) @ Q.T
+        return [np.ascontiguousarray(S[:, j]) for j in range(S.shape[1])]
+
+    tag_index = get_tag_index(kb)
+    fetch_k = max(fetch_k_of(top_k) for top_k, _, _ in requests)
+    cand = index.candidates(Q, fetch_k)
+
+    out = []
+    for j, (_, must_tags, any_tags) in enumerate(requests):
+        rows = cand[j][cand[j] >= 0]
+        tag_rows = tag_index.docs_with_any(list(must_tags or []) + list(any_tags or []))
+        if tag_rows.size:
+            rows = np.union1d(rows, tag_rows)
+        else:
+            rows = np.sort(rows)
+        sims = np.full(EMBS.shape[0], -np.inf, dtype=np.float32)
+        # EMBS có thể là mmap → chỉ đọc các dòng ứng viên
+        sims[rows] = np.asarray(EMBS[rows], dtype=np.float32) @ Q[j]
+        out.append(sims)
+    return out
+
 def search(client, kb, norm_query: str, top_k: int, must_tags=None, any_tags=None):
+    # --- Retrieval cache: trúng thì không embed, không quét KB ---
+    key = retrieval_cache.key(kb, norm_query, top_k, must_tags, any_tags)
+    rows = retrieval_cache.get(key)
+    if rows is not None:
+        print('[RETRIEVAL CACHE HIT] norm_query: ', norm_query)
+        return _hits_from_rows(client, kb, norm_query, rows)
+
+    # --- Query embedding ---
+    q = embed_text(client, norm_query)
+
+    # --- Similarity ---
+    sims = similarities(kb, q.reshape(1, -1), [(top_k, must_tags, any_tags)])[0]
+
+    rows = _search_with_sims(kb, norm_query, sims, top_k, must_tags, any_tags)
+    retrieval_cache.put(key, rows)
+    return _hits_from_rows(client, kb, norm_query, rows)
+
+def search_many(client, kb, requests):
+    """
+    Batch nhiều search() trên cùng KB:
+    requests = [(norm_query, top_k, must_tags, any_tags), ...]
+
+    - request đã có trong retrieval cache không embed / quét lại
+    - embed mọi query khác nhau còn lại trong 1 lần gọi embeddings
+    - 1 phép nhân ma trận EMBS @ Q cho cả batch
+    - tag filter / ranking áp dụng riêng cho từng request trên cột sims tương ứng
+
+    Trả về list kết quả, cùng thứ tự và cùng format với search().
+    """
+    requests = [tuple(r) for r in (requests or [])]
+    if not requests:
+        return []
+
+    keys = [retrieval_cache.key(kb, *r) for r in requests]
+    rows_for = {}
+    for key, r in zip(keys, requests):
+        if key in rows_for:
+            continue
+        rows = retrieval_cache.get(key)
+        if rows is not None:
+            print('[RETRIEVAL CACHE HIT] norm_query: ', r[0])
+            rows_for[key] = rows
+
+    pending = list({key: r for key, r in zip(keys, requests) if key not in rows_for}.items())
+    if pending:
+        queries = list(dict.fromkeys(r[0] for _, r in pending))
+        col = {q: j for j, q in enumerate(queries)}
+
+        Q = embed_texts(client, queries)
+        if _candidate_index(kb)[0] is None:
+            # exact: 1 GEMM cho mọi query khác nhau
+            sims_all = similarities(kb, Q, [(0, None, None)] * len(queries))
+            sims_for = [sims_all[col[r[0]]] for _, r in pending]
+        else:
+            # ANN / lượng tử: ứng viên phụ thuộc top_k + tag của từng request
+            Q_req = Q[[col[r[0]] for _, r in pending]]
+            sims_for = similarities(kb, Q_req, [(r[1], r[2], r[3]) for _, r in pending])
+
+        for (key, (norm_query, top_k, must_tags, any_tags)), sims in zip(pending, sims_for):
+            rows = _search_with_sims(kb, norm_query, sims, top_k, must_tags, any_tags)
+            retrieval_cache.put(key, rows)
+            rows_for[key] = rows
+
+    return [_hits_from_rows(client, kb, r[0], rows_for[key]) for key, r in zip(keys, requests)]
+
+def search_with_sims(client, kb, norm_query: str, sims: np.ndarray, top_k: int, must_tags=None, any_tags=None):
+    """
+    search() với vector similarity đã tính sẵn cho norm_query (sims[i] = EMBS[i] · q, đủ
+    mọi dòng) → không embed, không quét KB; chỉ còn tag filter + ranking.
+    Dùng cho query cố định tính trước lúc load KB (slot query của T4).
+    """
+    rows = _search_with_sims(kb, norm_query, sims, top_k, must_tags, any_tags)
+    return _hits_from_rows(client, kb, norm_query, rows)
+
+def _hits_from_rows(client, kb, norm_query: str, rows):
+    """rows = [(kb_row, score, tag_score), ...] đã xếp hạng → list KBHit (+ rerank nếu bật)."""
+    # KBHit: text (question/answer/tags...) chỉ đọc từ KB khi được truy cập
+    results = [KBHit(kb, i, score, tag_score) for i, score, tag_score in rows]
+
+    # --- Optional rerank ---
+    # NOTE: Nếu query dạng "liệt kê theo hoạt chất", rerank LLM có thể làm giảm độ đầy đủ.
+    # Bạn có thể cân nhắc disable rerank khi must_tags có "chemical:*".
+    if RAGConfig.use_llm_rerank and len(results) > 1:
+        results = llm_rerank(client, norm_query, results, RAGConfig.top_k_rerank)
+
+    return results
+
+def _search_with_sims(kb, norm_query: str, sims: np.ndarray, top_k: int, must_tags=None, any_tags=None):
     must_tags = list(must_tags or [])
     any_tags  = list(any_tags or [])
     print('norm_query: ', norm_query)
@@ -72,64 +227,13 @@ def search(client, kb, norm_query: str, top_k: int, must_tags=None, any_tags=Non
         TAGS_V2 = None
         ENTITY_TYPE = None
 
-    # --- Query embedding ---
-    q = embed_text(client, norm_query)
+    n_docs = sims.shape[0]
 
-    # --- Similarity ---
-    embs = np.array(EMBS, dtype=np.float32)
-    sims = embs @ q
-    idx_sorted = np.argsort(-sims)
+    # tag đã parse sẵn lúc load KB (inverted index + frozenset/doc)
+    tag_index = get_tag_index(kb)
 
     debug = True
 
-    def _parse_tags_any_format(x):
-        if x is None:
-            return set()
-
-        if isinstance(x, (list, tuple, set)):
-            return {str(t).strip().lower() for t in x if str(t).strip()}
-
-        s = str(x).strip()
-        if not s or s.lower() in {"nan", "none"}:
-            return set()
-
-        # unwrap if the whole cell is quoted
-        if len(s) >= 2 and ((s[0] == s[-1] == '"') or (s[0] == s[-1] == "'")):
-            s = s[1:-1].strip()
-
-        # JSON-like list
-        if s.startswith("[") and s.endswith("]"):
-            s_json = s.replace('""', '"')
-            try:
-                arr = json.loads(s_json)
-                if isinstance(arr, list):
-                    return {str(t).strip().lower() for t in arr if str(t).strip()}
-            except Exception:
-                pass
-
-            tokens = re.findall(r'["\']([^"\']+)["\']', s)
-            if tokens:
-                return {t.strip().lower() for t in tokens if t.strip()}
-
-            inner = s[1:-1].strip()
-            if inner:
-                parts = [p.strip().strip('"').strip("'").lower() for p in inner.split(",")]
-                return {p for p in parts if p}
-
-            return set()
-
-        # pipe
-        if "|" in s:
-            return {p.strip().lower() for p in s.split("|") if p.strip()}
-
-        # comma
-        if "," in s:
-            parts = [p.strip().strip('"').strip("'").lower() for p in s.split(",")]
-            return {p for p in parts if p}
-
-        return {s.lower()}
-
-
     def explain_doc_tags(doc_tags, must_tags, any_tags):
         # No filters
         if not must_tags and not any_tags:
@@ -154,17 +258,9 @@ def search(client, kb, norm_query: str, top_k: int, must_tags=None, any_tags=Non
         return True, must_reason
 
 
-    def compute_tag_score(doc_tags, must_tags, any_tags):
-        score = 0
-        for t in must_tags:
-            if t in doc_tags:
-                score += 3
-        for t in any_tags:
-            if t in doc_tags:
-                score += 1
-        return score
-
     def log_pick(stage_name, picked_rows, IDS, QUESTIONS, TAGS_V2, ENTITY_TYPE):
+        if not debug_enabled():
+            return
         debug_log("=== PICKED {} in stage {} ===".format(len(picked_rows), stage_name))
         debug_log("=== norm_query: {} ===".format(norm_query))
 
@@ -186,33 +282,34 @@ def search(client, kb, norm_query: str, top_k: int, must_tags=None, any_tags=Non
             )
 
 
+    tag_score_of = {}
+
     def pick_indices(stage_name, must_local, any_local, top_k):
-        scored = []
+        if stage_name == "FALLBACK1_DROP_ANY":
+            pass_mask = tag_index.filter_mask(must_local, [], n_docs)
+            # ranking still uses original any_tags to reward relevant docs
+            tag_scores = tag_index.tag_scores(must_local, any_tags, n_docs)
+        else:
+            pass_mask = tag_index.filter_mask(must_local, any_local, n_docs)
+            tag_scores = tag_index.tag_scores(must_local, any_local, n_docs)
 
-        for idx in idx_sorted:
-            i = int(idx)  # ensure python int index
+        rows = rank_filtered(sims, tag_scores, pass_mask, top_k)
 
+        picked_rows = []
+        for i in rows:
+            i = int(i)
             sim = float(sims[i])
-
-            if TAGS_V2 is None:
-                doc_tags = set()
+            tag_score = int(tag_scores[i])
+            if debug:
+                doc_tags = tag_index.doc_tags[i] if i < tag_index.num_docs else frozenset()
+                if stage_name == "FALLBACK1_DROP_ANY":
+                    _, reason = explain_doc_tags(doc_tags, must_local, [])
+                else:
+                    _, reason = explain_doc_tags(doc_tags, must_local, any_local)
             else:
-                doc_tags = _parse_tags_any_format(TAGS_V2[i])
-
-            if stage_name == "FALLBACK1_DROP_ANY":
-                ok, reason = explain_doc_tags(doc_tags, must_local, [])
-                # ranking still uses original any_tags to reward relevant docs
-                tag_score = compute_tag_score(doc_tags, must_local, any_tags)
-            else:
-                ok, reason = explain_doc_tags(doc_tags, must_local, any_local)
-                tag_score = compute_tag_score(doc_tags, must_local, any_local)
-
-            key = (1 if ok else 0, int(tag_score), sim)
-            if ok:
-                scored.append((key, i, sim, tag_score, reason))
-
-        scored.sort(key=lambda x: x[0], reverse=True)
-        picked_rows = scored[:top_k]
+                reason = ""
+            picked_rows.append(((1, tag_score, sim), i, sim, tag_score, reason))
+            tag_score_of.setdefault(i, tag_score)
 
         if debug:
             log_pick(stage_name, picked_rows, IDS, QUESTIONS, TAGS_V2, ENTITY_TYPE)
@@ -253,35 +350,5 @@ def search(client, kb, norm_query: str, top_k: int, must_tags=None, any_tags=Non
             f"top_k       : {top_k}",
             "========================"
         )
-    # --- Build results ---
-    results = []
-    for i in picked:
-        item = {
-            "id": str(IDS[i]) if IDS is not None else "",
-            "question": str(QUESTIONS[i]) if QUESTIONS is not None else "",
-            "alt_question": str(ALT_QUESTIONS[i]) if ALT_QUESTIONS is not None else "",
-            "answer": str(ANSWERS[i]),
-            "score": float(sims[i]),
-        }
-
-        if CATEGORY is not None:
-            item["category"] = str(CATEGORY[i])
-
-        if ENTITY_TYPE is not None:
-            item["entity_type"] = str(ENTITY_TYPE[i])
-
-        # Prefer tags_v2 for debug/metadata
-        if TAGS_V2 is not None:
-            item["tags_v2"] = str(TAGS_V2[i])
-        elif TAGS is not None:
-            item["tags"] = str(TAGS[i])
-
-        results.append(item)
-
-    # --- Optional rerank ---
-    # NOTE: Nếu query dạng "liệt kê theo hoạt chất", rerank LLM có thể làm giảm độ đầy đủ.
-    # Bạn có thể cân nhắc disable rerank khi must_tags có "chemical:*".
-    if RAGConfig.use_llm_rerank and len(results) > 1:
-        results = llm_rerank(client, norm_query, results, RAGConfig.top_k_rerank)
-
-    return results
+    # (kb_row, score, tag_score) theo thứ tự xếp hạng — dạng lưu trong retrieval cache
+    return [(int(i), float(sims[i]), int(tag_score_of.get(i, 0))) for i in picked]
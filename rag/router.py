@@ -1,5 +1,5 @@
 import re
-from .chemical_knowledge import CHEMICAL_REGEX
+from .chemical_knowledge import chemical_regex
 from rag.tag_filter import tag_filter_pipeline
 
 RAG_TAG_PREFIXES = (
@@ -91,7 +91,7 @@ def route_query(client, user_query: str) -> str:
     #    Hỏi kiến thức thuần về hoạt chất -> GLOBAL
     # ============================================
 
-    if CHEMICAL_REGEX.search(q):
+    if chemical_regex().search(q):
 
         product_intent = re.search(
             r"\b("
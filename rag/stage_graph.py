@@ -0,0 +1,260 @@
+"""
+Chạy song song các stage độc lập của pipeline (mỗi stage thường là 1 round trip mạng:
+embedding read_memory, analyze_intent_strategy...) trên thread pool dùng chung,
+chỉ join ở chỗ thật sự cần dữ liệu.
+
+    graph = StageGraph(timer)
+    graph.submit("read_memory", read_memory, client=client, user_id=uid, query=q)
+    ...                                   # main thread làm việc khác
+    facts = graph.result("read_memory", default=[])
+
+Mỗi stage ghi span vào TimingLog (start/end theo offset từ đầu request) và thời gian
+main thread phải chờ ở join → nhìn timeline thấy được critical path.
+
+gather() chạy 1 nhóm call độc lập (vd. các LLM sinh giả thuyết recovery) cùng lúc;
+timeout tính riêng cho từng call từ lúc call bắt đầu chạy, call lỗi / quá hạn trả default,
+các call khác vẫn giữ kết quả.
+
+Pipeline async dùng cùng StageGraph: arun() / aresult() chờ stage bằng await thay vì
+chặn thread (event loop vẫn phục vụ stream khác).
+
+Việc không cần cho câu trả lời (tóm tắt memory sau khi stream xong) chạy bằng
+run_in_background(..., key=user_id) trên pool nền riêng: job cùng key chạy tuần tự theo
+thứ tự submit, key khác nhau chạy song song. wait_background(key) cho phép lượt sau của
+cùng user chờ (có hạn) memory của lượt trước ghi xong.
+"""
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from typing import Any, Callable, Dict
+
+from rag.config import RAGConfig
+
+_RAISE = object()
+
+_STAGE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(getattr(RAGConfig, "stage_graph_workers", 16)),
+    thread_name_prefix="rag-stage",
+)
+# bước tuần tự của pipeline async (StageGraph.arun) — tách khỏi pool stage con
+_PIPELINE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(getattr(RAGConfig, "async_pipeline_workers", 32)),
+    thread_name_prefix="rag-pipeline",
+)
+
+
+class KeyedSerialExecutor:
+    """
+    Job cùng key chạy tuần tự theo thứ tự submit, key khác nhau chạy song song trên pool.
+    Số job chờ có giới hạn (max_pending): quá giới hạn thì job mới bị bỏ (Future lỗi)
+    thay vì để hàng đợi trễ dần.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, thread_name_prefix: str = ""):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.max_pending = max_pending
+        self._queues = {}        # key -> deque[(fn, Future)] chưa chạy
+        self._last = {}          # key -> Future của job submit sau cùng
+        self._pending = 0
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def submit(self, key, fn) -> Future:
+        fut = Future()
+        with self._cond:
+            if self._pending >= self.max_pending:
+                self.dropped += 1
+                fut.set_exception(RuntimeError(f"background queue full ({self.max_pending})"))
+                return fut
+            self._pending += 1
+            self._last[key] = fut
+            q = self._queues.get(key)
+            if q is not None:
+                q.append((fn, fut))
+                return fut
+            self._queues[key] = deque([(fn, fut)])
+        self._pool.submit(self._drain, key)
+        return fut
+
+    def _drain(self, key):
+        while True:
+            with self._cond:
+                q = self._queues[key]
+                if not q:
+                    del self._queues[key]
+                    return
+                fn, fut = q.popleft()
+            if fut.set_running_or_notify_cancel():
+                try:
+                    fut.set_result(fn())
+                except BaseException as e:
+                    fut.set_exception(e)
+            with self._cond:
+                self._pending -= 1
+                if self._last.get(key) is fut:
+                    del self._last[key]
+                self._cond.notify_all()
+
+    def wait_key(self, key, timeout: float = None) -> bool:
+        """Chờ mọi job đã submit của key xong; False nếu quá timeout."""
+        with self._cond:
+            fut = self._last.get(key)
+        if fut is None:
+            return True
+        done, _ = wait([fut], timeout=timeout)
+        return bool(done)
+
+    def wait_all(self, timeout: float = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"pending": self._pending, "keys": len(self._queues), "dropped": self.dropped}
+
+
+# việc nền (tóm tắt + ghi memory): tuần tự theo user, song song giữa các user
+_BACKGROUND_EXECUTOR = KeyedSerialExecutor(
+    max_workers=int(getattr(RAGConfig, "background_workers", 4)),
+    max_pending=int(getattr(RAGConfig, "background_queue_max", 1000)),
+    thread_name_prefix="rag-background",
+)
+
+
+class StageGraph:
+    def __init__(self, timer, executor: ThreadPoolExecutor = None):
+        self.timer = timer
+        self.executor = executor or _STAGE_EXECUTOR
+        self.futures = {}
+
+    def submit(self, name: str, fn, *args, **kwargs) -> Future:
+        def _run():
+            self.timer.start(name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.timer.end(name)
+
+        fut = self.executor.submit(_run)
+        self.futures[name] = fut
+        return fut
+
+    def result(self, name: str, timeout: float = None, default=_RAISE):
+        """Join stage `name`; có default thì stage lỗi / quá timeout trả default thay vì raise."""
+        fut = self.futures[name]
+        t0 = time.time()
+        try:
+            return fut.result(timeout=timeout)
+        except Exception as e:
+            if default is _RAISE:
+                raise
+            print(f"[STAGE ERROR] {name}: {type(e).__name__}: {e}")
+            return default
+        finally:
+            self.timer.wait(name, time.time() - t0)
+
+
+    async def arun(self, name: str, fn, *args, **kwargs):
+        """
+        Chạy 1 bước tuần tự của pipeline async trên pool riêng rồi await (không chặn
+        event loop). Pool riêng → bước này có thể submit() stage con và chờ nó mà
+        không tự khoá pool stage. name=None → không ghi span.
+        """
+        def _run():
+            if name:
+                self.timer.start(name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if name:
+                    self.timer.end(name)
+
+        return await asyncio.wrap_future(_PIPELINE_EXECUTOR.submit(_run))
+
+    async def aresult(self, name: str, timeout: float = None, default=_RAISE):
+        fut = self.futures[name]
+        t0 = time.time()
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(fut), timeout)
+        except Exception as e:
+            if default is _RAISE:
+                raise
+            print(f"[STAGE ERROR] {name}: {type(e).__name__}: {e}")
+            return default
+        finally:
+            self.timer.wait(name, time.time() - t0)
+
+
+def _result_from_start(fut: Future, started_at: Callable[[], float], submitted: float, timeout: float):
+    # chưa chạy → hạn tính từ lúc submit (quá hạn thì cancel); đã chạy → tính từ lúc bắt đầu
+    if timeout is None:
+        return fut.result()
+    while True:
+        start = started_at()
+        remaining = (start or submitted) + timeout - time.time()
+        if start is None and remaining <= 0 and fut.cancel():
+            raise TimeoutError(f"chưa được chạy sau {timeout}s trong hàng đợi")
+        try:
+            # vừa chạy nhưng chưa kịp ghi giờ bắt đầu → chờ ngắn rồi đọc lại
+            return fut.result(timeout=max(remaining, 0.0 if start is not None else 0.05))
+        except FuturesTimeoutError:
+            if start is not None:
+                raise TimeoutError(f"quá {timeout}s kể từ lúc bắt đầu chạy")
+
+
+def gather(
+    calls: Dict[str, Callable[[], Any]],
+    timeout: float = None,
+    default: Any = None,
+) -> Dict[str, Any]:
+    """
+    {name: fn} → {name: kết quả}, giữ nguyên thứ tự key của calls.
+
+    Các call xếp hàng trên _STAGE_EXECUTOR dùng chung nên không chắc bắt đầu cùng lúc:
+    timeout của mỗi call tính từ lúc call đó bắt đầu chạy. Call chờ trong hàng quá
+    timeout mà chưa chạy thì bị cancel (không chiếm worker nữa). Call đã chạy mà quá hạn
+    vẫn chạy nốt trong pool nhưng kết quả bị bỏ.
+    """
+    submitted = time.time()
+    started = {}
+
+    def _timed(name, fn):
+        def _run():
+            started[name] = time.time()
+            return fn()
+        return _run
+
+    futures = {name: _STAGE_EXECUTOR.submit(_timed(name, fn)) for name, fn in calls.items()}
+
+    out = {}
+    for name, fut in futures.items():
+        try:
+            out[name] = _result_from_start(fut, lambda: started.get(name), submitted, timeout)
+        except Exception as e:
+            print(f"[STAGE ERROR] {name}: {type(e).__name__}: {e}")
+            out[name] = default
+    return out
+
+
+def run_in_background(name: str, fn, *args, key=None, **kwargs) -> Future:
+    """Job cùng key (vd. user_id) chạy tuần tự; key=None → chung 1 hàng."""
+    def _run():
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            print(f"[BACKGROUND ERROR] {name}: {type(e).__name__}: {e}")
+
+    fut = _BACKGROUND_EXECUTOR.submit(key, _run)
+    if fut.done() and fut.exception() is not None:
+        print(f"[BACKGROUND DROPPED] {name}: {fut.exception()}")
+    return fut
+
+
+def wait_background(key=None, timeout: float = None) -> bool:
+    """key → chờ job nền của key đó; None → chờ mọi job nền. False nếu quá timeout."""
+    if key is None:
+        return _BACKGROUND_EXECUTOR.wait_all(timeout)
+    return _BACKGROUND_EXECUTOR.wait_key(key, timeout)
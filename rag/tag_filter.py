@@ -1,9 +1,19 @@
 import re
 import json
+import importlib.util
 import unicodedata
 from pathlib import Path
+from collections import Counter
 from typing import Dict, List, Set, Tuple, Optional, Callable
 
+import rag.alias_matcher
+import rag.fuzzy_alias
+from rag.alias_matcher import AliasMatcher
+from rag.fuzzy_alias import FuzzyVocab, correct_tokens
+from rag.ontology import Ontology, OntologyRegistry, load_or_build
+from rag.cache import LRUCache
+from rag.config import RAGConfig
+
 # ===========================
 # 1) PATH & LOAD KNOWLEDGE
 # ===========================
@@ -11,8 +21,8 @@ from typing import Dict, List, Set, Tuple, Optional, Callable
 BASE_DIR = Path(__file__).resolve().parent.parent
 KB_PATH = BASE_DIR / "chemical_tags_from_kb.json"
 
-with open(KB_PATH, "r", encoding="utf-8") as f:
-    CHEMICAL_KB = json.load(f)
+# CHEMICAL_KB / CHEMICAL_INDEX / matcher nằm trong Ontology, load lười qua ontology_registry
+# (từ snapshot rag/ontology.py nếu còn fresh)
 
 # ===========================
 # 2) NORMALIZATION UTILITIES
@@ -81,14 +91,44 @@ def normalize_set(values: Set[str], normalizer: Callable[[str], str]) -> Set[str
     return {normalizer(x) for x in values if x}
 
 
-# Chuẩn hóa sẵn dữ liệu trong KB theo entity-normalize để join ổn định
-for _, v in CHEMICAL_KB.items():
-    v["crops"] = [normalize_entity(x) for x in v.get("crops", [])]
-    v["diseases"] = [normalize_entity(x) for x in v.get("diseases", [])]
-    v["pests"] = [normalize_entity(x) for x in v.get("pests", [])]
-    v["weeds"] = [normalize_entity(x) for x in v.get("weeds", [])]
-    # formulation nếu có (nhiều KB không có)
-    v["formulation"] = [normalize_entity(x) for x in v.get("formulation", [])]
+def load_chemical_kb(path: Path = KB_PATH) -> Dict[str, Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        kb = json.load(f)
+
+    # Chuẩn hóa sẵn dữ liệu trong KB theo entity-normalize để join ổn định
+    for _, v in kb.items():
+        v["crops"] = [normalize_entity(x) for x in v.get("crops", [])]
+        v["diseases"] = [normalize_entity(x) for x in v.get("diseases", [])]
+        v["pests"] = [normalize_entity(x) for x in v.get("pests", [])]
+        v["weeds"] = [normalize_entity(x) for x in v.get("weeds", [])]
+        # formulation nếu có (nhiều KB không có)
+        v["formulation"] = [normalize_entity(x) for x in v.get("formulation", [])]
+    return kb
+
+
+CHEMICAL_INDEX_FIELDS = ("crops", "diseases", "pests", "weeds", "formulation")
+
+
+def build_chemical_index(kb: Dict[str, Dict]) -> Dict[str, Dict[str, Set[str]]]:
+    """
+    Inverted index: field -> entity (đã normalize_entity) -> set(chemical).
+    Suy diễn chemical chỉ còn là vài phép union/intersect thay vì quét toàn KB.
+    """
+    index: Dict[str, Dict[str, Set[str]]] = {field: {} for field in CHEMICAL_INDEX_FIELDS}
+    for chem, data in kb.items():
+        for field in CHEMICAL_INDEX_FIELDS:
+            for x in data.get(field, []):
+                index[field].setdefault(x, set()).add(chem)
+    return index
+
+
+def _chems_with(index: Dict[str, Dict[str, Set[str]]], field: str, values: Set[str]) -> Set[str]:
+    postings = index[field]
+    out: Set[str] = set()
+    for x in values:
+        out |= postings.get(x, set())
+    return out
+
 
 # ===========================
 # 3) ALIASES (BẠN TỰ COPY ĐẦY ĐỦ SAU)
@@ -1269,24 +1309,147 @@ INTENT_ALIAS_GROUPS = {
 # 4) MATCHING UTILITIES
 # ===========================
 
-def match_aliases(text: str, aliases: Dict[str, List[str]], normalizer: Callable[[str], str]) -> Set[str]:
+# Bảng alias compile sẵn lúc import: 1 automaton cho mỗi normalizer
+# - entity (crop/pest/disease/weed/product/...): normalize_entity (coi '-' như khoảng trắng)
+# - chemical: normalize() để giữ tên có dấu '-'
+ENTITY_ALIAS_TABLES = {
+    "crop": CROP_ALIASES,
+    "disease": DISEASE_ALIASES,
+    "pest": PEST_ALIASES,
+    "weed": WEED_ALIASES,
+    "product": PRODUCT_ALIASES,
+    "formula": FORMULA_ALIASES,
+    "formulation": FORMULATION_ALIASES,
+    "mechanisms": MECHANISMS_ALIASES,
+}
+CHEMICAL_ALIAS_TABLES = {
+    "chemical": CHEMICAL_ALIASES,
+}
+
+# File quyết định nội dung ontology: JSON + module này (bảng alias, normalizer) + matcher
+ONTOLOGY_SOURCES = (
+    KB_PATH,
+    Path(__file__).resolve(),
+    Path(rag.alias_matcher.__file__).resolve(),
+    Path(rag.fuzzy_alias.__file__).resolve(),
+)
+
+
+
+# bảng tên riêng: token của chúng (cùng tên hoạt chất) được làm đích sửa chính tả;
+# bảng tên tiếng Việt (cây, sâu, bệnh, cỏ, công thức, cơ chế) chỉ để nhận biết token
+FUZZY_TARGET_TABLES = ("product", "formulation")
+
+
+def build_fuzzy_vocab(chemical_kb: Dict[str, Dict], entity_tables, chemical_tables) -> FuzzyVocab:
     """
-    Match theo word-boundary (khoảng trắng) sau khi normalize.
+    Từ vựng để sửa chính tả: token của mọi alias (key + variant) và của ontology hoá chất.
+    Đích sửa chỉ là tên hoạt chất / sản phẩm / dạng thuốc, trừ token cũng là từ tiếng Việt
+    trong bảng tên cây / sâu / bệnh... (vd. "chet" của "chết cành" không bao giờ là đích sửa).
+    """
+    counts: Counter = Counter()
+    targets, plain = set(), set()
+    for tables, normalizer, is_chemical in (
+        (entity_tables, normalize_entity, False),
+        (chemical_tables, normalize, True),
+    ):
+        for name, aliases in tables.items():
+            bucket = targets if is_chemical or name in FUZZY_TARGET_TABLES else plain
+            for key, variants in aliases.items():
+                for v in [key, *variants]:
+                    tokens = normalizer(v).split()
+                    counts.update(tokens)
+                    bucket.update(tokens)
+    for chem, data in chemical_kb.items():
+        tokens = normalize(chem).split()
+        counts.update(tokens)
+        targets.update(tokens)
+        for field in CHEMICAL_INDEX_FIELDS:
+            bucket = targets if field == "formulation" else plain
+            for x in data.get(field, []):
+                counts.update(x.split())
+                bucket.update(x.split())
+    return FuzzyVocab(counts, targets=targets - plain)
+
+
+def build_ontology(version: str, entity_tables=None, chemical_tables=None) -> Ontology:
+    entity_tables = entity_tables or ENTITY_ALIAS_TABLES
+    chemical_tables = chemical_tables or CHEMICAL_ALIAS_TABLES
+    chemical_kb = load_chemical_kb(KB_PATH)
+    return Ontology(
+        version=version,
+        chemical_kb=chemical_kb,
+        chemical_index=build_chemical_index(chemical_kb),
+        entity_matcher=AliasMatcher(entity_tables, normalize_entity),
+        chemical_matcher=AliasMatcher(chemical_tables, normalize),
+        fuzzy=build_fuzzy_vocab(chemical_kb, entity_tables, chemical_tables),
+    )
+
+
+def _read_alias_tables_from_disk():
     """
-    found: Set[str] = set()
-    norm_text = f" {normalizer(text)} "
+    Đọc lại bảng alias từ file tag_filter.py hiện tại trên đĩa (module tạm, không đụng
+    sys.modules) → reload nóng được cả khi sửa *_ALIASES mà không restart worker.
+    """
+    spec = importlib.util.spec_from_file_location("rag._tag_filter_reload", Path(__file__).resolve())
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod.ENTITY_ALIAS_TABLES, mod.CHEMICAL_ALIAS_TABLES
+
+
+def load_ontology(force_rebuild: bool = False, reload: bool = False) -> Ontology:
+    build = build_ontology
+    if reload:
+        entity_tables, chemical_tables = _read_alias_tables_from_disk()
+        build = lambda version: build_ontology(version, entity_tables, chemical_tables)
+    return load_or_build(
+        ONTOLOGY_SOURCES,
+        build,
+        use_snapshot=bool(getattr(RAGConfig, "ontology_snapshot", True)),
+        force_rebuild=force_rebuild,
+    )
+
+
+ontology_registry = OntologyRegistry(load_ontology)
+
 
-    for key, variants in aliases.items():
-        for v in variants:
-            alias = normalizer(v)
-            if not alias:
-                continue
-            pattern = rf"(?:^|\s){re.escape(alias)}(?:\s|$)"
-            if re.search(pattern, norm_text):
-                found.add(key)
-                break
+def get_ontology() -> Ontology:
+    return ontology_registry.get()
 
-    return found
+
+def ontology_version() -> str:
+    return ontology_registry.version
+
+
+_LAZY_ATTRS = {
+    "CHEMICAL_KB": "chemical_kb",
+    "CHEMICAL_INDEX": "chemical_index",
+    "ENTITY_MATCHER": "entity_matcher",
+    "CHEMICAL_MATCHER": "chemical_matcher",
+    "ALIAS_VERSION": "version",
+}
+
+
+def __getattr__(name):
+    # giữ tên module-level cũ (tag_filter.CHEMICAL_KB, ...) nhưng chỉ load khi được dùng
+    if name in _LAZY_ATTRS:
+        return getattr(get_ontology(), _LAZY_ATTRS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# matcher cho các bảng alias khác gọi qua match_aliases(): compile 1 lần / (bảng, normalizer)
+_TABLE_MATCHERS: Dict[Tuple[int, Callable[[str], str]], Tuple[Dict, AliasMatcher]] = {}
+
+
+def match_aliases(text: str, aliases: Dict[str, List[str]], normalizer: Callable[[str], str]) -> Set[str]:
+    """
+    Match theo word-boundary (khoảng trắng) sau khi normalize.
+    """
+    key = (id(aliases), normalizer)
+    cached = _TABLE_MATCHERS.get(key)
+    if cached is None or cached[0] is not aliases:
+        cached = (aliases, AliasMatcher({"_": aliases}, normalizer))
+        _TABLE_MATCHERS[key] = cached
+    return cached[1].match(text)["_"]
 
 
 # ===========================
@@ -1297,6 +1460,7 @@ def infer_chemicals_from_kb(
     crops: Set[str],
     diseases: Set[str],
     pests: Set[str],
+    ontology: Optional[Ontology] = None,
 ) -> Tuple[Set[str], str]:
     """
     Trả về (chemicals, mode)
@@ -1313,19 +1477,16 @@ def infer_chemicals_from_kb(
     diseases_n = normalize_set(diseases, normalize_entity)
     pests_n = normalize_set(pests, normalize_entity)
 
-    def _filter_by_crop_if_any(kb_crops: Set[str]) -> bool:
-        # nếu user có crop thì bắt buộc intersect; nếu không có crop thì không chặn
-        return (not crops_n) or bool(crops_n.intersection(kb_crops))
+    # chemical dùng được trên crop của user (None = user không nói crop → không chặn)
+    index = (ontology or get_ontology()).chemical_index
+    crop_chems = _chems_with(index, "crops", crops_n) if crops_n else None
 
     def _match_target(target: Set[str], kb_field: str) -> Set[str]:
-        out = set()
         if not target:
-            return out
-        for chem, data in CHEMICAL_KB.items():
-            kb_targets = set(data.get(kb_field, []))
-            kb_crops = set(data.get("crops", []))
-            if target.intersection(kb_targets) and _filter_by_crop_if_any(kb_crops):
-                out.add(chem)
+            return set()
+        out = _chems_with(index, kb_field, target)
+        if crop_chems is not None:
+            out &= crop_chems
         return out
 
     # 2) Pest
@@ -1339,31 +1500,23 @@ def infer_chemicals_from_kb(
         return chems, "disease"
 
     # 4) Crop fallback (OLD behavior)
-    if crops_n:
-        out = set()
-        for chem, data in CHEMICAL_KB.items():
-            kb_crops = set(data.get("crops", []))
-            if crops_n.intersection(kb_crops):
-                out.add(chem)
-        if out:
-            return out, "crop"
+    if crop_chems:
+        return set(crop_chems), "crop"
 
     return set(), "none"
 
 
-def filter_chemicals_by_formulation(chems: Set[str], forms: Set[str]) -> Set[str]:
+def filter_chemicals_by_formulation(
+    chems: Set[str],
+    forms: Set[str],
+    ontology: Optional[Ontology] = None,
+) -> Set[str]:
     if not forms:
         return chems  # user không yêu cầu dạng → giữ nguyên
 
     forms_n = normalize_set(forms, normalize_entity)
-    out = set()
-    for c in chems:
-        kb = CHEMICAL_KB.get(c, {})
-        kb_forms = set(kb.get("formulation", []))
-        # có ít nhất 1 dạng trùng
-        if kb_forms.intersection(forms_n):
-            out.add(c)
-    return out
+    # có ít nhất 1 dạng trùng
+    return set(chems) & _chems_with((ontology or get_ontology()).chemical_index, "formulation", forms_n)
 
 
 # ===========================
@@ -1374,29 +1527,40 @@ def extract_tags(norm_query_raw: str) -> Dict:
     """
     norm_query_raw: string đã normalize() (giữ + - /)
     """
+    onto = get_ontology()
+    return _tags_from_hits(
+        onto,
+        onto.entity_matcher.match(norm_query_raw),
+        onto.chemical_matcher.match(norm_query_raw),
+    )
+
 
+def _tags_from_hits(
+    onto: Ontology,
+    entity_hits: Dict[str, Set[str]],
+    chemical_hits: Dict[str, Set[str]],
+) -> Dict:
     # Entity match: dùng normalize_entity để tránh mismatch do '-'
-    crops = match_aliases(norm_query_raw, CROP_ALIASES, normalize_entity)
-    diseases = match_aliases(norm_query_raw, DISEASE_ALIASES, normalize_entity)
-    pests = match_aliases(norm_query_raw, PEST_ALIASES, normalize_entity)
-    weeds = match_aliases(norm_query_raw, WEED_ALIASES, normalize_entity)
+    crops = entity_hits["crop"]
+    diseases = entity_hits["disease"]
+    pests = entity_hits["pest"]
+    weeds = entity_hits["weed"]
 
-    products = match_aliases(norm_query_raw, PRODUCT_ALIASES, normalize_entity)
-    # brands = match_aliases(norm_query_raw, BRAND_ALIASES, normalize_entity)
-    formulas = match_aliases(norm_query_raw, FORMULA_ALIASES, normalize_entity)
-    forms = match_aliases(norm_query_raw, FORMULATION_ALIASES, normalize_entity)
-    mechanisms = match_aliases(norm_query_raw, MECHANISMS_ALIASES, normalize_entity)
+    products = entity_hits["product"]
+    formulas = entity_hits["formula"]
+    forms = entity_hits["formulation"]
+    mechanisms = entity_hits["mechanisms"]
 
     # Chemical match: dùng normalize() để giữ tên có dấu '-'
-    direct_chems = match_aliases(norm_query_raw, CHEMICAL_ALIASES, normalize)
+    direct_chems = chemical_hits["chemical"]
 
-    kb_chems, kb_mode = infer_chemicals_from_kb(crops, diseases, pests)
+    kb_chems, kb_mode = infer_chemicals_from_kb(crops, diseases, pests, ontology=onto)
 
     # all chemicals: explicit + inferred
     all_chems = set(direct_chems).union(kb_chems)
 
     # FILTER theo formulation
-    all_chems = filter_chemicals_by_formulation(all_chems, forms)
+    all_chems = filter_chemicals_by_formulation(all_chems, forms, ontology=onto)
 
     # ======================
     # BUILD TAGS (must/any)
@@ -1449,11 +1613,15 @@ def extract_tags(norm_query_raw: str) -> Dict:
 # 8) MAIN PIPELINE
 # ===========================
 
-def tag_filter_pipeline(query: str) -> Dict:
-    norm_raw = normalize(query)
+# tag_filter_pipeline là hàm thuần của (query đã normalize, bảng alias)
+# → cache LRU, key gồm version ontology để đổi bảng alias là tự mất hiệu lực
+_TAG_CACHE = LRUCache(maxsize=int(getattr(RAGConfig, "tag_filter_cache_size", 4096)))
+
 
-    # 1) Ontology core
-    tags = extract_tags(norm_raw)
+def _tags_for_normalized(onto: Ontology, norm_raw: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    # 1) Ontology core — mỗi automaton quét query đúng 1 lượt
+    entity_hits = onto.entity_matcher.match(norm_raw)
+    tags = _tags_from_hits(onto, entity_hits, onto.chemical_matcher.match(norm_raw))
 
     # MUST = ontology MUST + mechanisms MUST
     must_tags = set(tags["must"])
@@ -1462,22 +1630,161 @@ def tag_filter_pipeline(query: str) -> Dict:
     detected_any = set(tags["any"])
 
     # fallback: thêm crop/pest/weed nếu match được (để tránh thiếu do extract_tags thay đổi)
-    for c in match_aliases(norm_raw, CROP_ALIASES, normalize_entity):
+    for c in entity_hits["crop"]:
         detected_any.add(f"crop:{c}")
-    for p in match_aliases(norm_raw, PEST_ALIASES, normalize_entity):
+    for p in entity_hits["pest"]:
         detected_any.add(f"pest:{p}")
-    for p in match_aliases(norm_raw, WEED_ALIASES, normalize_entity):
+    for p in entity_hits["weed"]:
         detected_any.add(f"weed:{p}")
 
+    return tuple(sorted(must_tags)), tuple(sorted(detected_any))
+
+
+def tag_filter_many(queries: List[str]) -> List[Dict]:
+    """
+    Tag nhiều query 1 lượt: normalize cả list, query trùng (sau normalize) chỉ match 1 lần,
+    query đã có trong cache không match lại. Trả về cùng thứ tự, cùng format tag_filter_pipeline().
+    """
+    queries = list(queries)
+    norms = [normalize(q) for q in queries]
+
+    # lấy ontology 1 lần: reload nóng giữa chừng không làm lẫn 2 version trong 1 lượt
+    onto = get_ontology()
+    tags_for = {}
+    for norm_raw in dict.fromkeys(norms):
+        key = (onto.version, norm_raw)
+        tags = _TAG_CACHE.get(key)
+        if tags is None:
+            tags = _tags_for_normalized(onto, norm_raw)
+            _TAG_CACHE.put(key, tags)
+        tags_for[norm_raw] = tags
+
+    return [
+        {
+            "query": q,
+            "must": list(tags_for[n][0]),
+            "any": list(tags_for[n][1]),
+        }
+        for q, n in zip(queries, norms)
+    ]
+
+
+def tag_filter_pipeline(query: str) -> Dict:
+    return tag_filter_many([query])[0]
+
+
+def clear_tag_cache():
+    _TAG_CACHE.clear()
+
+
+def tag_cache_stats() -> Dict:
+    s = _TAG_CACHE.stats()
+    s["alias_version"] = ontology_version()
+    return s
+
+
+# ===========================
+# 9) LOCAL (FUZZY) NORMALIZE
+# ===========================
+
+_word_re = re.compile(r"\S+")
+_word_core_re = re.compile(r"^(\W*)(.*?)(\W*)$")
+
+
+def _apply_corrections(query: str, corrections: Dict[str, str], surface_forms: Dict[str, str] = None) -> str:
+    """
+    Thay từng từ gốc (giữ dấu câu hai đầu) khi dạng normalize của nó được sửa.
+    Từ thay vào là dạng có dấu (surface_forms: token bỏ dấu → dạng viết trong KB) nếu có,
+    không thì là token từ vựng (vd. tên hoạt chất vốn không dấu).
+    """
+    if not corrections:
+        return query
+    surface_forms = surface_forms or {}
+
+    def _repl(m):
+        word = m.group(0)
+        fixed = corrections.get(normalize(word))
+        if fixed is None:
+            return word
+        lead, core, trail = _word_core_re.match(word).groups()
+        fixed = surface_forms.get(fixed, fixed)
+        if core[:1].isupper():
+            fixed = fixed[:1].upper() + fixed[1:]
+        return f"{lead}{fixed}{trail}"
+
+    return _word_re.sub(_repl, query)
+
+
+def _missing_diacritics(text: str, surface_forms: Dict[str, str]) -> List[str]:
+    """Từ viết không dấu trong text mà KB viết có dấu (vd. "lua" ↔ "lúa")."""
+    out = []
+    for word in text.split():
+        core = _word_core_re.match(word).group(2).lower()
+        if core and core.isascii() and surface_forms.get(core, core) != core:
+            out.append(core)
+    return out
+
+
+def fuzzy_normalize(
+    query: str,
+    known_words: Set[str] = frozenset(),
+    surface_forms: Dict[str, str] = None,
+) -> Dict:
+    """
+    Sửa lỗi chính tả entity cục bộ (không gọi LLM), vd. "metalaxi" -> "metalaxyl".
+
+    known_words: từ bình thường (vd. token trong câu hỏi KB) → không bao giờ bị "sửa" thành entity.
+    surface_forms: token bỏ dấu → dạng có dấu trong KB; từ sửa được ghép lại bằng dạng có dấu,
+    và câu còn từ không dấu (mà KB viết có dấu) thì không confident → LLM khôi phục dấu,
+    norm_query không bị lẫn từ có dấu / không dấu. Token KB viết có dấu là từ tiếng Việt
+    thường → không làm đích sửa.
+    Từ người dùng gõ có dấu được coi là cố ý (vd. "chiết" không bị sửa thành "chết").
+    confident = có ít nhất 1 entity match, mọi token đều đã biết / sửa được, và mỗi chỗ sửa
+    đều tạo ra entity / hoạt chất mà câu gốc chưa match → caller có thể bỏ qua LLM normalize.
+    """
+    onto = get_ontology()
+    tokens = normalize(query).split()
+    accented = {
+        t for word in query.split()
+        if any(ch.isalpha() and not ch.isascii() for ch in word)
+        for t in normalize(word).split()
+    }
+    corrections, unresolved = correct_tokens(
+        tokens, onto.fuzzy, known_words, accented=accented, protected=set(surface_forms or ()),
+    )
+
+    def _hits(toks):
+        text = " ".join(toks)
+        entity_hits = onto.entity_matcher.match(text)
+        chemical_hits = onto.chemical_matcher.match(text)
+        return ({(g, k) for g, keys in entity_hits.items() for k in keys}
+                | {("chemical", k) for k in chemical_hits["chemical"]})
+
+    base_hits = _hits(tokens)
+    num_entities = len(_hits([corrections.get(t, t) for t in tokens]))
+    # chỗ sửa không tạo thêm match nào → không có bằng chứng là sửa đúng
+    ungrounded = [
+        src for src, fixed in corrections.items()
+        if not _hits([fixed if t == src else t for t in tokens]) - base_hits
+    ]
+
+    text = _apply_corrections(query, corrections, surface_forms)
+    missing = _missing_diacritics(text, surface_forms) if surface_forms else []
+
     return {
         "query": query,
-        "must": sorted(list(must_tags)),
-        "any": sorted(list(detected_any)),
+        "text": text,
+        "corrections": corrections,
+        "unresolved": unresolved,
+        "ungrounded": ungrounded,
+        "missing_diacritics": missing,
+        "num_entities": num_entities,
+        "confident": num_entities > 0 and not unresolved and not ungrounded and not missing,
     }
 
 
 # ===========================
-# 9) TEST HARNESS
+# 10) TEST HARNESS
 # ===========================
 
 if __name__ == "__main__":
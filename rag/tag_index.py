@@ -0,0 +1,175 @@
+import re
+import json
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+import numpy as np
+
+
+def parse_tags_any_format(x) -> set:
+    """
+    Parse 1 ô tags_v2 (mọi format đang có trong NPZ) thành set[str] lowercase:
+    - list/tuple/set
+    - chuỗi JSON-like '["a","b"]' (kể cả bị quote 2 lớp từ CSV)
+    - 'a|b|c' hoặc 'a,b,c'
+    """
+    if x is None:
+        return set()
+
+    if isinstance(x, (list, tuple, set)):
+        return {str(t).strip().lower() for t in x if str(t).strip()}
+
+    s = str(x).strip()
+    if not s or s.lower() in {"nan", "none"}:
+        return set()
+
+    # unwrap if the whole cell is quoted
+    if len(s) >= 2 and ((s[0] == s[-1] == '"') or (s[0] == s[-1] == "'")):
+        s = s[1:-1].strip()
+
+    # JSON-like list
+    if s.startswith("[") and s.endswith("]"):
+        s_json = s.replace('""', '"')
+        try:
+            arr = json.loads(s_json)
+            if isinstance(arr, list):
+                return {str(t).strip().lower() for t in arr if str(t).strip()}
+        except Exception:
+            pass
+
+        tokens = re.findall(r'["\']([^"\']+)["\']', s)
+        if tokens:
+            return {t.strip().lower() for t in tokens if t.strip()}
+
+        inner = s[1:-1].strip()
+        if inner:
+            parts = [p.strip().strip('"').strip("'").lower() for p in inner.split(",")]
+            return {p for p in parts if p}
+
+        return set()
+
+    # pipe
+    if "|" in s:
+        return {p.strip().lower() for p in s.split("|") if p.strip()}
+
+    # comma
+    if "," in s:
+        parts = [p.strip().strip('"').strip("'").lower() for p in s.split(",")]
+        return {p for p in parts if p}
+
+    return {s.lower()}
+
+
+_EMPTY_IDS = np.zeros(0, dtype=np.int64)
+
+
+class TagIndex:
+    """
+    Inverted index tag → doc ids (mảng int64 đã sort), build 1 lần lúc load KB.
+
+    - doc_tags[i]  : frozenset tag của doc i
+    - postings[t]  : np.ndarray các doc có tag t
+    """
+
+    def __init__(self, doc_tags: List[FrozenSet[str]]):
+        self.num_docs = len(doc_tags)
+        self.doc_tags = doc_tags
+
+        buckets: Dict[str, List[int]] = {}
+        for i, tags in enumerate(doc_tags):
+            for t in tags:
+                buckets.setdefault(t, []).append(i)
+        self.postings: Dict[str, np.ndarray] = {
+            t: np.asarray(ids, dtype=np.int64) for t, ids in buckets.items()
+        }
+
+    def docs_with(self, tag: str) -> np.ndarray:
+        return self.postings.get(tag, _EMPTY_IDS)
+
+    def docs_with_any(self, tags: Iterable[str]) -> np.ndarray:
+        """OR: doc có ít nhất 1 tag trong danh sách (sorted, unique)."""
+        arrs = [self.postings[t] for t in tags if t in self.postings]
+        if not arrs:
+            return _EMPTY_IDS
+        if len(arrs) == 1:
+            return arrs[0]
+        return np.unique(np.concatenate(arrs))
+
+    def filter_ids(self, must_tags: List[str], any_tags: List[str]) -> Optional[np.ndarray]:
+        """
+        Doc ids pass filter (MUST = OR, ANY = OR, hai nhóm AND với nhau).
+        None nghĩa là không có filter → mọi doc đều pass.
+        """
+        if not must_tags and not any_tags:
+            return None
+
+        ids = None
+        if must_tags:
+            ids = self.docs_with_any(must_tags)
+        if any_tags:
+            any_ids = self.docs_with_any(any_tags)
+            ids = any_ids if ids is None else np.intersect1d(ids, any_ids, assume_unique=True)
+        return ids
+
+    def filter_mask(self, must_tags: List[str], any_tags: List[str], n: int) -> Optional[np.ndarray]:
+        """
+        Giống filter_ids nhưng trả về boolean mask độ dài n (số dòng KB).
+        None nghĩa là không có filter → mọi doc đều pass.
+        """
+        if not must_tags and not any_tags:
+            return None
+
+        mask = np.ones(n, dtype=bool)
+        if must_tags:
+            m = np.zeros(n, dtype=bool)
+            m[self.docs_with_any(must_tags)] = True
+            mask &= m
+        if any_tags:
+            a = np.zeros(n, dtype=bool)
+            a[self.docs_with_any(any_tags)] = True
+            mask &= a
+        return mask
+
+    def tag_scores(self, must_tags: List[str], any_tags: List[str], n: int) -> np.ndarray:
+        """
+        tag_score cho mọi doc: +3 mỗi must tag khớp, +1 mỗi any tag khớp
+        (tương đương cột doc×tag của ma trận thưa, gom theo trọng số).
+        """
+        scores = np.zeros(n, dtype=np.float64)
+        for t in must_tags:
+            scores[self.docs_with(t)] += 3
+        for t in any_tags:
+            scores[self.docs_with(t)] += 1
+        return scores
+
+
+def build_tag_index(tags_v2) -> TagIndex:
+    if tags_v2 is None:
+        return TagIndex([])
+    return TagIndex([frozenset(parse_tags_any_format(x)) for x in tags_v2])
+
+
+# KB dạng tuple thô (không qua kb_registry) → cache index theo cột tags_v2.
+# Giữ tham chiếu tới cột để id() không bị tái sử dụng.
+_ADHOC_INDEXES: Dict[int, tuple] = {}
+_ADHOC_MAX = 4
+
+
+def get_tag_index(kb) -> TagIndex:
+    idx = getattr(kb, "tag_index", None)
+    if idx is not None:
+        return idx
+
+    TAGS_V2 = kb[7] if len(kb) >= 9 else None
+    if TAGS_V2 is None:
+        return TagIndex([])
+
+    key = id(TAGS_V2)
+    cached = _ADHOC_INDEXES.get(key)
+    if cached is not None and cached[0] is TAGS_V2:
+        return cached[1]
+
+    idx = build_tag_index(TAGS_V2)
+    if len(_ADHOC_INDEXES) >= _ADHOC_MAX:
+        _ADHOC_INDEXES.pop(next(iter(_ADHOC_INDEXES)))
+    _ADHOC_INDEXES[key] = (TAGS_V2, idx)
+    return idx
@@ -0,0 +1,287 @@
+"""
+Benchmark + golden regression cho rag/tag_filter.py.
+
+Chạy từ thư mục gốc repo:
+    python -m run.bench_tag_filter                  # so với golden + benchmark
+    python -m run.bench_tag_filter --update-golden  # sinh lại corpus + golden (khi đổi alias/ontology có chủ đích)
+    python -m run.bench_tag_filter --check-only     # chỉ so golden (exit 1 nếu lệch)
+
+Corpus (lưu luôn trong file golden để lần chạy sau dùng đúng bộ query đó):
+- câu hỏi thật: run/questions.txt + câu hỏi / alt question trong KB
+- câu hỏi sinh từ template nông nghiệp (có dấu) ghép alias crop/pest/disease/weed/chemical/product
+- mã sản phẩm kiểu "ANKAMEC 3.6EC", "Bpsaco 50EC"
+- bản không dấu của mọi câu trên
+
+Golden = hash của (must, any) cho từng query → tối ưu matcher/index nào cũng phải ra
+đúng cùng tập tag.
+
+FUZZY_CASES: regression cho sửa chính tả cục bộ (fuzzy_normalize với từ vựng của KB).
+"""
+import gc
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import tracemalloc
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+from rag import tag_filter as tf
+
+BASE_DIR = Path(__file__).resolve().parent
+ROOT_DIR = BASE_DIR.parent
+QUESTIONS_TXT = BASE_DIR / "questions.txt"
+GOLDEN_PATH = BASE_DIR / "tag_filter_golden.json"
+DEFAULT_KB = ROOT_DIR / "data-kd-1-4-1-2-2026-focus-product.npz"
+
+TEMPLATES = [
+    "Thuốc nào trị {disease} trên {crop}?",
+    "Cây {crop} bị {disease} thì xử lý thế nào?",
+    "{product} có trừ được {pest} trên {crop} không?",
+    "Liều lượng {product} cho {crop} là bao nhiêu?",
+    "Hoạt chất {chemical} có pha chung với {product} được không?",
+    "Cỏ {weed} trong ruộng {crop} dùng thuốc gì?",
+    "Công thức trị {pest} cho {crop} giai đoạn ra hoa",
+    "Sản phẩm {code} dùng cho {crop} được không?",
+    "{code} phun {pest} liều bao nhiêu ml/bình 25 lít?",
+    "Bên em có sp nào chứa {chemical} trị {pest} không ạ",
+    "{chemical} dạng {formulation} có lưu dẫn mạnh không?",
+    "Thời điểm phun {product} trên {crop} tốt nhất là khi nào?",
+]
+
+
+def strip_accents(text: str) -> str:
+    text = text.replace("đ", "d").replace("Đ", "D")
+    text = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+
+
+def _variants(aliases):
+    return [v.strip() for vs in aliases.values() for v in vs if v and v.strip()]
+
+
+def _product_codes(rng):
+    codes = []
+    for key in tf.PRODUCT_ALIASES:
+        parts = key.split("-")
+        code = " ".join(parts)
+        codes.append(code.upper())
+        codes.append(" ".join(p.capitalize() for p in parts))
+        if len(parts) > 1:
+            codes.append(parts[0].capitalize() + " " + "".join(parts[1:]).upper())
+    rng.shuffle(codes)
+    return codes
+
+
+def build_corpus(num_queries: int, kb_path=None, seed: int = 0):
+    rng = random.Random(seed)
+
+    real = []
+    if QUESTIONS_TXT.exists():
+        real += [q.strip() for q in QUESTIONS_TXT.read_text(encoding="utf-8").splitlines()
+                 if q.strip() and not q.startswith("#")]
+    if kb_path is not None and Path(kb_path).exists():
+        from rag.kb_loader import load_kb
+
+        kb = load_kb(kb_path)
+        for col in (kb[1], kb[3]):
+            if col is not None:
+                real += [str(q).strip() for q in col if q and str(q).strip()]
+
+    pools = {
+        "crop": _variants(tf.CROP_ALIASES),
+        "disease": _variants(tf.DISEASE_ALIASES),
+        "pest": _variants(tf.PEST_ALIASES),
+        "weed": _variants(tf.WEED_ALIASES),
+        "chemical": _variants(tf.CHEMICAL_ALIASES),
+        "product": _variants(tf.PRODUCT_ALIASES),
+        "formulation": _variants(tf.FORMULATION_ALIASES),
+        "code": _product_codes(rng),
+    }
+
+    generated = []
+    while len(generated) + len(real) < num_queries:
+        tpl = rng.choice(TEMPLATES)
+        generated.append(tpl.format(**{k: rng.choice(v) for k, v in pools.items()}))
+
+    corpus = list(dict.fromkeys(real + generated))
+    corpus += [strip_accents(q) for q in corpus]
+    corpus = list(dict.fromkeys(corpus))
+    rng.shuffle(corpus)
+    return corpus[:num_queries]
+
+# (query, text mong đợi khi sửa cục bộ confident) — None: không được confident (phải qua LLM)
+FUZZY_CASES = [
+    ("chiết cành sầu riêng bị thối rễ", None),             # "chiết" không được thành "chết"
+    ("sầu riêng chiết cành có bị nấm hồng không", None),
+    ("chiet canh sau rieng bi thoi re", None),
+    ("metalaxi trị sương mai trên lúa", "metalaxyl trị sương mai trên lúa"),
+    ("mancozep phun lúa được không", "mancozeb phun lúa được không"),
+    ("Mancozep + metalaxi phun sầu riêng", "Mancozeb + metalaxyl phun sầu riêng"),
+]
+
+
+def tags_digest(result) -> str:
+    payload = json.dumps([sorted(result["must"]), sorted(result["any"])], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+# ===========================
+# Golden
+# ===========================
+
+def write_golden(corpus, path=GOLDEN_PATH):
+    tf.clear_tag_cache()
+    golden = {
+        "ontology_version": tf.ontology_version(),
+        "num_queries": len(corpus),
+        "queries": [[q, tags_digest(tf.tag_filter_pipeline(q))] for q in corpus],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(golden, f, ensure_ascii=False, indent=0)
+    print(f"[GOLDEN] wrote {len(corpus)} queries -> {path}")
+
+
+def check_golden(path=GOLDEN_PATH) -> bool:
+    with open(path, "r", encoding="utf-8") as f:
+        golden = json.load(f)
+
+    tf.clear_tag_cache()
+    mismatches = []
+    for q, digest in golden["queries"]:
+        res = tf.tag_filter_pipeline(q)
+        if tags_digest(res) != digest:
+            mismatches.append((q, res))
+
+    print(f"[GOLDEN] {len(golden['queries']) - len(mismatches)}/{len(golden['queries'])} identical "
+          f"(golden ontology {golden.get('ontology_version')}, current {tf.ontology_version()})")
+    for q, res in mismatches[:10]:
+        print("  MISMATCH:", q)
+        print("    must:", res["must"])
+        print("    any :", res["any"])
+    if mismatches and golden.get("ontology_version") != tf.ontology_version():
+        print("  (ontology/alias tables changed since golden was written — "
+              "re-run with --update-golden if the new tags are intended)")
+    return not mismatches
+
+
+def check_fuzzy(kb_path) -> bool:
+    from rag.kb_registry import kb_registry
+    from rag.normalize import kb_words, kb_surface_forms
+
+    kb = kb_registry.load(kb_path)
+    words, surface = kb_words(kb), kb_surface_forms(kb)
+    failures = []
+    for q, expected in FUZZY_CASES:
+        res = tf.fuzzy_normalize(q, known_words=words, surface_forms=surface)
+        got = res["text"] if res["confident"] else None
+        if got != expected:
+            failures.append((q, expected, res))
+
+    print(f"[FUZZY] {len(FUZZY_CASES) - len(failures)}/{len(FUZZY_CASES)} cases OK")
+    for q, expected, res in failures:
+        print("  FAIL:", q)
+        print("    expected:", expected)
+        print("    got     :", res["text"] if res["confident"] else None, res["corrections"], res["unresolved"])
+    return not failures
+
+
+# ===========================
+# Benchmark
+# ===========================
+
+def _timed(fn, inputs):
+    lat = np.empty(len(inputs), dtype=np.float64)
+    t_all = time.perf_counter()
+    for i, x in enumerate(inputs):
+        t0 = time.perf_counter()
+        fn(x)
+        lat[i] = time.perf_counter() - t0
+    total = time.perf_counter() - t_all
+    return total, lat
+
+
+def _allocations(fn, inputs):
+    """peak KB / call (bộ nhớ tạm tracemalloc) + net block còn giữ lại / call (cache, index...)."""
+    gc.collect()
+    blocks0 = sys.getallocatedblocks()
+    tracemalloc.start()
+    peaks = np.zeros(max(1, len(inputs)), dtype=np.int64)
+    for i, x in enumerate(inputs):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        fn(x)
+        peaks[i] = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    gc.collect()
+    net_blocks = (sys.getallocatedblocks() - blocks0) / max(1, len(inputs))
+    return float(np.mean(peaks)) / 1024, net_blocks
+
+
+def bench(name, fn, inputs, alloc_sample: int, before=None):
+    if before:
+        before()
+    total, lat = _timed(fn, inputs)
+    if before:
+        before()
+    peak_kb, net_blocks = _allocations(fn, inputs[:alloc_sample])
+    return {
+        "name": name,
+        "n": len(inputs),
+        "qps": len(inputs) / total if total else float("inf"),
+        "p50_ms": float(np.percentile(lat, 50)) * 1000,
+        "p99_ms": float(np.percentile(lat, 99)) * 1000,
+        "peak_kb": peak_kb,
+        "net_blocks": net_blocks,
+    }
+
+
+def run_benchmarks(corpus, alloc_sample: int = 500):
+    onto = tf.get_ontology()
+    norms = [tf.normalize(q) for q in corpus]
+    hits = [onto.entity_matcher.match(n) for n in norms]
+    infer_inputs = [(h["crop"], h["disease"], h["pest"]) for h in hits]
+
+    rows = [
+        bench("match_aliases[pest]", lambda q: tf.match_aliases(q, tf.PEST_ALIASES, tf.normalize_entity),
+              norms, alloc_sample),
+        bench("entity_matcher.match", onto.entity_matcher.match, norms, alloc_sample),
+        bench("infer_chemicals_from_kb", lambda x: tf.infer_chemicals_from_kb(*x), infer_inputs, alloc_sample),
+        bench("extract_tags", tf.extract_tags, norms, alloc_sample),
+        bench("tag_filter_pipeline(cold)", tf.tag_filter_pipeline, corpus, alloc_sample, before=tf.clear_tag_cache),
+        bench("tag_filter_pipeline(warm)", tf.tag_filter_pipeline, corpus, alloc_sample),
+        bench("fuzzy_normalize", tf.fuzzy_normalize, corpus, alloc_sample),
+    ]
+
+    print(f"\n[BENCH] {len(corpus)} queries, ontology {tf.ontology_version()}")
+    print(f"{'stage':<28} {'q/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'peak KB':>9} {'net blk':>8}")
+    for r in rows:
+        print(f"{r['name']:<28} {r['qps']:>10.0f} {r['p50_ms']:>9.3f} {r['p99_ms']:>9.3f} "
+              f"{r['peak_kb']:>9.1f} {r['net_blocks']:>8.2f}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="tag_filter benchmark + golden output regression")
+    parser.add_argument("--update-golden", action="store_true", help="regenerate corpus and golden digests")
+    parser.add_argument("--check-only", action="store_true", help="only run the golden check")
+    parser.add_argument("--queries", type=int, default=3000, help="corpus size for --update-golden")
+    parser.add_argument("--kb", default=str(DEFAULT_KB), help="KB whose questions seed the corpus")
+    parser.add_argument("--alloc-sample", type=int, default=500, help="queries traced for allocation stats")
+    args = parser.parse_args()
+
+    if args.update_golden or not GOLDEN_PATH.exists():
+        write_golden(build_corpus(args.queries, args.kb))
+
+    ok = check_golden()
+    ok &= check_fuzzy(args.kb)
+    if not args.check_only:
+        with open(GOLDEN_PATH, "r", encoding="utf-8") as f:
+            corpus = [q for q, _ in json.load(f)["queries"]]
+        run_benchmarks(corpus, args.alloc_sample)
+
+    sys.exit(0 if ok else 1)
@@ -1,4 +1,4 @@
-from openai import OpenAI
+from rag.llm_client import get_client
 from rag.config import RAGConfig
 from rag.kb_loader import load_npz
 from rag.logging.logger_csv import append_log_to_csv
@@ -37,8 +37,8 @@ def iter_questions(txt_path: str):
 def run_batch_questions(KB, API_KEY):
     # 1) đọc query từ CLI
 
-    # 2) init OpenAI client (đặt key theo env là tốt nhất)
-    client = OpenAI(api_key=API_KEY)
+    # 2) client OpenAI dùng chung (pool + keep-alive; đặt key theo env là tốt nhất)
+    client = get_client(api_key=API_KEY)
 
     # 3) load KB (1 lần)
     # kb = load_npz("data-kd-nam-benh-full-fix-noise.npz")
@@ -73,8 +73,8 @@ def run_batch_questions(KB, API_KEY):
 def main(KB, API_KEY):
     # 1) đọc query từ CLI
 
-    # 2) init OpenAI client (đặt key theo env là tốt nhất)
-    client = OpenAI(api_key=API_KEY)
+    # 2) client OpenAI dùng chung (pool + keep-alive; đặt key theo env là tốt nhất)
+    client = get_client(api_key=API_KEY)
 
     # 3) load KB (1 lần)
     # kb = load_npz("data-kd-nam-benh-full-fix-noise.npz")
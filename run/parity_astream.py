@@ -0,0 +1,372 @@
+"""
+So khớp answer_with_suggestions_astream (async) với answer_with_suggestions_stream (sync)
+trên 1 fake OpenAI server chạy local (không cần API key / mạng).
+
+Chạy từ thư mục gốc repo:
+    python -m run.parity_astream                        # parity sync vs async
+    python -m run.parity_astream --concurrency 200 --latency 0.2   # thêm tải: N stream async cùng lúc
+
+Fake server trả lời tất định theo nội dung request (sha1 của messages / input):
+- /v1/embeddings: vector ngẫu nhiên seed theo text
+- /v1/chat/completions: JSON (response_format json_object), list FACT (summarize memory),
+  echo câu user (rewrite / normalize), hoặc SSE stream cho câu trả lời cuối
+Parity = cùng chuỗi token yield ra cho từng lượt + cùng multiset request gửi tới server.
+"""
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_KB = ROOT_DIR / "data-kd-1-4-1-2-2026-focus-product.npz"
+EMBED_DIM = 1536
+RETURNING = 2    # --coalesce: số user đã có memory (khác nhau) hỏi thêm mỗi câu
+
+CONVERSATIONS = [
+    ["thuốc trị rầy nâu trên lúa", "liều lượng pha bao nhiêu?"],
+    ["hoạt chất abamectin là gì"],
+    ["công thức lưu dẫn + tiếp xúc trị cỏ"],
+    ["bệnh đạo ôn trên lúa xử lý thế nào", "phun lúc nào thì tốt?"],
+    ["cty có sản phẩm nào trị sâu cuốn lá không"],
+]
+
+
+# ===========================
+# Fake OpenAI server
+# ===========================
+
+def _digest(obj) -> str:
+    return hashlib.sha1(json.dumps(obj, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class FakeOpenAI(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"     # keep-alive như API thật (stream thì đóng kết nối)
+    latency = 0.0
+    log = []
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with self.lock:
+            self.log.append((self.path, _digest(req)))
+        if self.latency:
+            time.sleep(self.latency)
+        if self.path.endswith("/embeddings"):
+            return self._embeddings(req)
+        if self.path.endswith("/chat/completions"):
+            return self._chat(req)
+        self.send_error(404)
+
+    def _embeddings(self, req):
+        inputs = req.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+        data = []
+        for i, text in enumerate(inputs):
+            seed = int(hashlib.sha1(str(text).encode("utf-8")).hexdigest()[:8], 16)
+            vec = np.random.default_rng(seed).standard_normal(EMBED_DIM).astype(np.float32)
+            data.append({"object": "embedding", "index": i, "embedding": vec.tolist()})
+        self._json({"object": "list", "data": data, "model": req.get("model"),
+                    "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+    def _chat(self, req):
+        messages = req.get("messages") or []
+        d = _digest(messages)[:8]
+        user_msg = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+
+        if any("FACT" in str(m.get("content", "")) for m in messages):
+            content = json.dumps([{"type": "profile", "fact": f"fact-{d}", "confidence": 0.9}])
+        elif (req.get("response_format") or {}).get("type") == "json_object":
+            content = json.dumps({
+                "primary_target": f"target-{d}",
+                "fallback_targets": [],
+                "missing_slots": ["need_pesticide", "need_timing"] if int(d, 16) % 2 else [],
+                "need_next_hop": False,
+                "next_query": "",
+                "reason": "",
+            })
+        else:
+            content = str(user_msg)[:200]
+
+        if req.get("stream"):
+            return self._stream(req, f"Trả lời {d}: " + content[:80])
+        self._json({
+            "id": f"chatcmpl-{d}", "object": "chat.completion", "created": 0, "model": req.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    def _stream(self, req, text):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.close_connection = True
+        self.end_headers()
+        for word in text.split(" "):
+            chunk = {
+                "id": "chatcmpl-stream", "object": "chat.completion.chunk", "created": 0,
+                "model": req.get("model"),
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_server(latency: float):
+    FakeOpenAI.latency = latency
+    ThreadingHTTPServer.request_queue_size = 1024    # --concurrency mở nhiều kết nối cùng lúc
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenAI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+# ===========================
+# Parity
+# ===========================
+
+def reset_caches():
+    from rag.embedder import embedding_cache
+    from rag.retrieval_cache import retrieval_cache
+    from rag.llm_cache import llm_cache
+    from rag.post_answer import solution_completion
+
+    embedding_cache.mem.clear()
+    retrieval_cache.clear()
+    llm_cache.mem.clear()
+    solution_completion._SLOT_INDEXES.clear()
+    FakeOpenAI.log.clear()
+
+
+def run_sync(base_url, kb):
+    from openai import OpenAI
+    from rag.pipeline import answer_with_suggestions_stream
+    from rag.stage_graph import wait_background
+
+    client = OpenAI(base_url=base_url, api_key="parity")
+    out = []
+    for i, turns in enumerate(CONVERSATIONS):
+        for q in turns:
+            toks = list(answer_with_suggestions_stream(
+                user_id=f"sync-{i}", user_query=q, kb=kb, client=client, cfg=None, policy=None,
+            ))
+            wait_background()   # chờ ghi memory nền
+            out.append(toks)
+    return out
+
+
+async def run_async(base_url, kb):
+    from rag.llm_client import get_async_client
+    from rag.pipeline import answer_with_suggestions_astream
+    from rag.stage_graph import wait_background
+
+    aclient = get_async_client(base_url=base_url, api_key="parity")
+    out = []
+    for i, turns in enumerate(CONVERSATIONS):
+        for q in turns:
+            toks = [tok async for tok in answer_with_suggestions_astream(
+                user_id=f"async-{i}", user_query=q, kb=kb, cfg=None, policy=None, aclient=aclient,
+            )]
+            await asyncio.to_thread(wait_background)
+            out.append(toks)
+    return out
+
+
+async def run_concurrent(base_url, kb, n: int):
+    from rag.llm_client import get_async_client
+    from rag.pipeline import answer_with_suggestions_astream
+    from rag.stage_graph import wait_background
+
+    aclient = get_async_client(base_url=base_url, api_key="parity")
+    queries = [q for turns in CONVERSATIONS for q in turns]
+    peak_threads = 0
+
+    async def one(j):
+        nonlocal peak_threads
+        n_tok = 0
+        async for _ in answer_with_suggestions_astream(
+            user_id=f"load-{j}", user_query=queries[j % len(queries)], kb=kb, cfg=None, policy=None,
+            aclient=aclient,
+        ):
+            n_tok += 1
+            peak_threads = max(peak_threads, threading.active_count())
+        return n_tok
+
+    t0 = time.perf_counter()
+    counts = await asyncio.gather(*(one(j) for j in range(n)))
+    await asyncio.to_thread(wait_background)   # memory nền vẫn cần loop
+    return time.perf_counter() - t0, peak_threads, counts
+
+
+def run_coalesced(base_url, kb, n: int):
+    """
+    n user hỏi cùng lúc mỗi câu trong CONVERSATIONS (lượt đầu) qua bản coalesced, cùng
+    RETURNING user đã có memory riêng (dùng chung bước chuẩn bị, generate riêng):
+    → token mỗi user == bản không gộp, mỗi user có lượt hội thoại riêng, ít request hơn.
+    """
+    from openai import OpenAI
+    from concurrent.futures import ThreadPoolExecutor
+    from rag.pipeline import (
+        answer_with_suggestions_stream, answer_with_suggestions_stream_coalesced, coalesce_stats,
+    )
+    from rag.conversation_state import conversation_state
+    from rag.memory.memory_store import memory_store
+    from rag.stage_graph import wait_background
+
+    client = OpenAI(base_url=base_url, api_key="parity")
+    queries = [turns[0] for turns in CONVERSATIONS]
+    ok = True
+    diffs = []
+
+    def remember(user_id, j):
+        memory_store.add(user_id, np.ones(EMBED_DIM, dtype=np.float32), {"fact": f"returning-{j}"})
+
+    expected = {}
+    reset_caches()
+    for q in queries:
+        expected[q] = list(answer_with_suggestions_stream(
+            user_id=f"solo-{q}", user_query=q, kb=kb, client=client, cfg=None, policy=None,
+        ))
+        for j in range(RETURNING):
+            remember(f"solo-back-{j}-{q}", j)
+            expected[q, j] = list(answer_with_suggestions_stream(
+                user_id=f"solo-back-{j}-{q}", user_query=q, kb=kb, client=client, cfg=None, policy=None,
+            ))
+    wait_background()
+    solo_requests = len(FakeOpenAI.log)
+
+    reset_caches()
+    jobs = [(f"burst-{j}-{q}", q, q) for j in range(n) for q in queries]
+    for q in queries:
+        for j in range(RETURNING):
+            remember(f"back-{j}-{q}", j)
+            jobs.append((f"back-{j}-{q}", q, (q, j)))
+
+    def one(job):
+        user_id, q, expect_key = job
+        return user_id, expect_key, list(answer_with_suggestions_stream_coalesced(
+            user_id=user_id, user_query=q, kb=kb, client=client, cfg=None, policy=None,
+        ))
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        results = list(pool.map(one, jobs))
+    secs = time.perf_counter() - t0
+    wait_background()
+    answer_requests = sum(1 for path, _ in FakeOpenAI.log if path.endswith("/chat/completions"))
+
+    for user_id, expect_key, toks in results:
+        same = toks == expected[expect_key]
+        turns = conversation_state.get_turns(user_id)
+        ok &= same and len(turns) == 2
+        if not same or len(turns) != 2:
+            diffs.append(f"[DIFF] {user_id}: tokens {'OK' if same else 'DIFF'}, turns {len(turns)}")
+    summary = (f"[COALESCE] {len(jobs)} requests ({n} new + {RETURNING} returning users × "
+               f"{len(queries)} questions) in {secs:.2f}s: "
+               f"server requests {len(FakeOpenAI.log)} (chat {answer_requests}) vs {solo_requests} for "
+               f"{len(queries) * (1 + RETURNING)} solo runs, {coalesce_stats()}")
+    return ok, "\n".join(diffs + [summary])
+
+
+def main():
+    import io
+    import contextlib
+
+    parser = argparse.ArgumentParser(description="parity sync vs async pipeline trên fake OpenAI server")
+    parser.add_argument("--kb", default=str(DEFAULT_KB))
+    parser.add_argument("--latency", type=float, default=0.0, help="độ trễ giả lập mỗi request (giây)")
+    parser.add_argument("--concurrency", type=int, default=0, help="số stream async chạy đồng thời (0 → bỏ qua)")
+    parser.add_argument("--coalesce", type=int, default=0,
+                        help="số user hỏi cùng lúc mỗi câu qua bản coalesced (0 → bỏ qua)")
+    parser.add_argument("--verbose", action="store_true", help="không ẩn log của pipeline")
+    args = parser.parse_args()
+
+    from rag.config import RAGConfig
+    from rag.kb_registry import kb_registry
+    from rag.embedder import embedding_cache
+    from rag.llm_cache import llm_cache
+
+    RAGConfig.enable_timing_log = False
+    embedding_cache.disk = None           # 2 lượt chạy phải gọi embeddings / LLM helper như nhau
+    llm_cache.disk = None
+    kb = kb_registry.load(args.kb)
+
+    server, base_url = start_server(args.latency)
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    reset_caches()
+    with quiet:
+        t0 = time.perf_counter()
+        sync_out = run_sync(base_url, kb)
+        sync_secs = time.perf_counter() - t0
+    sync_log = Counter(FakeOpenAI.log)
+
+    reset_caches()
+    with quiet:
+        t0 = time.perf_counter()
+        async_out = asyncio.run(run_async(base_url, kb)) if args.concurrency == 0 else None
+        async_secs = time.perf_counter() - t0
+    async_log = Counter(FakeOpenAI.log)
+
+    ok = True
+    if async_out is not None:
+        turns = [q for t in CONVERSATIONS for q in t]
+        for q, a, b in zip(turns, sync_out, async_out):
+            same = a == b
+            ok &= same
+            print(f"[{'OK' if same else 'DIFF'}] {q!r}: {len(a)} tokens")
+            if not same:
+                print("   sync :", "".join(a)[-120:])
+                print("   async:", "".join(b)[-120:])
+        same_calls = sync_log == async_log
+        ok &= same_calls
+        print(f"[{'OK' if same_calls else 'DIFF'}] requests to server: sync {sum(sync_log.values())}, "
+              f"async {sum(async_log.values())}")
+        if not same_calls:
+            print("   only sync :", sorted((sync_log - async_log).items())[:5])
+            print("   only async:", sorted((async_log - sync_log).items())[:5])
+        print(f"[TIME] sync {sync_secs:.2f}s, async {async_secs:.2f}s")
+
+    if args.concurrency:
+        with quiet:
+            secs, peak_threads, counts = asyncio.run(run_concurrent(base_url, kb, args.concurrency))
+        print(f"[LOAD] {args.concurrency} concurrent streams in {secs:.2f}s "
+              f"(latency {args.latency}s/request), peak threads {peak_threads}, "
+              f"min tokens/stream {min(counts)}")
+
+    if args.coalesce:
+        with quiet:
+            coalesce_ok, summary = run_coalesced(base_url, kb, args.coalesce)
+        print(summary)
+        ok &= coalesce_ok
+        print(f"[{'OK' if coalesce_ok else 'DIFF'}] coalesced answers identical, per-user turns recorded")
+
+    from rag.llm_client import pool_stats
+    print("[POOL]", json.dumps(pool_stats().get("async"), ensure_ascii=False))
+
+    server.shutdown()
+    print("PARITY OK" if ok else "PARITY FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()